@@ -0,0 +1,399 @@
+import heapq
+import json
+import logging
+import math
+import os
+import re
+import sys
+import time
+from abc import ABC, abstractmethod
+from array import array
+
+from .dedup import MASK_64, _mix64
+
+logger = logging.getLogger(__name__)
+
+# Hashtags and mentions are found in the texts, as the fast parsing path does not decode the entities
+ENTITY_PATTERN = re.compile(r'(?<!\w)([#@])(\w+)')
+# Placeholders of the output filename templates (see writers.window_filename and matcher.route_filename)
+PLACEHOLDER_PATTERN = re.compile(r'[-_.]?\{\w+\}')
+# Filename part of the aggregates snapshot
+AGGREGATES_NAME = '_aggregates'
+# Number of the top items per kind written to a snapshot
+TOP_ITEMS = 100
+
+
+class BaseHeavyHitters(ABC):
+    """
+    Base class of the bounded-memory top-k counters. At most `size` items are monitored, each with its count and
+    the max overestimation of that count (error). The monitored items are kept in a lazy min-heap: counts only grow,
+    so a heap entry may be lower than the current count and is fixed once it reaches the top.
+    """
+
+    def __init__(self, size=1000, **kwargs):
+        """
+        Args:
+            size: max number of monitored items
+        """
+        self.size = size
+        # item -> [count, error]
+        self.counts = {}
+        # (count at the push, item) per monitored item
+        self._heap = []
+        # number of added items
+        self.total = 0
+
+    @abstractmethod
+    def add(self, item):
+        """
+        Count an item occurrence
+
+        Args:
+            item: hashable item (a string)
+
+        Returns:
+            int, estimated count of the item
+        """
+        raise NotImplementedError('Method not implemented')
+
+    @abstractmethod
+    def memory_usage(self):
+        """
+        Returns:
+            int, approximate number of bytes used by the counter
+        """
+        raise NotImplementedError('Method not implemented')
+
+    def _min_count(self):
+        """
+        Returns:
+            int, the smallest count of the monitored items (its heap entry is at the top)
+        """
+        heap = self._heap
+        counts = self.counts
+        while True:
+            count, item = heap[0]
+            current = counts[item][0]
+            if current == count:
+                return count
+            heapq.heapreplace(heap, (current, item))
+
+    def _monitor(self, item, count, error):
+        self.counts[item] = [count, error]
+        heapq.heappush(self._heap, (count, item))
+
+    def _evict(self):
+        """
+        Stop monitoring the item with the smallest count
+
+        Returns:
+            int, its count
+        """
+        count = self._min_count()
+        _, item = heapq.heappop(self._heap)
+        del self.counts[item]
+        return count
+
+    def error_bound(self, item):
+        return self.counts[item][1]
+
+    def top(self, count=TOP_ITEMS):
+        """
+        Args:
+            count: number of items
+
+        Returns:
+            list of (item, count, error) tuples ordered by the count (descending)
+        """
+        items = heapq.nlargest(count, self.counts.items(), key=lambda item: item[1][0])
+        return [(item, item_count, self.error_bound(item)) for item, (item_count, _) in items]
+
+    def __contains__(self, item):
+        return item in self.counts
+
+    def __len__(self):
+        return len(self.counts)
+
+    def _monitored_memory_usage(self):
+        # a two item list per monitored item and a two item tuple per heap entry
+        return (sys.getsizeof(self.counts) + sys.getsizeof(self._heap) +
+                len(self.counts) * (sys.getsizeof([0, 0]) + sys.getsizeof((0, 0))))
+
+
+class SpaceSaving(BaseHeavyHitters):
+    """
+    Space-Saving (Metwally et al.): a new item replaces the monitored item with the smallest count and inherits that
+    count as its error. Every item occurring more than total / size times is monitored, and no count is overestimated
+    by more than total / size.
+    """
+
+    def add(self, item):
+        self.total += 1
+        entry = self.counts.get(item)
+        if entry is not None:
+            entry[0] += 1
+            return entry[0]
+        error = self._evict() if len(self.counts) >= self.size else 0
+        self._monitor(item, error + 1, error)
+        return error + 1
+
+    def memory_usage(self):
+        return self._monitored_memory_usage()
+
+
+class CountMinSketch(BaseHeavyHitters):
+
+    def __init__(self, size=1000, width=8192, depth=4, **kwargs):
+        """
+        Count-Min sketch with conservative updates, plus the `size` items of the highest estimates. Estimates are
+        never lower than the true counts and exceed them by at most e / width * total with the probability
+        of 1 - e^-depth (the reported error is that bound).
+
+        Args:
+            size: max number of monitored items
+            width: number of counters per row
+            depth: number of rows (hash functions)
+        """
+        super().__init__(size)
+        self.width = width
+        self.depth = depth
+        self.cells = array('Q', bytes(8 * width * depth))
+        # first cell of every row
+        self._offsets = [row * width for row in range(depth)]
+
+    def add(self, item):
+        self.total += 1
+        # double hashing, as the Bloom filter of the deduplicator does
+        first = _mix64(hash(item) & MASK_64)
+        second = first >> 32 | 1
+        width = self.width
+        cells = self.cells
+        positions = self._offsets.copy()
+        estimate = None
+        for row in range(self.depth):
+            position = positions[row] + (first + row * second) % width
+            positions[row] = position
+            if estimate is None or cells[position] < estimate:
+                estimate = cells[position]
+        estimate += 1
+        for position in positions:
+            if cells[position] < estimate:
+                cells[position] = estimate
+
+        entry = self.counts.get(item)
+        if entry is not None:
+            entry[0] = estimate
+        elif len(self.counts) < self.size:
+            self._monitor(item, estimate, 0)
+        elif estimate > self._min_count():
+            self._evict()
+            self._monitor(item, estimate, 0)
+        return estimate
+
+    def error_bound(self, item):
+        return math.ceil(math.e / self.width * self.total)
+
+    def memory_usage(self):
+        return self._monitored_memory_usage() + self.cells.itemsize * len(self.cells)
+
+
+HEAVY_HITTERS = {
+    'space-saving': SpaceSaving,
+    'count-min': CountMinSketch,
+}
+
+
+def create_heavy_hitters(name='space-saving', **kwargs):
+    """
+    Instantiate a top-k counter by its name
+
+    Args:
+        name: one of HEAVY_HITTERS keys
+        kwargs: counter parameters (size, width, depth); irrelevant ones are ignored
+
+    Returns:
+        BaseHeavyHitters instance
+    """
+    if name not in HEAVY_HITTERS:
+        raise ValueError(f'Unknown heavy hitters algorithm: {name}')
+    return HEAVY_HITTERS[name](**{key: value for key, value in kwargs.items() if value is not None})
+
+
+class RateCounter:
+
+    def __init__(self, window=60, windows=60):
+        """
+        Tweet counts of the tumbling windows of the tweet creation time (e.g. tweets per minute). Only the last
+        `windows` windows are kept, the tweets created before them are counted as late.
+
+        Args:
+            window: window length in seconds
+            windows: number of the kept windows
+        """
+        self.window = window
+        self.windows = windows
+        # window index (creation time // window) -> count
+        self.counts = {}
+        self.newest = None
+        self.late = 0
+
+    def add(self, created_at):
+        index = created_at // self.window
+        if self.newest is None or index > self.newest:
+            self.newest = index
+            oldest = index - self.windows + 1
+            for old_index in [old_index for old_index in self.counts if old_index < oldest]:
+                del self.counts[old_index]
+        elif index <= self.newest - self.windows:
+            self.late += 1
+            return
+        self.counts[index] = self.counts.get(index, 0) + 1
+
+    def snapshot(self):
+        """
+        Returns:
+            list of dicts with the window start (epoch seconds) and its tweets count, oldest first
+        """
+        return [{'start': index * self.window, 'tweets': count} for index, count in sorted(self.counts.items())]
+
+    def memory_usage(self):
+        return sys.getsizeof(self.counts) + len(self.counts) * 2 * sys.getsizeof(2 ** 62)
+
+
+def aggregates_filename(filename):
+    """
+    Build the filename of the aggregates snapshot next to the output: the placeholders of a template are dropped
+    and AGGREGATES_NAME is added to the base name (output.csv -> output-_aggregates.json)
+
+    Args:
+        filename: output filename (template)
+
+    Returns:
+        str, filename
+    """
+    directory, name = os.path.split(filename)
+    base = PLACEHOLDER_PATTERN.sub('', name.partition('.')[0]) or 'output'
+    return os.path.join(directory, f'{base}-{AGGREGATES_NAME}.json')
+
+
+class StreamAggregator:
+
+    def __init__(self, algorithm='space-saving', size=1000, top=TOP_ITEMS, rate_window=60, rate_windows=60,
+                 **kwargs):
+        """
+        Aggregates the accepted tweets in a fixed memory regardless of the stream length: the most active users,
+        the most used hashtags and the most mentioned users (a top-k counter each) and the tweets per tumbling
+        window of the creation time. Hashtags and mentions are case-insensitive.
+
+        Args:
+            algorithm: top-k counter name (see HEAVY_HITTERS)
+            size: number of the items monitored per kind
+            top: number of the top items per kind in a snapshot
+            rate_window: rate window length in seconds
+            rate_windows: number of the rate windows kept
+            kwargs: other top-k counter parameters (width, depth)
+        """
+        self.algorithm = algorithm
+        self.size = size
+        self.top = top
+        self.users = create_heavy_hitters(algorithm, size=size, **kwargs)
+        self.hashtags = create_heavy_hitters(algorithm, size=size, **kwargs)
+        self.mentions = create_heavy_hitters(algorithm, size=size, **kwargs)
+        self.rates = RateCounter(rate_window, rate_windows)
+        # user ID -> screen name, pruned to the monitored users
+        self.screen_names = {}
+        self.tweets = 0
+
+    def add(self, tweet):
+        """
+        Aggregate an accepted tweet
+
+        Args:
+            tweet: models.Tweet instance (with its user)
+
+        Returns:
+            None
+        """
+        self.tweets += 1
+        user = tweet.user
+        self.users.add(user.id_str)
+        screen_names = self.screen_names
+        screen_names[user.id_str] = user.screen_name
+        if len(screen_names) > 2 * self.size:
+            self.screen_names = {id_str: name for id_str, name in screen_names.items() if id_str in self.users}
+
+        if tweet.text:
+            for sign, name in ENTITY_PATTERN.findall(tweet.text):
+                (self.hashtags if sign == '#' else self.mentions).add(name.lower())
+        self.rates.add(tweet.created_at)
+
+    def snapshot(self, final=False):
+        """
+        Args:
+            final: whether it is the snapshot of the end of the run
+
+        Returns:
+            dict, JSON-serializable snapshot of the aggregates
+        """
+        def items(counter, key):
+            return [{key: item, 'count': count, 'error': error} for item, count, error in counter.top(self.top)]
+
+        users = items(self.users, 'id_str')
+        for user in users:
+            user['screen_name'] = self.screen_names.get(user['id_str'])
+        return {
+            'generated_at': int(time.time()),
+            'final': final,
+            'algorithm': self.algorithm,
+            'size': self.size,
+            'tweets': self.tweets,
+            'users': users,
+            'hashtags': items(self.hashtags, 'hashtag'),
+            'mentions': items(self.mentions, 'screen_name'),
+            'rates': {'window_seconds': self.rates.window, 'windows': self.rates.snapshot(), 'late': self.rates.late},
+            'memory_bytes': self.memory_usage(),
+        }
+
+    def write(self, filename, final=False):
+        """
+        Write a snapshot to a JSON file. The file is replaced atomically, so a reader never sees a partial snapshot.
+
+        Args:
+            filename: path to the file
+            final: whether it is the snapshot of the end of the run
+
+        Returns:
+            dict, the snapshot
+        """
+        snapshot = self.snapshot(final)
+        tmp_filename = f'{filename}.{os.getpid()}.tmp'
+        with open(tmp_filename, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_filename, filename)
+        logger.info('Wrote the aggregates of %s tweets to "%s"', self.tweets, filename)
+        if final:
+            for kind, key in (('users', 'screen_name'), ('hashtags', 'hashtag'), ('mentions', 'screen_name')):
+                top = ', '.join(f"{item[key]} ({item['count']})" for item in snapshot[kind][:5])
+                logger.info('Top %s: %s', kind, top)
+        return snapshot
+
+    def memory_usage(self):
+        return (self.users.memory_usage() + self.hashtags.memory_usage() + self.mentions.memory_usage() +
+                self.rates.memory_usage() + sys.getsizeof(self.screen_names))
+
+
+def create_aggregator(algorithm='space-saving', **kwargs):
+    """
+    Instantiate a StreamAggregator
+
+    Args:
+        algorithm: top-k counter name (see HEAVY_HITTERS)
+        kwargs: aggregator and counter parameters (size, top, rate_window, rate_windows, width, depth), the ones set
+        to None are left default
+
+    Returns:
+        StreamAggregator instance
+    """
+    if algorithm not in HEAVY_HITTERS:
+        raise ValueError(f'Unknown heavy hitters algorithm: {algorithm}')
+    return StreamAggregator(algorithm, **{key: value for key, value in kwargs.items() if value is not None})
@@ -0,0 +1,248 @@
+import asyncio
+import logging
+import time
+import urllib.parse as urlparse
+
+import requests
+
+from .tweets_streamer import STABLE_CONNECTION_SECONDS, TweetsStreamer
+
+logger = logging.getLogger(__name__)
+
+
+class StreamStatusError(ConnectionError):
+
+    def __init__(self, status_code):
+        super().__init__(f'Stream responded with {status_code} status code')
+        self.status_code = status_code
+
+
+class AsyncTweetsStreamer(TweetsStreamer):
+
+    def __init__(self, api_key, api_secret_key, input_queue, stop_event, **kwargs):
+        """
+        AsyncTweetsStreamer reads the tweets stream on the asyncio event loop. The chunked HTTP response is read
+        from a non-blocking connection, so a single process can drive many streams. Dropped connections are
+        reconnected with the same backoff strategies and `max_reconnects` as TweetsStreamer (rejected credentials
+        are not renewed).
+
+        Args:
+            api_key: client API key
+            api_secret_key: client API secret key
+            input_queue: asyncio.Queue instance to put all messages from the stream
+            stop_event: asyncio.Event instance. Is set when either time is out or a message queue is full
+            kwargs: see TweetsStreamer
+        """
+        super().__init__(api_key, api_secret_key, None, input_queue, stop_event, **kwargs)
+
+    async def authenticate(self):
+        """
+        Authenticate application in the default executor (PIN flow is blocking)
+
+        Returns:
+            bool, True if the authentication succeeded
+        """
+        if self._started_at is None:
+            self._started_at = time.monotonic()
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, self._authenticate)
+        except Exception:
+            logger.exception('Authentication failed')
+            self.stop_event.set()
+            return False
+        return True
+
+    async def _open_stream(self, url, body):
+        """
+        Send a signed POST request and read the response status and headers
+
+        Args:
+            url: stream URL
+            body: request body
+
+        Returns:
+            tuple of StreamReader, StreamWriter and a dict of response headers
+
+        Raises:
+            StreamStatusError if the status code is not 200, OSError on the connection errors
+        """
+        request = requests.Request('POST', url, data=body, auth=self.auth).prepare()
+        parsed_url = urlparse.urlsplit(request.url)
+        is_https = parsed_url.scheme == 'https'
+        port = parsed_url.port or (443 if is_https else 80)
+        reader, writer = await asyncio.open_connection(parsed_url.hostname, port, ssl=is_https or None)
+
+        path = parsed_url.path + (f'?{parsed_url.query}' if parsed_url.query else '')
+        headers = {'Host': parsed_url.netloc, 'Connection': 'close', 'Accept-Encoding': 'identity'}
+        headers.update(request.headers)
+        head = f'POST {path} HTTP/1.1\r\n' + ''.join(f'{name}: {value}\r\n' for name, value in headers.items())
+        request_body = request.body or b''
+        if isinstance(request_body, str):
+            request_body = request_body.encode(self.encoding)
+        writer.write(head.encode('latin-1') + b'\r\n' + request_body)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        status = status_line.split(b' ', 2)
+        if len(status) < 2 or not status[1].isdigit():
+            writer.close()
+            raise ConnectionError(f'Invalid status line: {status_line!r}')
+        response_headers = {}
+        while True:
+            header_line = await reader.readline()
+            if header_line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = header_line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+
+        status_code = int(status[1])
+        if status_code != 200:
+            writer.close()
+            raise StreamStatusError(status_code)
+        return reader, writer, response_headers
+
+    @staticmethod
+    async def _read_chunks(reader, headers):
+        """
+        Read the response body, decoding the chunked transfer encoding if needed
+
+        Args:
+            reader: StreamReader instance
+            headers: dict of response headers
+
+        Returns:
+            yields body chunks
+        """
+        if headers.get('transfer-encoding', '').lower() != 'chunked':
+            while True:
+                chunk = await reader.read(65536)
+                if not chunk:
+                    return
+                yield chunk
+
+        while True:
+            size_line = await reader.readline()
+            if not size_line:
+                return
+            size = int(size_line.split(b';', 1)[0], 16)
+            if not size:
+                return
+            chunk = await reader.readexactly(size)
+            # skip CRLF after the chunk data
+            await reader.readexactly(2)
+            yield chunk
+
+    async def _connect(self, url, body):
+        """
+        Open a streaming connection
+
+        Args:
+            url: stream URL
+            body: request body
+
+        Returns:
+            tuple of the StreamReader, StreamWriter and response headers (None if the connection failed) and
+            the backoff strategy to apply on failure
+        """
+        try:
+            return await self._open_stream(url, body), None
+        except StreamStatusError as exc:
+            logger.error('%s', exc)
+            if exc.status_code in (420, 429):
+                return None, self.rate_limit_backoff
+            return None, self.http_backoff
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            logger.exception('Can not connect to the stream')
+            return None, self.network_backoff
+
+    async def _read_stream(self, url, body):
+        """
+        Read from stream and yield none-empty message (omitting ping-alive empty strings).
+        Reconnects with a backoff on the connection errors till the STOP event is set (see TweetsStreamer).
+
+        Args:
+            url: stream URL
+            body: request body
+
+        Returns:
+            yields messages
+        """
+        logger.info('Reading from stream...')
+        attempts = 0
+        disconnected_at = None
+        try:
+            while not self.stop_event.is_set():
+                connection, backoff = await self._connect(url, body)
+                if connection is not None:
+                    if disconnected_at is not None:
+                        self.disconnected_seconds += time.monotonic() - disconnected_at
+                        disconnected_at = None
+                        logger.info('Reconnected to the stream')
+                    reader, writer, headers = connection
+                    connected_at = time.monotonic()
+                    stable = False
+                    pending = b''
+                    try:
+                        async for chunk in self._read_chunks(reader, headers):
+                            *lines, pending = (pending + chunk).split(b'\n')
+                            for line in lines:
+                                if self.stop_event.is_set():
+                                    logger.info('Exiting the stream')
+                                    return
+                                line = line.rstrip(b'\r')
+                                if not stable and (line or
+                                                   time.monotonic() - connected_at >= STABLE_CONNECTION_SECONDS):
+                                    stable = True
+                                    attempts = 0
+                                    self._reset_backoff()
+                                # filter out 'keep-alive' empty lines
+                                if line:
+                                    self._observe_line(line)
+                                    yield line
+                        logger.warning('Stream is closed by the server')
+                    except (OSError, asyncio.IncompleteReadError, ValueError):
+                        logger.exception('Stream is interrupted')
+                    finally:
+                        writer.close()
+                    backoff = self.network_backoff
+
+                if disconnected_at is None:
+                    disconnected_at = time.monotonic()
+                delay = self._reconnect_delay(attempts, backoff)
+                if delay is None:
+                    return
+                attempts += 1
+                try:
+                    await asyncio.wait_for(self.stop_event.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if disconnected_at is not None:
+                self.disconnected_seconds += time.monotonic() - disconnected_at
+
+    async def filter_tweets(self, track):
+        """
+        Fetch tweets from the streaming endpoint and store them in the queue
+
+        Args:
+            track: string that represents a comma-separated list of phrases which will be used to determine what
+            Tweets will be delivered on the stream
+
+        Returns:
+            None
+        """
+        if self._started_at is None:
+            self._started_at = time.monotonic()
+        if not self.auth and not await self.authenticate():
+            return
+
+        url = self.stream_root_url + '/statuses/filter.json'
+        body = {'track': track}
+        self._streaming_started_at = time.monotonic()
+        try:
+            async for line in self._read_stream(url, body):
+                await self.input_queue.put(line)
+        finally:
+            logger.info('Stream reconnected %s times, %.1f sec spent disconnected',
+                        self.reconnects, self.disconnected_seconds)
+            self._log_throughput()
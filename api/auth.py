@@ -1,4 +1,8 @@
+import json
 import logging
+import os
+import stat
+import threading
 import urllib.parse as urlparse
 from abc import ABC, abstractmethod
 
@@ -8,6 +12,7 @@ logger = logging.getLogger(__name__)
 
 ROOT_TWITTER_URL = 'https://api.twitter.com/'
 OAUTH_FRAGMENT = '/oauth/'
+DEFAULT_CREDENTIALS_FILE = os.path.join('~', '.twitter_cli', 'credentials.json')
 
 
 class BaseAuthenticator(ABC):
@@ -23,6 +28,15 @@ class BaseAuthenticator(ABC):
     def provide_auth(self):
         raise NotImplemented('Method not implemented')
 
+    def invalidate(self):
+        """
+        Called when the stream rejects the credentials.
+
+        Returns:
+            bool, True if new credentials were obtained (provide_auth returns the new auth object)
+        """
+        return False
+
 
 class PINAuthenticator(BaseAuthenticator):
 
@@ -105,3 +119,184 @@ class PINAuthenticator(BaseAuthenticator):
             OAuth instance
         """
         return self.oauth1.auth
+
+
+class StaticAuthenticator(BaseAuthenticator):
+
+    def __init__(self, api_key, api_secret_key, access_token=None, access_token_secret=None):
+        """
+        StaticAuthenticator signs requests with already known access tokens, skipping the interactive PIN flow
+
+        Args:
+            api_key: application API Key
+            api_secret_key: application API secret Key
+            access_token: user access token
+            access_token_secret: user access token secret
+        """
+        self.api_key = api_key
+        self.api_secret_key = api_secret_key
+        self.access_token = access_token
+        self.access_token_secret = access_token_secret
+        self.oauth1 = None
+
+    def authenticate(self):
+        """
+        Build the OAuth session from the known tokens.
+
+        Returns:
+            tuple of access token and secret access token
+        """
+        self.oauth1 = OAuth1Session(self.api_key, client_secret=self.api_secret_key,
+                                    resource_owner_key=self.access_token,
+                                    resource_owner_secret=self.access_token_secret)
+        return self.access_token, self.access_token_secret
+
+    def provide_auth(self):
+        return self.oauth1.auth
+
+
+class NoAuthenticator(BaseAuthenticator):
+    """
+    Authenticator that does not sign requests at all (for local stream stand-ins, e.g. the replay server)
+    """
+
+    def __init__(self, api_key=None, api_secret_key=None):
+        self.api_key = api_key
+        self.api_secret_key = api_secret_key
+
+    def authenticate(self):
+        return None, None
+
+    def provide_auth(self):
+        return None
+
+
+class CredentialsCache:
+
+    def __init__(self, filename=DEFAULT_CREDENTIALS_FILE):
+        """
+        Local cache of the access tokens (a JSON file keyed by the application API key).
+        The file is only readable and writable by its owner (0600), its directory - by its owner (0700).
+
+        Args:
+            filename: path to the cache file
+        """
+        self.filename = os.path.expanduser(filename)
+
+    def _read(self):
+        try:
+            with open(self.filename) as f:
+                file_mode = os.fstat(f.fileno()).st_mode
+                credentials = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError):
+            logger.exception('Can not read the credentials cache "%s"', self.filename)
+            return {}
+
+        if file_mode & (stat.S_IRWXG | stat.S_IRWXO):
+            logger.warning('Credentials cache "%s" is accessible by other users. Run `chmod 600 %s`',
+                           self.filename, self.filename)
+        return credentials if isinstance(credentials, dict) else {}
+
+    def _write(self, credentials):
+        directory = os.path.dirname(self.filename)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        tmp_filename = f'{self.filename}.{os.getpid()}.tmp'
+        fd = os.open(tmp_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(credentials, f)
+        os.replace(tmp_filename, self.filename)
+
+    def load(self, api_key):
+        """
+        Returns:
+            tuple of access token and secret access token or None if there are no cached tokens for the API key
+        """
+        tokens = self._read().get(api_key)
+        if not isinstance(tokens, dict) or not tokens.get('access_token') or not tokens.get('access_token_secret'):
+            return None
+        return tokens['access_token'], tokens['access_token_secret']
+
+    def save(self, api_key, access_token, access_token_secret):
+        credentials = self._read()
+        credentials[api_key] = {'access_token': access_token, 'access_token_secret': access_token_secret}
+        self._write(credentials)
+
+    def remove(self, api_key):
+        credentials = self._read()
+        if credentials.pop(api_key, None) is not None:
+            self._write(credentials)
+
+
+class CachedAuthenticator(BaseAuthenticator):
+
+    def __init__(self, api_key, api_secret_key, cache_file=DEFAULT_CREDENTIALS_FILE, fallback_cls=PINAuthenticator):
+        """
+        CachedAuthenticator reuses the access tokens kept in the local credentials cache across runs, so there are
+        no network round-trips and no interactive steps before streaming. The fallback authenticator (PIN flow)
+        is only used when there are no cached tokens or the stream rejects them (see `invalidate`).
+
+        Args:
+            api_key: application API Key
+            api_secret_key: application API secret Key
+            cache_file: path to the credentials cache file
+            fallback_cls: authenticator class that obtains new access tokens
+        """
+        self.api_key = api_key
+        self.api_secret_key = api_secret_key
+        self.cache = CredentialsCache(cache_file)
+        self.fallback_cls = fallback_cls
+        self.static = None
+        # True if the current tokens were taken from the cache
+        self.from_cache = False
+        # several streamers may share the authenticator, only one of them should go through the fallback flow
+        self._lock = threading.Lock()
+
+    def _use_tokens(self, access_token, access_token_secret):
+        self.static = StaticAuthenticator(self.api_key, self.api_secret_key, access_token, access_token_secret)
+        return self.static.authenticate()
+
+    def _authenticate_with_fallback(self):
+        authenticator = self.fallback_cls(self.api_key, self.api_secret_key)
+        access_token, access_token_secret = authenticator.authenticate()
+        self.from_cache = False
+        try:
+            self.cache.save(self.api_key, access_token, access_token_secret)
+        except OSError:
+            logger.exception('Can not save the credentials to "%s"', self.cache.filename)
+        return self._use_tokens(access_token, access_token_secret)
+
+    def authenticate(self):
+        """
+        Take the access tokens from the cache or obtain them with the fallback authenticator (and cache them).
+
+        Returns:
+            tuple of access token and secret access token
+        """
+        tokens = self.cache.load(self.api_key)
+        if tokens:
+            logger.info('Using cached credentials from "%s"', self.cache.filename)
+            self.from_cache = True
+            return self._use_tokens(*tokens)
+        return self._authenticate_with_fallback()
+
+    def provide_auth(self):
+        return self.static.provide_auth()
+
+    def invalidate(self):
+        """
+        Drop the rejected cached tokens and obtain new ones with the fallback authenticator.
+        Freshly obtained tokens are not retried.
+
+        Returns:
+            bool, True if new credentials were obtained
+        """
+        with self._lock:
+            if not self.from_cache:
+                return False
+            logger.warning('Cached credentials are rejected. Falling back to %s', self.fallback_cls.__name__)
+            self.cache.remove(self.api_key)
+            self._authenticate_with_fallback()
+            return True
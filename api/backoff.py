@@ -0,0 +1,69 @@
+class LinearBackoff:
+
+    def __init__(self, step, max_delay, initial=None):
+        """
+        Delay grows linearly by `step` seconds on every attempt, up to `max_delay` seconds.
+
+        Args:
+            step: delay increment in seconds
+            max_delay: max delay in seconds
+            initial: first delay (equals to `step` if None)
+        """
+        self.step = step
+        self.max_delay = max_delay
+        self.initial = step if initial is None else initial
+        self.attempt = 0
+
+    def next_delay(self):
+        delay = min(self.initial + self.step * self.attempt, self.max_delay)
+        self.attempt += 1
+        return delay
+
+    def reset(self):
+        self.attempt = 0
+
+
+class ExponentialBackoff:
+
+    def __init__(self, initial, max_delay, factor=2):
+        """
+        Delay starts at `initial` seconds and is multiplied by `factor` on every attempt, up to `max_delay` seconds.
+
+        Args:
+            initial: first delay in seconds
+            max_delay: max delay in seconds
+            factor: delay multiplier
+        """
+        self.initial = initial
+        self.max_delay = max_delay
+        self.factor = factor
+        self.attempt = 0
+
+    def next_delay(self):
+        delay = min(self.initial * self.factor ** self.attempt, self.max_delay)
+        self.attempt += 1
+        return delay
+
+    def reset(self):
+        self.attempt = 0
+
+
+def network_backoff():
+    """
+    Twitter streaming guideline for TCP/IP level errors: back off linearly by 250 ms up to 16 seconds
+    """
+    return LinearBackoff(0.25, 16)
+
+
+def http_backoff():
+    """
+    Twitter streaming guideline for HTTP errors: back off exponentially starting at 5 seconds up to 320 seconds
+    """
+    return ExponentialBackoff(5, 320)
+
+
+def rate_limit_backoff():
+    """
+    Twitter streaming guideline for HTTP 420/429 errors: back off exponentially starting at 1 minute
+    """
+    return ExponentialBackoff(60, 960)
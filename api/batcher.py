@@ -0,0 +1,73 @@
+import threading
+import time
+
+
+class LineBatcher:
+
+    def __init__(self, put, batch_size, batch_interval=0.05):
+        """
+        Groups lines into batches handed over either once full or once the first line of a non-full batch has
+        waited `batch_interval` seconds (whichever comes first). The interval is watched by a timer thread, so
+        a quiet stream does not hold a partial batch back; `close` hands the rest over.
+
+        Args:
+            put: callable the batches (lists of lines) are handed over to (e.g. input_queue.put)
+            batch_size: max number of lines per batch
+            batch_interval: max number of seconds a line may wait in a non-full batch
+        """
+        self.put = put
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self._batch = []
+        self._flush_at = None
+        # batches are handed over under the lock, so they keep the order of the lines
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(name='batch-timer', target=self._run, daemon=True)
+        self._thread.start()
+
+    def add(self, line):
+        with self._lock:
+            if not self._batch:
+                self._flush_at = time.monotonic() + self.batch_interval
+            self._batch.append(line)
+            if len(self._batch) >= self.batch_size:
+                self._flush()
+
+    def _flush(self):
+        batch = self._batch
+        self._batch = []
+        self.put(batch)
+
+    def _run(self):
+        timeout = self.batch_interval
+        while not self._closed.wait(timeout):
+            with self._lock:
+                if not self._batch:
+                    timeout = self.batch_interval
+                    continue
+                timeout = self._flush_at - time.monotonic()
+                if timeout <= 0:
+                    self._flush()
+                    timeout = self.batch_interval
+
+    def close(self):
+        """
+        Stop the timer and hand the non-full batch over
+        """
+        self._closed.set()
+        if self._thread:
+            self._thread.join()
+        with self._lock:
+            if self._batch:
+                self._flush()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
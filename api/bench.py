@@ -0,0 +1,439 @@
+import csv
+import functools
+import io
+import itertools
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import requests
+
+from .aggregates import HEAVY_HITTERS, create_heavy_hitters
+from .auth import NoAuthenticator
+from .decoder import decode_message
+from .framing import DELIMITED_BUFFER_SIZE, ChunkReader, iter_delimited
+from .matcher import TrackMatcher, naive_match
+from .replay import ReplayServer, generate_stream
+from .ringbuffer import RING_BUFFER_SIZE, RingBuffer
+from .tweets_processor import TweetsWriter
+from .twitter_api import TwitterAPI
+from .writers import FIELDS, WRITERS, create_writer
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest-rank percentile of the sorted values
+
+    Args:
+        sorted_values: sorted list of numbers
+        fraction: percentile as a fraction (e.g. 0.99)
+
+    Returns:
+        percentile value or None if there are no values
+    """
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def peak_rss_bytes():
+    """
+    Peak resident set size of the current process
+    """
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+
+class LatencyRecorder:
+
+    def __init__(self, sent_at):
+        """
+        Records the end-to-end latency (from the moment the replay server sent a tweet till the moment the
+        processor accepted it) of every tweet
+
+        Args:
+            sent_at: dict of tweet ID -> send time (time.perf_counter) filled in by the replay server
+        """
+        self.sent_at = sent_at
+        self.latencies = []
+        self.first_at = None
+        self.last_at = None
+
+    def __call__(self, tweet):
+        now = time.perf_counter()
+        if self.first_at is None:
+            self.first_at = now
+        self.last_at = now
+        sent_at = self.sent_at.get(tweet.id_str)
+        if sent_at is not None:
+            self.latencies.append(now - sent_at)
+
+
+def run_benchmark(lines, rate=None, track='bieber', time_limit=30, message_limit=None, filename=None,
+                  **api_options):
+    """
+    Replay the lines through a local stream stand-in and drive the full TwitterAPI pipeline
+
+    Args:
+        lines: list of raw lines to replay
+        rate: replay rate in lines per second (unlimited if None)
+        track: track phrases passed to the stream, or a list of them to open a stream per item
+        time_limit: max number of seconds the streaming may run
+        message_limit: max number of accepted messages (number of unique tweets in the lines if None)
+        filename: output filename (temporary file if None)
+        api_options: other TwitterAPI options (engine, batch_size, decode_workers, dedup, fast_parse etc.)
+
+    Returns:
+        dict with the benchmark report
+    """
+    server = ReplayServer(lines, rate)
+    server.start()
+    recorder = LatencyRecorder(server.sent_at)
+    unique_tweets = len({message_id for message_id in server.message_ids if message_id is not None})
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        api = TwitterAPI(
+            'bench', 'bench', time_limit=time_limit, message_limit=message_limit or unique_tweets,
+            filename=filename or os.path.join(tmp_dir, 'output.csv'), auth_cls=NoAuthenticator,
+            stream_root_url=server.url, on_message=recorder, **api_options
+        )
+        started = time.perf_counter()
+        try:
+            api.filter_tweets(track)
+        finally:
+            server.stop()
+        total_seconds = time.perf_counter() - started
+        # all output files (windows, routes, canonical tables) of the temporary output
+        output_bytes = None if filename else sum(entry.stat().st_size for entry in os.scandir(tmp_dir))
+
+    latencies = sorted(recorder.latencies)
+    messages = len(recorder.latencies)
+    ingest_seconds = (recorder.last_at - recorder.first_at) if messages > 1 else None
+    return {
+        'lines': len(lines),
+        'messages': messages,
+        'messages_per_second': messages / ingest_seconds if ingest_seconds else None,
+        'latency_p50': percentile(latencies, 0.5),
+        'latency_p90': percentile(latencies, 0.9),
+        'latency_p99': percentile(latencies, 0.99),
+        'latency_max': latencies[-1] if latencies else None,
+        'export_seconds': api.processor.export_seconds if api.processor else None,
+        'total_seconds': total_seconds,
+        'peak_rss_bytes': peak_rss_bytes(),
+        'output_bytes': output_bytes,
+        'metrics': api.metrics.snapshot() if api.metrics else {},
+    }
+
+
+def generate_rows(count, seed=0):
+    """
+    Generate output rows from a synthetic stream
+
+    Args:
+        count: number of rows
+        seed: random seed
+
+    Returns:
+        list of output rows
+    """
+    rows = []
+    for line in generate_stream(count, control_ratio=0, duplicate_ratio=0, seed=seed):
+        record = decode_message(line)
+        rows.append(tuple(record[:len(FIELDS)]))
+    return rows
+
+
+def write_rows_legacy(rows, filename, encoding='utf-8'):
+    """
+    TSV export as it was done before the writers registry: a dict and a writerow call per row
+    """
+    with open(filename, 'w', newline='') as csvfile:
+        writer = TweetsWriter(csvfile, delimiter='\t', quoting=csv.QUOTE_NONNUMERIC)
+        writer.writeheader()
+
+        for id_str, created_at, text, user_id_str, user_created_at, name, screen_name in rows:
+            writer.writerow({
+                'tweet_str_id': id_str,
+                'tweet_creation_dt': str(float(created_at)),
+                'tweet_text': text.encode('unicode_escape').decode(encoding),
+                'user_str_id': user_id_str,
+                'user_creation_dt': str(float(user_created_at)),
+                'user_name': name,
+                'user_screen_name': screen_name
+            })
+
+
+def run_writer_benchmark(rows, formats=None, repeat=3):
+    """
+    Measure the export time and the output size of every writer and of the legacy TSV export
+
+    Args:
+        rows: list of output rows
+        formats: list of writer names (all writers if None)
+        repeat: number of runs per writer (the best time is reported)
+
+    Returns:
+        dict of writer name ('tsv-legacy' for the legacy export) -> dict with seconds, rows_per_second and size
+    """
+    report = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name in ['tsv-legacy'] + list(formats or WRITERS):
+            filename = os.path.join(tmp_dir, f'output.{name}')
+            best = None
+            for _ in range(repeat):
+                started = time.perf_counter()
+                if name == 'tsv-legacy':
+                    write_rows_legacy(rows, filename)
+                else:
+                    with create_writer(name, filename) as writer:
+                        writer.write_rows(rows)
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            report[name] = {
+                'seconds': best,
+                'rows_per_second': len(rows) / best if best else None,
+                'size': os.path.getsize(filename),
+            }
+    return report
+
+
+def _consume_queue(input_queue, output_queue):
+    lines_count = bytes_count = 0
+    while True:
+        line = input_queue.get()
+        if line is None:
+            break
+        lines_count += 1
+        bytes_count += len(line)
+    output_queue.put((lines_count, bytes_count))
+
+
+def _consume_ring(ring, output_queue):
+    lines_count = bytes_count = 0
+    while True:
+        view = ring.get_view()
+        if view is None:
+            break
+        lines_count += 1
+        bytes_count += len(view)
+        view.release()
+    ring.detach()
+    output_queue.put((lines_count, bytes_count))
+
+
+def run_transport_benchmark(lines, ring_buffer_size=RING_BUFFER_SIZE, repeat=3):
+    """
+    Measure the hand-over of raw lines to a child process through multiprocessing.Queue (every line is pickled
+    and sent through a pipe) and through the shared memory ring buffer
+
+    Args:
+        lines: list of raw lines
+        ring_buffer_size: size of the ring buffer in bytes
+        repeat: number of runs per transport (the best time is reported)
+
+    Returns:
+        dict of transport name ('queue', 'ring') -> dict with seconds and lines_per_second
+    """
+    report = {}
+    for name in ('queue', 'ring'):
+        best = None
+        for _ in range(repeat):
+            output_queue = multiprocessing.Queue()
+            if name == 'queue':
+                transport = multiprocessing.Queue()
+                consumer = multiprocessing.Process(target=_consume_queue, args=(transport, output_queue))
+            else:
+                transport = RingBuffer(ring_buffer_size)
+                consumer = multiprocessing.Process(target=_consume_ring, args=(transport, output_queue))
+            consumer.start()
+            started = time.perf_counter()
+            for line in lines:
+                transport.put(line)
+            if name == 'queue':
+                transport.put(None)
+            else:
+                transport.close()
+            lines_count, _ = output_queue.get()
+            elapsed = time.perf_counter() - started
+            consumer.join()
+            if name == 'ring':
+                transport.unlink()
+            if lines_count != len(lines):
+                raise RuntimeError(f'{name} delivered {lines_count} of {len(lines)} lines')
+            best = elapsed if best is None else min(best, elapsed)
+        report[name] = {'seconds': best, 'lines_per_second': len(lines) / best if best else None}
+    return report
+
+
+def _iter_lines_capture(data, chunk_size):
+    resp = requests.Response()
+    resp.raw = io.BytesIO(data)
+    return resp.iter_lines(chunk_size)
+
+
+def _iter_delimited_capture(data, chunk_size):
+    return iter_delimited(ChunkReader(iter(functools.partial(io.BytesIO(data).read, chunk_size), b'')).readinto)
+
+
+def run_framing_benchmark(lines, repeat=3):
+    """
+    Measure the splitting of a captured stream into messages: `requests` iter_lines over the newline-delimited
+    stream (with its default 512-byte chunks, as the streamer used it, and with 64 KiB chunks) against
+    the length-delimited framing
+
+    Args:
+        lines: list of raw lines
+        repeat: number of runs per framing (the best time is reported)
+
+    Returns:
+        dict of framing name -> dict with seconds and lines_per_second
+    """
+    newline_capture = b''.join(line + b'\r\n' for line in lines)
+    delimited_capture = b''.join(b'%d\r\n%s\r\n' % (len(line) + 2, line) for line in lines)
+    framings = (
+        ('iter_lines', _iter_lines_capture, newline_capture, requests.models.ITER_CHUNK_SIZE),
+        ('iter_lines-64k', _iter_lines_capture, newline_capture, DELIMITED_BUFFER_SIZE),
+        ('delimited', _iter_delimited_capture, delimited_capture, DELIMITED_BUFFER_SIZE),
+    )
+    report = {}
+    for name, iter_messages, capture, chunk_size in framings:
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            lines_count = sum(1 for message in iter_messages(capture, chunk_size) if message)
+            elapsed = time.perf_counter() - started
+            if lines_count != len(lines):
+                raise RuntimeError(f'{name} split {lines_count} of {len(lines)} lines')
+            best = elapsed if best is None else min(best, elapsed)
+        report[name] = {'seconds': best, 'lines_per_second': len(lines) / best if best else None}
+    return report
+
+
+def generate_phrases(count, seed=0):
+    """
+    Generate a track list for the matcher benchmark: phrases matching the synthetic tweets ('bieber', hashtags,
+    two-term phrases), filler keywords and filler two-term phrases
+
+    Args:
+        count: number of phrases
+        seed: random seed
+
+    Returns:
+        list of phrases
+    """
+    rng = random.Random(seed)
+    phrases = ['bieber', 'synthetic tweet', 'justin bieber', '@user_7']
+    while len(phrases) < count:
+        chance = rng.random()
+        if chance < 0.2:
+            phrases.append(f'#{rng.randrange(1000)}')
+        elif chance < 0.6:
+            phrases.append(f'keyword{rng.randrange(100000)}')
+        else:
+            phrases.append(f'topic{rng.randrange(1000)} news{rng.randrange(1000)}')
+    return phrases[:count]
+
+
+def run_matcher_benchmark(texts, phrases, repeat=3):
+    """
+    Measure the matching of tweet texts against the track phrases: a substring check per phrase term (what
+    a straightforward filter does) against the single-pass TrackMatcher. The naive check ignores the token
+    boundaries, so it may match more tweets.
+
+    Args:
+        texts: list of tweet texts
+        phrases: list of phrases
+        repeat: number of runs per matcher (the best time is reported)
+
+    Returns:
+        dict of matcher name -> dict with seconds, tweets_per_second and matched (tweets matching any phrase)
+    """
+    started = time.perf_counter()
+    matcher = TrackMatcher(phrases)
+    logger.info('Built the matcher of %s phrases in %.3f sec', len(matcher.phrases), time.perf_counter() - started)
+    matchers = (
+        ('naive', functools.partial(naive_match, matcher.phrases)),
+        ('automaton', matcher.match),
+    )
+    report = {}
+    for name, match in matchers:
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            matched = sum(1 for text in texts if match(text))
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        report[name] = {'seconds': best, 'tweets_per_second': len(texts) / best if best else None,
+                        'matched': matched}
+    return report
+
+
+def generate_items(count, distinct=100000, skew=1.1, seed=0):
+    """
+    Generate a stream of items with a Zipf distribution (as the hashtags and the user activity are) for
+    the aggregates benchmark
+
+    Args:
+        count: number of items
+        distinct: number of distinct items
+        skew: Zipf exponent
+        seed: random seed
+
+    Returns:
+        list of item strings
+    """
+    rng = random.Random(seed)
+    cum_weights = list(itertools.accumulate(1 / rank ** skew for rank in range(1, distinct + 1)))
+    return [f'tag{rank}' for rank in rng.choices(range(distinct), cum_weights=cum_weights, k=count)]
+
+
+def run_aggregates_benchmark(items, size=1000, top=100):
+    """
+    Measure the top-k counters against an exact Counter (what the scripts over the output do): the time,
+    the memory and the accuracy of the top items
+
+    Args:
+        items: list of items
+        size: number of the items monitored by the counters
+        top: number of the top items compared
+
+    Returns:
+        dict of counter name ('exact' for the Counter) -> dict with seconds, items_per_second, memory (bytes),
+        recall (share of the exact top items found in the counter top) and max_error (max relative count error
+        of the counter top items)
+    """
+    started = time.perf_counter()
+    exact = Counter()
+    for item in items:
+        exact[item] += 1
+    elapsed = time.perf_counter() - started
+    memory = sys.getsizeof(exact) + sum(sys.getsizeof(item) + sys.getsizeof(count) for item, count in exact.items())
+    report = {'exact': {'seconds': elapsed, 'items_per_second': len(items) / elapsed if elapsed else None,
+                        'memory': memory, 'recall': 1.0, 'max_error': 0.0}}
+    exact_top = {item for item, _ in exact.most_common(top)}
+
+    for name in HEAVY_HITTERS:
+        counter = create_heavy_hitters(name, size=size)
+        started = time.perf_counter()
+        for item in items:
+            counter.add(item)
+        elapsed = time.perf_counter() - started
+        counter_top = counter.top(top)
+        report[name] = {
+            'seconds': elapsed,
+            'items_per_second': len(items) / elapsed if elapsed else None,
+            'memory': counter.memory_usage(),
+            'recall': len(exact_top & {item for item, _, _ in counter_top}) / len(exact_top) if exact_top else None,
+            'max_error': max((abs(count - exact[item]) / exact[item] for item, count, _ in counter_top), default=None),
+        }
+    return report
@@ -0,0 +1,102 @@
+import logging
+import sys
+
+from .metrics import MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+# expand - retweets and quotes are exported as usual; normalize - the text of the collapsed retweets is left out of
+# the output and a canonical tweets table is written next to it (see writers.write_canonical_table)
+COLLAPSE_MODES = ('expand', 'normalize')
+# Filename part of the canonical tweets table of a normalized output (see matcher.route_filename)
+CANONICAL_ROUTE = '_canonical'
+
+
+class CanonicalTweet:
+    """
+    A tweet retweeted or quoted by the streamed ones
+    """
+    __slots__ = ('id_str', 'screen_name', 'text', 'retweet_text', 'retweet_text_size')
+
+    def __init__(self, id_str, screen_name=None, text=None):
+        self.id_str = id_str
+        self.screen_name = screen_name
+        self.text = text
+        # text of its retweets ('RT @screen_name: text', truncated by Twitter), shared by all of them
+        self.retweet_text = None
+        # size of the retweet text in bytes (UTF-8)
+        self.retweet_text_size = 0
+
+
+class CanonicalTable:
+
+    def __init__(self, keep_text=False, metrics=None):
+        """
+        Keeps the tweets the streamed tweets retweet or quote (canonical tweets). Retweets of the same tweet carry
+        the same text, so it is stored once: the text of the first retweet is kept by the canonical tweet and
+        the next retweets refer to it instead of keeping their own copies.
+
+        Args:
+            keep_text: keep the texts of the canonical tweets themselves (needed by the normalized output only)
+            metrics: MetricsRegistry instance (a private one if None)
+        """
+        self.keep_text = keep_text
+        self.tweets = {}
+        # approximate size of the table in bytes
+        self.size = 0
+        metrics = metrics or MetricsRegistry()
+        metrics.gauge('canonical_tweets', 'Retweeted and quoted tweets in the canonical table',
+                      function=lambda: len(self.tweets))
+        self.collapsed = metrics.counter('collapsed_retweets_total',
+                                         'Retweets sharing the text of their canonical tweet instead of a copy')
+        self.saved_bytes = metrics.counter('collapsed_text_bytes_total',
+                                           'Memory of the retweet text copies released thanks to the sharing')
+
+    def __len__(self):
+        return len(self.tweets)
+
+    def collapse(self, tweet, record):
+        """
+        Refer the tweet to the canonical tweet it retweets or quotes (if any), share the retweet text
+
+        Args:
+            tweet: models.Tweet instance
+            record: decoder.TweetRecord instance the tweet was built from (with the reference fields)
+
+        Returns:
+            bool, True if the tweet text is shared
+        """
+        if record.ref_type is None or (record.ref_type != 'retweet' and not self.keep_text):
+            return False
+        canonical = self.tweets.get(record.ref_id_str)
+        if canonical is None:
+            canonical = CanonicalTweet(record.ref_id_str, record.ref_screen_name,
+                                       record.ref_text if self.keep_text else None)
+            self.tweets[canonical.id_str] = canonical
+            self.size += sys.getsizeof(canonical) + sys.getsizeof(canonical.id_str) + sys.getsizeof(canonical.text)
+        tweet.ref_type = record.ref_type
+        tweet.ref = canonical
+        if record.ref_type != 'retweet':
+            return False
+
+        if canonical.retweet_text is None:
+            canonical.retweet_text = tweet.text
+            canonical.retweet_text_size = len(tweet.text.encode('utf-8'))
+            return True
+        if tweet.text != canonical.retweet_text:
+            return False
+        self.collapsed.inc()
+        self.saved_bytes.inc(sys.getsizeof(tweet.text))
+        tweet.text = canonical.retweet_text
+        return True
+
+    def clear(self):
+        """
+        Forget the canonical tweets (the tweets referring to them keep them)
+        """
+        self.tweets = {}
+        self.size = 0
+
+    def log_stats(self):
+        logger.info('Canonical table keeps %s tweets in ~%s bytes, %s retweet texts are shared (~%s bytes saved)',
+                    len(self), self.size, self.collapsed.value, self.saved_bytes.value)
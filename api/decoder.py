@@ -0,0 +1,278 @@
+import json
+import logging
+import multiprocessing
+import zlib
+from collections import namedtuple
+
+from .fastparse import is_control_message, parse_message
+from .models import parse_created_at, snowflake_to_epoch
+
+logger = logging.getLogger(__name__)
+
+EVENT_KEYS = frozenset({'limit', 'disconnect', 'warning', 'delete', 'scrub_geo', 'status_withheld',
+                        'user_withheld', 'event'})
+MESSAGE_KEYS = frozenset({'id_str', 'created_at', 'text', 'user'})
+USER_KEYS = frozenset({'id_str', 'name', 'screen_name', 'created_at'})
+# Number of leading bytes used to shard raw lines between decode workers (the tweet ID is among them)
+SHARD_PREFIX_SIZE = 64
+
+# Nested tweets a tweet may refer to: reference type -> payload key
+REFERENCE_KEYS = (('retweet', 'retweeted_status'), ('quote', 'quoted_status'))
+
+# Compact representation of a validated tweet, cheap to pickle between processes. The reference fields describe
+# the tweet it retweets or quotes (only extracted on request, see `project_reference`)
+TweetRecord = namedtuple('TweetRecord', ['id_str', 'created_at', 'text', 'user_id_str', 'user_created_at',
+                                         'user_name', 'user_screen_name', 'ref_type', 'ref_id_str', 'ref_text',
+                                         'ref_screen_name'], defaults=(None, None, None, None))
+
+
+def check_is_tweet(data):
+    """
+    Check if a supplied payload looks like a tweet.
+
+    Args:
+        data: Python dict object with a payload that should be tested
+
+    Returns:
+        bool, True id the data looks like a tweet
+
+    """
+    if not data or not isinstance(data, dict):
+        return False
+    data_keys_set = set(data.keys())
+
+    if not data or data_keys_set & EVENT_KEYS:
+        return False
+
+    if not MESSAGE_KEYS <= data_keys_set:
+        return False
+
+    return True
+
+
+def project_reference(data):
+    """
+    Find the tweet a tweet payload retweets or quotes (a retweet of a quote refers to the retweeted tweet)
+
+    Args:
+        data: Python dict object with a tweet payload
+
+    Returns:
+        tuple of the reference type ('retweet' or 'quote'), the ID, text and user screen name of the referred tweet,
+        empty if there is none
+    """
+    for ref_type, key in REFERENCE_KEYS:
+        nested = data.get(key)
+        if not isinstance(nested, dict):
+            continue
+        user_payload = nested.get('user')
+        if 'id_str' in nested and 'text' in nested and isinstance(user_payload, dict) and 'screen_name' in user_payload:
+            return ref_type, nested['id_str'], nested['text'], user_payload['screen_name']
+    return ()
+
+
+def project_payload(data, use_snowflake=False, references=False):
+    """
+    Validate a tweet payload and project it to a compact record with only the exported fields
+
+    Args:
+        data: Python dict object with a tweet payload
+        use_snowflake: take the tweet creation time from the snowflake ID instead of parsing created_at
+        references: extract the retweeted or quoted tweet as well (see `project_reference`)
+
+    Returns:
+        TweetRecord instance or None if the payload is invalid
+    """
+    user_payload = data['user']
+    if not isinstance(user_payload, dict) or not USER_KEYS <= user_payload.keys():
+        logger.debug('Can not instantiate User object from the payload. Skipping entry...')
+        return None
+    try:
+        user_created_at = parse_created_at(user_payload['created_at'])
+    except ValueError:
+        logger.debug('Can not instantiate User object from the payload. Skipping entry...')
+        return None
+    # IDs are exported and ordered as strings (a null one would fail the deduplication or the sort)
+    if not isinstance(data['id_str'], str) or not isinstance(user_payload['id_str'], str):
+        logger.debug('Message or user ID is not a string. Skipping entry...')
+        return None
+
+    created_at = snowflake_to_epoch(data['id_str']) if use_snowflake else None
+    try:
+        if created_at is None:
+            created_at = parse_created_at(data['created_at'])
+    except ValueError:
+        logger.debug('Can not instantiate Tweet object from the payload. Skipping entry...')
+        return None
+
+    return TweetRecord(data['id_str'], created_at, data['text'], user_payload['id_str'], user_created_at,
+                       user_payload['name'], user_payload['screen_name'],
+                       *(project_reference(data) if references else ()))
+
+
+def message_size(message, encoding='utf-8'):
+    """
+    Size of a raw message in bytes
+
+    Args:
+        message: raw message bytes or its decoded text
+        encoding: encoding string
+
+    Returns:
+        int, the number of bytes
+    """
+    if isinstance(message, str) and not message.isascii():
+        return len(message.encode(encoding))
+    return len(message)
+
+
+def decode_message(message, encoding='utf-8', use_snowflake=False, fast_parse=False, references=False):
+    """
+    Decode a raw message, check it is a tweet and project it to a compact record
+
+    Args:
+        message: raw message bytes or its decoded text
+        encoding: encoding string
+        use_snowflake: take the tweet creation time from the snowflake ID instead of parsing created_at
+        fast_parse: skip control messages by their leading key and extract the tweet fields without decoding
+        the whole document (messages of unexpected layout are decoded with json.loads)
+        references: extract the retweeted or quoted tweet as well
+
+    Returns:
+        TweetRecord instance or None if the message is not a valid tweet
+    """
+    if fast_parse:
+        status, fields = parse_message(message, encoding, use_snowflake, references)
+        if status == 'control':
+            logger.debug('Skipping a control message')
+            return None
+        if status == 'tweet':
+            logger.debug('Received a message (ID %s)', fields[0])
+            return TweetRecord(*fields)
+
+    json_message = json.loads(message if isinstance(message, str) else message.decode(encoding))
+
+    if not check_is_tweet(json_message):
+        logger.debug('A message does not look like an event: %s. Skipping that message.', json_message)
+        return None
+
+    logger.debug('Received a message (ID %s)', json_message['id_str'])
+    return project_payload(json_message, use_snowflake, references)
+
+
+def _decode_worker(input_queue, output_queue, encoding, use_snowflake, fast_parse, references):
+    """
+    Decode worker process: decodes batches of raw messages and sends back a list of (record, message size) tuples
+    along with the numbers of skipped control and invalid messages for every batch. Stops on a None item.
+    """
+    while True:
+        batch = input_queue.get()
+        if batch is None:
+            # results may be not consumed anymore, so do not wait for them to be flushed
+            output_queue.cancel_join_thread()
+            return
+
+        records = []
+        control_count = invalid_count = 0
+        for message in batch:
+            try:
+                record = decode_message(message, encoding, use_snowflake, fast_parse, references)
+            except ValueError:
+                logger.debug('Can not decode a message. Skipping that message.', exc_info=True)
+                invalid_count += 1
+                continue
+            if record:
+                records.append((record, message_size(message, encoding)))
+            elif is_control_message(message):
+                control_count += 1
+            else:
+                invalid_count += 1
+        output_queue.put((records, control_count, invalid_count))
+
+
+class DecodePool:
+
+    def __init__(self, workers, encoding='utf-8', use_snowflake=False, fast_parse=False, references=False):
+        """
+        DecodePool runs JSON decoding and validation of raw messages in a pool of worker processes.
+        Raw lines are sharded between the workers by a cheap hash of their leading bytes.
+
+        Args:
+            workers: number of worker processes
+            encoding: encoding string
+            use_snowflake: take the tweet creation time from the snowflake ID instead of parsing created_at
+            fast_parse: use the fast path of the message decoding (see `decode_message`)
+            references: extract the retweeted or quoted tweets as well
+        """
+        self.workers = workers
+        self.encoding = encoding
+        self.input_queues = [multiprocessing.Queue() for _ in range(workers)]
+        self.output_queue = multiprocessing.Queue()
+        self.processes = [
+            multiprocessing.Process(
+                name=f'decoder-{ind}',
+                target=_decode_worker,
+                args=(input_queue, self.output_queue, encoding, use_snowflake, fast_parse, references),
+                daemon=True,
+            )
+            for ind, input_queue in enumerate(self.input_queues)
+        ]
+
+    def start(self):
+        logger.info('Starting %s decode workers', self.workers)
+        for process in self.processes:
+            process.start()
+
+    def submit(self, batch):
+        """
+        Shard a batch of raw messages between the workers
+
+        Args:
+            batch: list of raw messages (bytes or decoded text)
+
+        Returns:
+            None
+        """
+        shards = [[] for _ in range(self.workers)]
+        for message in batch:
+            prefix = message[:SHARD_PREFIX_SIZE]
+            if isinstance(prefix, str):
+                prefix = prefix.encode(self.encoding)
+            shards[zlib.crc32(prefix) % self.workers].append(message)
+        for input_queue, shard in zip(self.input_queues, shards):
+            if shard:
+                input_queue.put(shard)
+
+    def get(self, timeout=None):
+        """
+        Get decoded records of a single batch
+
+        Args:
+            timeout: max number of seconds to wait for the results
+
+        Returns:
+            tuple of a list of (TweetRecord, message size) tuples, numbers of skipped control and invalid messages
+
+        Raises:
+            queue.Empty if there are no results within the timeout
+        """
+        return self.output_queue.get(timeout=timeout)
+
+    def stop(self, timeout=5):
+        """
+        Stop all worker processes, discarding not consumed results
+
+        Args:
+            timeout: max number of seconds to wait for each worker before terminating it
+
+        Returns:
+            None
+        """
+        for input_queue in self.input_queues:
+            input_queue.put(None)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        logger.info('Decode workers stopped')
+
@@ -0,0 +1,285 @@
+import logging
+import math
+import sys
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# size of a small int object, used for the memory estimates
+INT_SIZE = sys.getsizeof(2 ** 62)
+MASK_64 = (1 << 64) - 1
+
+
+class BaseDeduplicator(ABC):
+    """
+    Base deduplication class. Message IDs are 64-bit integers (snowflake IDs).
+    """
+
+    @abstractmethod
+    def add(self, message_id):
+        """
+        Remember the message ID.
+
+        Args:
+            message_id: int, message ID
+
+        Returns:
+            bool, True if the ID was not seen before
+        """
+        raise NotImplementedError('Method not implemented')
+
+    @abstractmethod
+    def __contains__(self, message_id):
+        raise NotImplementedError('Method not implemented')
+
+    @abstractmethod
+    def memory_usage(self):
+        """
+        Returns:
+            int, approximate number of bytes used by the deduplicator
+        """
+        raise NotImplementedError('Method not implemented')
+
+
+class SetDeduplicator(BaseDeduplicator):
+    """
+    Exact deduplication: keeps every seen ID for the whole run.
+    """
+
+    def __init__(self, **kwargs):
+        self.ids = set()
+
+    def add(self, message_id):
+        if message_id in self.ids:
+            return False
+        self.ids.add(message_id)
+        return True
+
+    def __contains__(self, message_id):
+        return message_id in self.ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def memory_usage(self):
+        return sys.getsizeof(self.ids) + INT_SIZE * len(self.ids)
+
+
+class LRUDeduplicator(BaseDeduplicator):
+
+    def __init__(self, size=1000000, **kwargs):
+        """
+        Keeps at most `size` recently seen IDs. Duplicates arriving after `size` newer unique IDs are not detected.
+
+        Args:
+            size: max number of IDs kept
+        """
+        self.size = size
+        self.ids = OrderedDict()
+
+    def add(self, message_id):
+        if message_id in self.ids:
+            self.ids.move_to_end(message_id)
+            return False
+        self.ids[message_id] = None
+        if len(self.ids) > self.size:
+            self.ids.popitem(last=False)
+        return True
+
+    def __contains__(self, message_id):
+        return message_id in self.ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def memory_usage(self):
+        return sys.getsizeof(self.ids) + INT_SIZE * len(self.ids)
+
+
+class WindowDeduplicator(BaseDeduplicator):
+
+    def __init__(self, window=300, buckets=10, **kwargs):
+        """
+        Keeps IDs created within the last `window` seconds. Snowflake IDs are roughly monotonic, so the creation
+        time (extracted from the ID) of a duplicate is close to the newest seen one. IDs are kept in time buckets,
+        and whole buckets are released once they fall out of the window. IDs older than the window are considered
+        new (and not remembered).
+
+        Args:
+            window: number of seconds
+            buckets: number of buckets the window is split into
+        """
+        self.window_ms = int(window * 1000)
+        self.bucket_ms = max(1, self.window_ms // buckets)
+        self.buckets = {}
+        self.newest_bucket = None
+
+    def _bucket_index(self, message_id):
+        return (message_id >> 22) // self.bucket_ms
+
+    def _evict(self):
+        oldest_bucket = self.newest_bucket - self.window_ms // self.bucket_ms
+        for bucket_index in [index for index in self.buckets if index < oldest_bucket]:
+            del self.buckets[bucket_index]
+
+    def add(self, message_id):
+        bucket_index = self._bucket_index(message_id)
+        if self.newest_bucket is None or bucket_index > self.newest_bucket:
+            self.newest_bucket = bucket_index
+            self._evict()
+        elif bucket_index < self.newest_bucket - self.window_ms // self.bucket_ms:
+            logger.debug('Message (ID %s) is older than the deduplication window', message_id)
+            return True
+
+        bucket = self.buckets.setdefault(bucket_index, set())
+        if message_id in bucket:
+            return False
+        bucket.add(message_id)
+        return True
+
+    def __contains__(self, message_id):
+        return message_id in self.buckets.get(self._bucket_index(message_id), ())
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self.buckets.values())
+
+    def memory_usage(self):
+        return sum(sys.getsizeof(bucket) + INT_SIZE * len(bucket) for bucket in self.buckets.values())
+
+
+def _mix64(value):
+    """
+    SplitMix64 finalizer: a cheap, well distributed 64-bit hash of an integer
+    """
+    value = (value + 0x9E3779B97F4A7C15) & MASK_64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK_64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK_64
+    return value ^ (value >> 31)
+
+
+class BloomFilter:
+
+    def __init__(self, capacity, error_rate):
+        """
+        Classic Bloom filter sized for `capacity` items with the given false-positive rate
+
+        Args:
+            capacity: expected number of items
+            error_rate: false-positive probability when the filter holds `capacity` items
+        """
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bits_count = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes_count = max(1, int(round(self.bits_count / capacity * math.log(2))))
+        self.bits = bytearray((self.bits_count + 7) // 8)
+        self.count = 0
+
+    def _positions(self, hashes):
+        # double hashing (Kirsch-Mitzenmacher) on two 64-bit hashes
+        first, second = hashes
+        bits_count = self.bits_count
+        return [(first + ind * second) % bits_count for ind in range(self.hashes_count)]
+
+    def contains(self, hashes):
+        """
+        Args:
+            hashes: tuple of two 64-bit hashes of the item (see `hash_item`)
+
+        Returns:
+            bool, True if the item is (probably) in the filter
+        """
+        bits = self.bits
+        for position in self._positions(hashes):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add(self, hashes):
+        """
+        Args:
+            hashes: tuple of two 64-bit hashes of the item (see `hash_item`)
+
+        Returns:
+            None
+        """
+        bits = self.bits
+        for position in self._positions(hashes):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    @staticmethod
+    def hash_item(message_id):
+        first = _mix64(message_id)
+        return first, _mix64(first) | 1
+
+    @property
+    def is_full(self):
+        return self.count >= self.capacity
+
+
+class BloomDeduplicator(BaseDeduplicator):
+
+    def __init__(self, size=1000000, error_rate=0.001, growth=2, tightening=0.5, **kwargs):
+        """
+        Scalable Bloom filter: once a filter is full, a new filter with a larger capacity and a tighter error rate
+        is added, so the overall false-positive rate stays below `error_rate` for any number of IDs.
+        A false positive means a unique message is dropped as a duplicate.
+
+        Args:
+            size: capacity of the first filter
+            error_rate: max false-positive rate
+            growth: capacity multiplier of every next filter
+            tightening: error rate multiplier of every next filter
+        """
+        self.size = size
+        self.error_rate = error_rate
+        self.growth = growth
+        self.tightening = tightening
+        self.filters = [BloomFilter(size, error_rate * (1 - tightening))]
+
+    def add(self, message_id):
+        hashes = BloomFilter.hash_item(message_id)
+        if any(bloom_filter.contains(hashes) for bloom_filter in self.filters):
+            return False
+        current = self.filters[-1]
+        if current.is_full:
+            current = BloomFilter(current.capacity * self.growth, current.error_rate * self.tightening)
+            self.filters.append(current)
+            logger.info('Bloom filter is scaled to %s filters', len(self.filters))
+        current.add(hashes)
+        return True
+
+    def __contains__(self, message_id):
+        hashes = BloomFilter.hash_item(message_id)
+        return any(bloom_filter.contains(hashes) for bloom_filter in self.filters)
+
+    def __len__(self):
+        return sum(bloom_filter.count for bloom_filter in self.filters)
+
+    def memory_usage(self):
+        return sum(len(bloom_filter.bits) for bloom_filter in self.filters)
+
+
+DEDUPLICATORS = {
+    'set': SetDeduplicator,
+    'window': WindowDeduplicator,
+    'lru': LRUDeduplicator,
+    'bloom': BloomDeduplicator,
+}
+
+
+def create_deduplicator(name='set', **kwargs):
+    """
+    Instantiate a deduplicator by its name
+
+    Args:
+        name: one of DEDUPLICATORS keys
+        kwargs: deduplicator parameters (size, error_rate, window); irrelevant ones are ignored
+
+    Returns:
+        BaseDeduplicator instance
+    """
+    if name not in DEDUPLICATORS:
+        raise ValueError(f'Unknown deduplicator: {name}')
+    return DEDUPLICATORS[name](**{key: value for key, value in kwargs.items() if value is not None})
@@ -0,0 +1,168 @@
+import logging
+from json.decoder import scanstring
+
+from .models import parse_created_at, snowflake_to_epoch
+
+logger = logging.getLogger(__name__)
+
+# Control messages are objects with a single type key, e.g. {"limit":{"track":42,...}}
+CONTROL_PREFIXES = tuple(b'{"%s"' % key.encode() for key in ('limit', 'disconnect', 'warning', 'delete',
+                                                             'scrub_geo', 'status_withheld', 'user_withheld',
+                                                             'event'))
+CONTROL_TEXT_PREFIXES = tuple(prefix.decode() for prefix in CONTROL_PREFIXES)
+TWEET_PREFIX = '{"created_at":"'
+# Objects that follow the user object and contain their own creation dates
+NESTED_TWEET_KEYS = ('"retweeted_status":{', '"quoted_status":{')
+# Reference types of the nested tweets (see decoder.REFERENCE_KEYS)
+NESTED_TWEET_TYPES = ('retweet', 'quote')
+
+
+def is_control_message(message):
+    """
+    Sniff the leading key of a raw message to detect a control message (limit, delete, scrub_geo, etc.)
+    without parsing it.
+
+    Args:
+        message: raw message bytes or its decoded text
+
+    Returns:
+        bool, True if the message is a control message
+    """
+    return message.startswith(CONTROL_TEXT_PREFIXES if isinstance(message, str) else CONTROL_PREFIXES)
+
+
+def _find_string(text, key, start, end=-1):
+    """
+    Find the first `"key":"value"` pair in the text and decode its value
+
+    Args:
+        text: JSON text
+        key: key name
+        start: position to start searching from
+        end: position to stop searching at (the end of the text if negative)
+
+    Returns:
+        tuple of the decoded value and the position where the key starts (None and -1 if not found)
+    """
+    pattern = f'"{key}":"'
+    position = text.find(pattern, start) if end < 0 else text.find(pattern, start, end)
+    if position < 0:
+        return None, -1
+    value, _ = scanstring(text, position + len(pattern))
+    return value, position
+
+
+def _extract_reference(text, ref_type, position):
+    """
+    Extract the ID, text and user screen name of the nested tweet starting at the position (the same layout as
+    the top-level tweet)
+
+    Returns:
+        tuple of the reference fields (see decoder.project_reference) or None if the layout is not the expected one
+    """
+    id_str, id_position = _find_string(text, 'id_str', position)
+    if id_position < 0:
+        return None
+    ref_text, text_position = _find_string(text, 'text', id_position)
+    if text_position < 0:
+        return None
+    user_position = text.find('"user":{', text_position)
+    if user_position < 0:
+        return None
+    screen_name, screen_name_position = _find_string(text, 'screen_name', user_position)
+    if screen_name_position < 0:
+        return None
+    return ref_type, id_str, ref_text, screen_name
+
+
+def extract_fields(message, encoding='utf-8', references=False):
+    """
+    Extract the exported fields of a tweet from the raw message without decoding the whole JSON document.
+    Relies on the field layout of the stream payloads: the top-level `created_at`, `id_str` and `text` come before
+    the `user` object, whose fields come before any nested (retweeted or quoted) tweet.
+
+    Args:
+        message: raw message bytes
+        encoding: encoding string
+        references: extract the retweeted or quoted tweet as well (the retweeted one first)
+
+    Returns:
+        tuple of tweet ID, created_at, text, user ID, user created_at, user name and screen name strings
+        (the order of TweetRecord fields), followed by the reference fields if requested and there is one,
+        or None if the message does not match the expected layout (the caller should fall back to json.loads)
+    """
+    text = message.decode(encoding) if not isinstance(message, str) else message
+    if not text.startswith(TWEET_PREFIX):
+        return None
+
+    try:
+        created_at, _ = scanstring(text, len(TWEET_PREFIX))
+        user_position = text.find('"user":{')
+        if user_position < 0:
+            return None
+        id_str, id_position = _find_string(text, 'id_str', len(TWEET_PREFIX), user_position)
+        tweet_text, text_position = _find_string(text, 'text', max(id_position, 0), user_position)
+        if id_position < 0 or text_position < 0:
+            return None
+
+        user_fields = []
+        last_position = user_position
+        for key in ('id_str', 'created_at', 'name', 'screen_name'):
+            value, position = _find_string(text, key, user_position)
+            if position < 0:
+                return None
+            user_fields.append(value)
+            last_position = max(last_position, position)
+    except ValueError:
+        # broken JSON string
+        return None
+
+    reference = ()
+    for nested_key, ref_type in zip(NESTED_TWEET_KEYS, NESTED_TWEET_TYPES):
+        nested_position = text.find(nested_key, user_position)
+        if 0 <= nested_position < last_position:
+            return None
+        if references and nested_position >= 0 and not reference:
+            try:
+                reference = _extract_reference(text, ref_type, nested_position + len(nested_key))
+            except ValueError:
+                reference = None
+            if reference is None:
+                return None
+
+    return (id_str, created_at, tweet_text) + tuple(user_fields) + reference
+
+
+def parse_message(message, encoding='utf-8', use_snowflake=False, references=False):
+    """
+    Fast path of the message decoding
+
+    Args:
+        message: raw message bytes
+        encoding: encoding string
+        use_snowflake: take the tweet creation time from the snowflake ID instead of parsing created_at
+        references: extract the retweeted or quoted tweet as well
+
+    Returns:
+        tuple of a status and the extracted fields: ('control', None) for control messages,
+        ('tweet', fields) for tweets (see `extract_fields`), created_at values are parsed to epoch seconds,
+        (None, None) if the message should be decoded with the full parser
+    """
+    if is_control_message(message):
+        return 'control', None
+
+    fields = extract_fields(message, encoding, references)
+    if not fields:
+        return None, None
+
+    id_str, created_at, text, user_id_str, user_created_at, user_name, user_screen_name = fields[:7]
+    try:
+        tweet_created_at = snowflake_to_epoch(id_str) if use_snowflake else None
+        if tweet_created_at is None:
+            tweet_created_at = parse_created_at(created_at)
+        user_created_at = parse_created_at(user_created_at)
+    except ValueError:
+        return None, None
+
+    return 'tweet', (id_str, tweet_created_at, text, user_id_str, user_created_at, user_name,
+                     user_screen_name) + fields[7:]
@@ -0,0 +1,124 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Initial size of the framing buffer in bytes (grows for longer messages)
+DELIMITED_BUFFER_SIZE = 1 << 16
+
+
+class ChunkReader:
+
+    def __init__(self, chunks):
+        """
+        File-like `readinto` adapter over an iterable of byte chunks (e.g. a streamed response read chunk by chunk
+        as the data arrives), so a reader never waits for more data than the stream has sent
+
+        Args:
+            chunks: iterable of bytes-like objects
+        """
+        self.chunks = iter(chunks)
+        self.pending = memoryview(b'')
+
+    @classmethod
+    def from_response(cls, resp, chunk_size=DELIMITED_BUFFER_SIZE):
+        """
+        Args:
+            resp: streamed requests.Response instance
+            chunk_size: max size of a chunk read from the connection
+        """
+        return cls(resp.raw.stream(chunk_size, decode_content=True))
+
+    def readinto(self, buffer):
+        """
+        Copy the next piece of data into the buffer
+
+        Args:
+            buffer: writable bytes-like object
+
+        Returns:
+            int, number of bytes copied (0 at the end of the stream)
+        """
+        while not self.pending:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return 0
+            self.pending = memoryview(chunk)
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+
+def iter_delimited(readinto, buffer_size=DELIMITED_BUFFER_SIZE):
+    """
+    Split a `delimited=length` stream into messages. Every message is preceded by a line with its length in bytes
+    (including the trailing CRLF of the message), keep-alive empty lines may come between the messages.
+
+    The stream is read into a single reusable buffer and messages are yielded as memoryview slices of it, without
+    searching them for newlines or copying them. A yielded view is valid till the next message is requested only.
+
+    Args:
+        readinto: callable filling a writable buffer and returning the number of bytes read (0 at the end)
+        buffer_size: initial size of the buffer (it grows if a message does not fit)
+
+    Returns:
+        yields messages (memoryview without the trailing CRLF) and b'' for keep-alive lines
+
+    Raises:
+        ValueError if the stream does not follow the length-delimited framing
+    """
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    start = end = 0
+
+    def fill(required):
+        """
+        Read more data, making room for `required` bytes from the start of the current message
+        """
+        nonlocal buffer, view, start, end
+        if required > len(buffer):
+            # views of the old buffer stay valid, they keep it alive
+            grown = bytearray(max(required, 2 * len(buffer)))
+            grown[:end - start] = view[start:end]
+            buffer = grown
+            view = memoryview(buffer)
+            end -= start
+            start = 0
+        elif start and (end == len(buffer) or start + required > len(buffer)):
+            # the source and the target may overlap, so the (partial message) tail is copied out first
+            buffer[:end - start] = bytes(view[start:end])
+            end -= start
+            start = 0
+        size = readinto(view[end:])
+        end += size
+        return size
+
+    while True:
+        newline = buffer.find(b'\n', start, end)
+        if newline < 0:
+            if end - start > 32:
+                raise ValueError(f'Invalid length prefix: {bytes(buffer[start:start + 32])!r}')
+            if not fill(end - start + 1):
+                return
+            continue
+
+        length_start = start
+        start = newline + 1
+        # keep-alive line (CRLF)
+        if newline - length_start < 2:
+            yield b''
+            continue
+        try:
+            length = int(buffer[length_start:newline])
+        except ValueError:
+            raise ValueError(f'Invalid length prefix: {bytes(buffer[length_start:newline])!r}') from None
+
+        while end - start < length:
+            if not fill(length):
+                logger.debug('Stream ended in the middle of a message')
+                return
+        message_start = start
+        start += length
+        # the announced length includes the CRLF ending the message
+        message_end = start - 2 if length > 1 and buffer[start - 1] == 10 and buffer[start - 2] == 13 else start
+        yield view[message_start:message_end]
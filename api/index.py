@@ -0,0 +1,243 @@
+import bisect
+import logging
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+logger = logging.getLogger(__name__)
+
+# Sidecar index filename suffix (output.csv -> output.csv.idx)
+INDEX_SUFFIX = '.idx'
+INDEX_MAGIC = b'TWIDX\x00\x01\x00'
+# output format name, output file size, users count
+INDEX_HEADER = struct.Struct('<16sQQ')
+# Query results are read from the output file in chunks of that many bytes
+READ_CHUNK_SIZE = 1 << 20
+
+
+def index_filename(filename):
+    return filename + INDEX_SUFFIX
+
+
+class IndexBuilder:
+
+    def __init__(self, output_format):
+        """
+        Collects the byte range of every user while an output file is written. The output is grouped by user and
+        ordered by the user creation date (see TweetsProcessor._sorted_rows), so every user takes a single
+        contiguous range and the ranges are ordered by the user creation epoch.
+
+        Args:
+            output_format: output format name (see writers.WRITERS)
+        """
+        self.output_format = output_format
+        # number of bytes written so far
+        self.offset = 0
+        # users in the file order
+        self.user_ids = array('Q')
+        self.epochs = array('q')
+        self.starts = array('Q')
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def skip(self, size):
+        """
+        Account bytes that do not belong to any row (e.g. the header)
+        """
+        self.offset += size
+
+    def add(self, user_id_str, user_created_at, size):
+        """
+        Account an output row
+
+        Args:
+            user_id_str: user ID of the row
+            user_created_at: user creation date (epoch) of the row
+            size: size of the row in bytes
+
+        Raises:
+            ValueError if the user ID is not an integer or the rows are not ordered by the user creation date
+        """
+        user_id = int(user_id_str)
+        if not self.user_ids or self.user_ids[-1] != user_id:
+            epoch = int(user_created_at)
+            if self.epochs and epoch < self.epochs[-1]:
+                raise ValueError('rows are not ordered by the user creation date')
+            self.user_ids.append(user_id)
+            self.epochs.append(epoch)
+            self.starts.append(self.offset)
+        self.offset += size
+
+    def write(self, filename):
+        """
+        Write the index file: INDEX_MAGIC, INDEX_HEADER, then the little-endian columns of the users in the file
+        order (creation epochs, start offsets followed by the end of the last user), the user IDs in the ascending
+        order and the file order positions of these users
+
+        Args:
+            filename: index filename
+
+        Raises:
+            ValueError if the rows of a user are not contiguous
+        """
+        order = sorted(range(len(self.user_ids)), key=self.user_ids.__getitem__)
+        sorted_ids = array('Q', (self.user_ids[position] for position in order))
+        for ind in range(1, len(sorted_ids)):
+            if sorted_ids[ind] == sorted_ids[ind - 1]:
+                raise ValueError(f'rows of the user {sorted_ids[ind]} are not contiguous')
+
+        starts = array('Q', self.starts)
+        starts.append(self.offset)
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, 'wb') as f:
+            f.write(INDEX_MAGIC)
+            f.write(INDEX_HEADER.pack(self.output_format.encode('ascii'), self.offset, len(self.user_ids)))
+            for column in (self.epochs, starts, sorted_ids, array('Q', order)):
+                f.write(_to_little_endian(column))
+        os.replace(tmp_filename, filename)
+
+
+def _to_little_endian(values):
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+class OutputIndex:
+
+    def __init__(self, filename):
+        """
+        Lookups in an output file by its sidecar index (see IndexBuilder). Both files are memory-mapped, a lookup
+        is a binary search over the index columns, the found rows are read straight from the mapped output.
+
+        Usage:
+            with OutputIndex('output.csv') as index:
+                start, end, epoch = index.find_user('12345')
+                data = b''.join(index.read(start, end))
+
+        Args:
+            filename: output filename (the index is expected in filename + INDEX_SUFFIX)
+
+        Raises:
+            OSError if there is no index
+            ValueError if the index is not valid or does not match the output file
+        """
+        self.filename = filename
+        self._maps = []
+        self._columns = []
+        try:
+            self._open()
+        except Exception:
+            self.close()
+            raise
+
+    def _map(self, filename):
+        with open(filename, 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                return b''
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mapped)
+        return mapped
+
+    def _open(self):
+        index = self._map(index_filename(self.filename))
+        if index[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+            raise ValueError(f'{index_filename(self.filename)} is not an output index')
+        output_format, data_size, users_count = INDEX_HEADER.unpack_from(index, len(INDEX_MAGIC))
+        self.output_format = output_format.rstrip(b'\x00').decode('ascii')
+        self.users_count = users_count
+        if os.path.getsize(self.filename) != data_size:
+            raise ValueError(f'Index of {self.filename} is stale (the file was rewritten)')
+        self.data = self._map(self.filename)
+
+        offset = len(INDEX_MAGIC) + INDEX_HEADER.size
+        for typecode, count in (('q', users_count), ('Q', users_count + 1), ('Q', users_count), ('Q', users_count)):
+            self._columns.append(self._column(index, typecode, offset, count))
+            offset += 8 * count
+        self.epochs, self.starts, self.user_ids, self.positions = self._columns
+
+    @staticmethod
+    def _column(index, typecode, offset, count):
+        data = memoryview(index)[offset:offset + 8 * count]
+        if sys.byteorder == 'little':
+            # the column is used in place, a lookup only touches the pages it needs
+            return data.cast(typecode)
+        values = array(typecode)
+        values.frombytes(data)
+        data.release()
+        values.byteswap()
+        return values
+
+    def header(self):
+        """
+        Returns:
+            bytes of the output file that precede the rows (the TSV header)
+        """
+        end = self.starts[0] if self.users_count else len(self.data)
+        return self.data[:end]
+
+    def find_user(self, user_id):
+        """
+        Args:
+            user_id: user ID (string or integer)
+
+        Returns:
+            tuple of the start and end offsets of the user rows and the user creation epoch, None if there is
+            no such user
+
+        Raises:
+            ValueError if the user ID is not an integer
+        """
+        user_id = int(user_id)
+        ind = bisect.bisect_left(self.user_ids, user_id)
+        if ind == self.users_count or self.user_ids[ind] != user_id:
+            return None
+        position = self.positions[ind]
+        return self.starts[position], self.starts[position + 1], self.epochs[position]
+
+    def epoch_range(self, from_epoch=None, to_epoch=None):
+        """
+        Find the rows of the users created within the range
+
+        Args:
+            from_epoch: min user creation date (epoch, inclusive; no limit if None)
+            to_epoch: max user creation date (epoch, inclusive; no limit if None)
+
+        Returns:
+            tuple of the start and end offsets (equal if there are no such users)
+        """
+        first = bisect.bisect_left(self.epochs, from_epoch) if from_epoch is not None else 0
+        last = bisect.bisect_right(self.epochs, to_epoch) if to_epoch is not None else self.users_count
+        if first >= last:
+            return self.starts[first], self.starts[first]
+        return self.starts[first], self.starts[last]
+
+    def read(self, start, end, chunk_size=READ_CHUNK_SIZE):
+        """
+        Read a range of the output file
+
+        Returns:
+            yields bytes chunks
+        """
+        for offset in range(start, end, chunk_size):
+            yield self.data[offset:min(offset + chunk_size, end)]
+
+    def close(self):
+        # the mapped columns have to be released before the maps are closed
+        for column in self._columns:
+            if isinstance(column, memoryview):
+                column.release()
+        self._columns = []
+        for mapped in self._maps:
+            mapped.close()
+        self._maps = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,421 @@
+import json
+import logging
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+
+from .metrics import MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+# Default size of a journal segment file in bytes
+JOURNAL_SEGMENT_SIZE = 64 << 20
+# Frames are prefixed with their length and CRC32 (little-endian uint32 each)
+FRAME_HEADER = struct.Struct('<II')
+# Length value that tells the reader to go on with the next segment
+SEGMENT_END = 0xFFFFFFFF
+SEGMENT_SUFFIX = '.journal'
+CURSOR_FILENAME = 'cursor.json'
+# always: sync every write and commit, interval: sync at most every `fsync_interval` seconds,
+# never: leave it to the OS (a killed process loses nothing, an OS crash or a power loss may)
+FSYNC_POLICIES = ('always', 'interval', 'never')
+
+
+def segment_filename(directory, index):
+    return os.path.join(directory, f'{index:010d}{SEGMENT_SUFFIX}')
+
+
+class Segment:
+
+    def __init__(self, directory, index, size, writable=False):
+        """
+        Journal segment: a preallocated file of `size` bytes mapped into memory
+
+        Args:
+            directory: journal directory
+            index: segment number
+            size: segment size in bytes (only used to create the file)
+            writable: map the file for writing, creating it if it does not exist
+        """
+        self.index = index
+        filename = segment_filename(directory, index)
+        if writable:
+            fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if os.fstat(fd).st_size < size:
+                    if hasattr(os, 'posix_fallocate'):
+                        # reserve the blocks now, so the disk getting full fails here and not as SIGBUS on a write
+                        os.posix_fallocate(fd, 0, size)
+                    else:
+                        os.ftruncate(fd, size)
+                self.size = os.fstat(fd).st_size
+                self.map = mmap.mmap(fd, self.size)
+            finally:
+                os.close(fd)
+        else:
+            with open(filename, 'rb') as f:
+                self.size = os.fstat(f.fileno()).st_size
+                self.map = mmap.mmap(f.fileno(), self.size, access=mmap.ACCESS_READ)
+
+    def read_frame(self, offset, check=False):
+        """
+        Args:
+            offset: frame offset
+            check: verify the frame checksum (frames written by an interrupted run)
+
+        Returns:
+            tuple of the frame data (None if there is no complete frame at the offset, SEGMENT_END at the segment
+            end marker) and the offset of the next frame
+        """
+        if offset + FRAME_HEADER.size > self.size:
+            return SEGMENT_END, offset
+        length, crc = FRAME_HEADER.unpack_from(self.map, offset)
+        if length == SEGMENT_END:
+            return SEGMENT_END, offset
+        end = offset + FRAME_HEADER.size + length
+        if not length or end > self.size:
+            return None, offset
+        data = self.map[offset + FRAME_HEADER.size:end]
+        if check and zlib.crc32(data) != crc:
+            return None, offset
+        return data, end
+
+    def close(self):
+        self.map.close()
+
+
+class Journal:
+
+    def __init__(self, directory, segment_size=JOURNAL_SEGMENT_SIZE, fsync='interval', fsync_interval=1.0,
+                 resume=False, retain_segments=1, metrics=None):
+        """
+        Append-only journal of raw lines between the streamers and the processor, a crash-safe replacement of
+        the input queue. Lines are appended to memory-mapped segment files (a frame per line: FRAME_HEADER
+        followed by the bytes, the length is stored after the bytes, so the reader never sees a partial frame).
+        The processor reads the lines back with `get` (that also syncs the last lines of a quiet stream on time)
+        and commits the position of the exported ones with `commit` to the cursor file (replaced atomically).
+
+        A run resuming the journal reads on from the committed cursor, so the lines an interrupted run did not
+        export are processed again, and `iter_committed` gives the exported lines back (e.g. to restore the
+        deduplication state). Otherwise the reader starts at the end of the journal.
+
+        Segments entirely before the cursor are removed on commit, except for the last `retain_segments` ones,
+        so the journal does not grow with the run and `iter_committed` only replays the recent exported lines.
+
+        Usage:
+            journal = Journal(directory, resume=True)
+            journal.put(line)                # streamer side, thread-safe
+            line = journal.get(timeout=1)    # processor side (a single reader)
+            journal.commit(journal.tell())   # once the lines read so far are exported
+            journal.close()
+
+        Args:
+            directory: journal directory (created if it does not exist)
+            segment_size: size of a segment file in bytes (the longest line must fit into it)
+            fsync: sync policy of the written lines and the cursor (see FSYNC_POLICIES)
+            fsync_interval: max number of seconds between the syncs with the 'interval' policy
+            resume: read on from the committed cursor instead of the end of the journal
+            retain_segments: number of the committed segments kept before the segment of the cursor (all of them
+            if None)
+            metrics: MetricsRegistry instance shared by the pipeline stages (a private one if None)
+        """
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f'Unknown fsync policy: {fsync}')
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_size = segment_size
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.retain_segments = retain_segments
+        self.metrics = metrics or MetricsRegistry()
+        self.bytes_written = self.metrics.counter('journal_bytes_total', 'Bytes of lines appended to the journal')
+        self.syncs = self.metrics.counter('journal_syncs_total', 'Journal syncs to the disk')
+        self.sync_seconds = self.metrics.histogram('journal_sync_seconds', 'Time to sync the journal to the disk',
+                                                   buckets=(0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1))
+        self.segments_removed = self.metrics.counter('journal_segments_removed_total',
+                                                     'Committed journal segments removed')
+
+        self._lock = threading.Lock()
+        self._data_ready = threading.Condition(self._lock)
+        self._frames_written = 0
+        self._frames_read = 0
+        self._synced_offset = 0
+        self._synced_at = time.monotonic()
+
+        segments = self.segments()
+        # the first segment that was not removed (positions before it are gone)
+        self.first_segment = segments[0] if segments else 0
+        self._writer = Segment(directory, segments[-1] if segments else 0, segment_size, writable=True)
+        self._write_offset = self._find_end(self._writer)
+        end = (self._writer.index, self._write_offset)
+        self._committed = end
+        if resume:
+            # nothing was committed yet if there is no cursor
+            self._committed = self._load_cursor() or (self.first_segment, 0)
+        if self._committed > end:
+            logger.warning('Journal cursor %s is past the end of the journal. Reading from the end', self._committed)
+            self._committed = end
+        elif self._committed < (self.first_segment, 0):
+            logger.warning('Journal segments before the cursor were removed, the lines in between are lost')
+            self._committed = (self.first_segment, 0)
+        self._reader = None
+        self._read_position = self._committed
+        if resume:
+            self._frames_written = sum(1 for _ in self._iter_frames(self._committed, check=True))
+            logger.info('Resuming the journal at %s: %s lines to process', self._committed, self._frames_written)
+
+    def segments(self):
+        """
+        Returns:
+            sorted list of the segment numbers in the journal directory
+        """
+        return sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.directory)
+                      if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit())
+
+    @staticmethod
+    def _find_end(segment):
+        """
+        Find the end of the written frames, a frame torn by a crash (checksum mismatch) ends them too
+        """
+        offset = 0
+        while True:
+            data, next_offset = segment.read_frame(offset, check=True)
+            if data is None or data is SEGMENT_END:
+                return offset
+            offset = next_offset
+
+    @property
+    def cursor_filename(self):
+        return os.path.join(self.directory, CURSOR_FILENAME)
+
+    def _load_cursor(self):
+        try:
+            with open(self.cursor_filename) as f:
+                cursor = json.load(f)
+            return cursor['segment'], cursor['offset']
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError):
+            logger.warning('Can not read the journal cursor', exc_info=True)
+            return None
+
+    def qsize(self):
+        """
+        Number of lines written but not read yet
+        """
+        return max(self._frames_written - self._frames_read, 0)
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def _sync(self, force=False):
+        """
+        Flush the written part of the current segment to the disk according to the fsync policy (under the lock)
+        """
+        if self.fsync == 'never' or self._synced_offset == self._write_offset:
+            return
+        if not force and self.fsync == 'interval' and time.monotonic() - self._synced_at < self.fsync_interval:
+            return
+        started = time.monotonic()
+        # the flushed range has to start at a page boundary
+        start = self._synced_offset - self._synced_offset % mmap.PAGESIZE
+        self._writer.map.flush(start, self._write_offset - start)
+        self._synced_offset = self._write_offset
+        self._synced_at = time.monotonic()
+        self.syncs.inc()
+        self.sync_seconds.observe(self._synced_at - started)
+
+    def _sync_delay(self):
+        """
+        Number of seconds till the written lines are due to be synced with the 'interval' policy (under the lock)
+
+        Returns:
+            float or None if there is nothing to sync on time
+        """
+        if self.fsync != 'interval' or self._synced_offset == self._write_offset:
+            return None
+        return max(self._synced_at + self.fsync_interval - time.monotonic(), 0)
+
+    def _next_segment(self):
+        if self._write_offset + FRAME_HEADER.size <= self._writer.size:
+            FRAME_HEADER.pack_into(self._writer.map, self._write_offset, SEGMENT_END, 0)
+            self._write_offset += FRAME_HEADER.size
+        self._sync(force=True)
+        self._writer.close()
+        self._writer = Segment(self.directory, self._writer.index + 1, self.segment_size, writable=True)
+        self._write_offset = self._synced_offset = 0
+
+    def _put_frame(self, data):
+        length = len(data)
+        frame_size = FRAME_HEADER.size + length
+        if not length:
+            return
+        # room for the segment end marker is always kept
+        if frame_size + FRAME_HEADER.size > self.segment_size:
+            raise ValueError(f'Line of {length} bytes does not fit into the journal segment of {self.segment_size} '
+                             f'bytes')
+        if self._write_offset + frame_size + FRAME_HEADER.size > self._writer.size:
+            self._next_segment()
+        offset = self._write_offset
+        self._writer.map[offset + FRAME_HEADER.size:offset + frame_size] = data
+        FRAME_HEADER.pack_into(self._writer.map, offset, length, zlib.crc32(data))
+        self._write_offset += frame_size
+        self._frames_written += 1
+        self.bytes_written.inc(length)
+
+    def put(self, item, block=True, timeout=None):
+        """
+        Append a raw line or a list of them (streamer side). Empty lines are skipped.
+        The arguments other than the item are accepted for compatibility with queue.Queue and ignored.
+
+        Args:
+            item: bytes-like object or a list of them
+
+        Raises:
+            ValueError if a line does not fit into a segment
+        """
+        with self._data_ready:
+            for data in item if isinstance(item, list) else (item, ):
+                self._put_frame(data)
+            self._sync(force=self.fsync == 'always')
+            self._data_ready.notify()
+
+    def _open_reader(self, index):
+        if self._reader is not None:
+            if self._reader.index == index:
+                return self._reader
+            self._reader.close()
+        self._reader = Segment(self.directory, index, self.segment_size)
+        return self._reader
+
+    def _iter_frames(self, start, end=None, check=False):
+        """
+        Iterate the frames from the `start` position till the `end` one (the end of the written frames if None),
+        using a reader of its own
+        """
+        index, offset = start
+        end = end or (self._writer.index, self._write_offset)
+        while (index, offset) < end:
+            segment = Segment(self.directory, index, self.segment_size)
+            try:
+                while (index, offset) < end:
+                    data, offset = segment.read_frame(offset, check)
+                    if data is None:
+                        logger.warning('Invalid journal frame in segment %s at offset %s', index, offset)
+                        return
+                    if data is SEGMENT_END:
+                        break
+                    yield data
+            finally:
+                segment.close()
+            index, offset = index + 1, 0
+
+    def iter_committed(self):
+        """
+        Iterate the lines committed by the previous runs (from the first segment kept)
+
+        Returns:
+            yields bytes
+        """
+        yield from self._iter_frames((self.first_segment, 0), self._committed)
+
+    def get(self, timeout=None):
+        """
+        Read the next line (a single reader), a drop-in for `queue.Queue.get`
+
+        Args:
+            timeout: max number of seconds to wait for a line (no limit if None)
+
+        Returns:
+            bytes
+
+        Raises:
+            queue.Empty if there is no line within the timeout
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._data_ready:
+            while self._read_position >= (self._writer.index, self._write_offset):
+                # the stream is quiet: sync the last lines once the interval is over instead of on the next put
+                self._sync()
+                wait = self._sync_delay()
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise queue.Empty
+                    wait = remaining if wait is None else min(wait, remaining)
+                self._data_ready.wait(wait)
+            writer_index = self._writer.index
+        index, offset = self._read_position
+        while True:
+            data, next_offset = self._open_reader(index).read_frame(offset)
+            # frames before the writer position are complete
+            if data is SEGMENT_END and index < writer_index:
+                index, offset = index + 1, 0
+                continue
+            if data is None or data is SEGMENT_END:
+                raise queue.Empty
+            self._read_position = (index, next_offset)
+            self._frames_read += 1
+            return data
+
+    def tell(self):
+        """
+        Returns:
+            position of the reader: tuple of the segment number and the offset
+        """
+        return self._read_position
+
+    def commit(self, position):
+        """
+        Persist the position the lines before it are processed up to, so a resumed run reads on from it
+
+        Args:
+            position: position returned by `tell`
+        """
+        if position is None or position <= self._committed:
+            return
+        with self._lock:
+            # the cursor must not point past the synced lines
+            self._sync(force=True)
+        tmp_filename = self.cursor_filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            json.dump({'segment': position[0], 'offset': position[1]}, f)
+            if self.fsync != 'never':
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_filename, self.cursor_filename)
+        self._committed = position
+        logger.debug('Journal cursor committed at %s', position)
+        self._remove_segments()
+
+    def _remove_segments(self):
+        """
+        Remove the committed segments but the last `retain_segments` ones (the reader and the writer are at
+        the cursor segment or after it)
+        """
+        if self.retain_segments is None:
+            return
+        end = self._committed[0] - self.retain_segments
+        while self.first_segment < end:
+            try:
+                os.remove(segment_filename(self.directory, self.first_segment))
+                self.segments_removed.inc()
+            except FileNotFoundError:
+                pass
+            self.first_segment += 1
+            logger.debug('Journal segment %s removed', self.first_segment - 1)
+
+    def close(self):
+        """
+        Sync the written lines and release the segment maps (the lines not committed stay for a resumed run)
+        """
+        with self._lock:
+            self._sync(force=True)
+            self._writer.close()
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
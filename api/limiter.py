@@ -1,43 +1,118 @@
+import asyncio
 import logging
 import time
-from datetime import datetime, timedelta
+
+from .metrics import MetricsRegistry
 
 logger = logging.getLogger(__name__)
 
 
 class Limiter:
 
-    def __init__(self, time_limit, message_limit, message_queue, barrier, stop_event):
+    def __init__(self, time_limit, message_limit, barrier, stop_event, byte_limit=None, user_message_limit=None,
+                 metrics=None):
         """
-        Limiter provides a way of applying restrictions on the max time period and max messages count in the queue.
+        Limiter provides a way of applying restrictions on the max time period, max messages count,
+        max size of the messages and max messages count per user.
+
+        The time limit is tracked against a monotonic deadline, while the other limits are checked when the
+        processor notifies the limiter about a new message (see `accept`), so the limiter thread is idle
+        till either the deadline or the STOP event.
 
         Args:
             time_limit: amount of seconds that limiter instance should wait till setting the STOP event
-            message_limit: size of the message queue
-            message_queue: limited (by size) message queue
+            (no time limit if None)
+            message_limit: max number of accepted messages (unlimited if None)
             barrier: synchronization primitive to sync all threads
-            stop_event: threading Event instance. Is set when either time is out or a message queue is full
+            stop_event: threading Event instance. Is set when either time is out or any of the limits is reached
+            byte_limit: max total size (in bytes) of the accepted raw messages (unlimited if None)
+            user_message_limit: max number of accepted messages per user (unlimited if None)
+            metrics: MetricsRegistry instance shared by the pipeline stages (a private one if None)
         """
         self.time_limit = time_limit
         self.message_limit = message_limit
-        self.message_queue = message_queue
         self.barrier = barrier
         self.stop_event = stop_event
+        self.byte_limit = byte_limit
+        self.user_message_limit = user_message_limit
+
+        self.messages_count = 0
+        self.bytes_count = 0
+        self.user_messages = {}
+
+        self.metrics = metrics or MetricsRegistry()
+        self.metrics.gauge('limiter_messages', 'Messages accounted by the limiter', function=lambda: self.messages_count)
+        self.metrics.gauge('limiter_bytes', 'Bytes of the messages accounted by the limiter',
+                           function=lambda: self.bytes_count)
+        self.user_limit_skipped = self.metrics.counter('user_limit_skipped_total',
+                                                       'Messages skipped as their users reached the messages limit')
         logger.info('Limiter is set with a %s sec time limit and %s max messages number', time_limit, message_limit)
 
+    def accept(self, message_size=0, user_id=None):
+        """
+        Check if a new message fits into the limits and account it. Sets the STOP event as soon as the message
+        limit is reached or the byte budget is exhausted. Expects a single caller (the processor).
+
+        Args:
+            message_size: size of the raw message in bytes
+            user_id: ID of the message author
+
+        Returns:
+            bool, True if the message should be kept
+        """
+        if self.stop_event.is_set():
+            return False
+        if self.message_limit is not None and self.messages_count >= self.message_limit:
+            # a zero limit, nothing is accepted
+            self.stop_event.set()
+            return False
+
+        if self.user_message_limit is not None and self.user_messages.get(user_id, 0) >= self.user_message_limit:
+            logger.debug('User %s reached the messages limit. Skipping the message', user_id)
+            self.user_limit_skipped.inc()
+            return False
+
+        if self.byte_limit is not None and self.bytes_count + message_size > self.byte_limit:
+            logger.warning('Byte budget is exhausted. Stopping further streaming')
+            self.stop_event.set()
+            return False
+
+        self.messages_count += 1
+        self.bytes_count += message_size
+        if self.user_message_limit is not None:
+            self.user_messages[user_id] = self.user_messages.get(user_id, 0) + 1
+
+        if self.message_limit is not None and self.messages_count >= self.message_limit:
+            logger.warning('Message limit is reached. Stopping further streaming')
+            self.stop_event.set()
+        return True
+
     def start(self):
         """
-        Start the limiter and wait till the time goes out or the message queue is full (whichever comes first).
+        Start the limiter and wait till the time goes out or the STOP event is set (whichever comes first).
         """
         self.barrier.wait()
         logger.info('Starting Limiter')
-        end_dt = datetime.utcnow() + timedelta(seconds=self.time_limit)
-        while datetime.utcnow() <= end_dt and not self.stop_event.is_set():
-            if self.message_queue.full():
-                logger.warning('Message queue is full. Stopping further streaming')
-                break
-            # Relax CPU usage:
-            time.sleep(0.1)
+        if self.time_limit is None:
+            self.stop_event.wait()
+        else:
+            deadline = time.monotonic() + self.time_limit
+            remaining = self.time_limit
+            while remaining > 0 and not self.stop_event.wait(remaining):
+                remaining = deadline - time.monotonic()
+
+        logger.info('Emitting STOP event')
+        self.stop_event.set()
+
+    async def start_async(self):
+        """
+        Coroutine version of `start` for the asyncio engine (stop_event is an asyncio.Event instance).
+        """
+        logger.info('Starting Limiter')
+        try:
+            await asyncio.wait_for(self.stop_event.wait(), self.time_limit)
+        except asyncio.TimeoutError:
+            pass
 
         logger.info('Emitting STOP event')
         self.stop_event.set()
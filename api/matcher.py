@@ -0,0 +1,205 @@
+import logging
+import os
+import re
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Characters replaced in the phrase part of a routed output filename
+FILENAME_UNSAFE = re.compile(r'[^\w.#@-]+')
+# Filename part of the routed output of the tweets that matched no phrase (e.g. Twitter matched them by an expanded
+# URL or a mention entity), phrase parts never start with an underscore
+UNMATCHED_ROUTE = '_unmatched'
+
+
+def parse_track(track):
+    """
+    Split the track parameter into phrases the way Twitter does: commas separate phrases (OR), spaces separate
+    the terms of a phrase (AND)
+
+    Args:
+        track: comma-separated string of phrases or a list of them (track groups)
+
+    Returns:
+        list of unique phrases (terms case-folded and separated by a single space) in the track order
+    """
+    groups = [track] if isinstance(track, str) else track
+    phrases = {}
+    for group in groups:
+        for phrase in group.split(','):
+            terms = phrase.casefold().split()
+            if terms:
+                phrases.setdefault(' '.join(terms), None)
+    return list(phrases)
+
+
+def _is_word_char(char):
+    return char.isalnum() or char == '_'
+
+
+class TrackMatcher:
+
+    def __init__(self, track):
+        """
+        Matches tweet texts against the track phrases in a single pass. The terms of all phrases are compiled into
+        an Aho-Corasick automaton (a trie with failure links), so the text is scanned once whatever the number of
+        phrases, and a phrase matches once all its terms are found, in any order.
+
+        Twitter matching rules: the case is ignored, punctuation and special characters in the text separate
+        the terms ('bieber' matches 'Bieber!', '#bieber', '@bieber' and 'http://bieber.com', but neither
+        'BieberFever' nor '#nobieber'), while the punctuation of a term is a part of it ('#bieber' matches '#bieber'
+        only). Only the text is matched, the URL, hashtag and mention entities Twitter checks as well are not.
+
+        Args:
+            track: comma-separated string of phrases or a list of them (see parse_track)
+        """
+        self.phrases = parse_track(track)
+        # term -> indexes of the phrases it belongs to
+        self.term_phrases = {}
+        self.phrase_sizes = []
+        for ind, phrase in enumerate(self.phrases):
+            terms = set(phrase.split(' '))
+            self.phrase_sizes.append(len(terms))
+            for term in terms:
+                self.term_phrases.setdefault(term, []).append(ind)
+        self._build(self.term_phrases)
+        self.route_names = route_names(self.phrases)
+
+    def _build(self, terms):
+        """
+        Build the automaton: `goto` transitions of the trie states, `fail` links to the state of the longest proper
+        suffix that is a trie prefix too, and `outputs` - terms ending at a state (including the ones of the
+        suffix states)
+        """
+        self.goto = [{}]
+        self.outputs = [()]
+        for term in terms:
+            state = 0
+            for char in term:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto.append({})
+                    self.outputs.append(())
+                    self.goto[state][char] = next_state
+                state = next_state
+            # a term is matched at the token boundaries only where it starts / ends with a word character
+            self.outputs[state] = ((term, _is_word_char(term[0]), _is_word_char(term[-1])), )
+
+        self.fail = [0] * len(self.goto)
+        states = deque(self.goto[0].values())
+        while states:
+            state = states.popleft()
+            for char, next_state in self.goto[state].items():
+                states.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.outputs[next_state] += self.outputs[self.fail[next_state]]
+
+    def match_terms(self, text):
+        """
+        Args:
+            text: tweet text
+
+        Returns:
+            set of the terms found in the text
+        """
+        text = text.casefold()
+        goto, fail, outputs = self.goto, self.fail, self.outputs
+        last = len(text) - 1
+        found = set()
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if not outputs[state]:
+                continue
+            for term, word_start, word_end in outputs[state]:
+                if term in found:
+                    continue
+                if word_end and position < last and _is_word_char(text[position + 1]):
+                    continue
+                start = position - len(term)
+                if word_start and start >= 0 and _is_word_char(text[start]):
+                    continue
+                found.add(term)
+        return found
+
+    def match(self, text):
+        """
+        Args:
+            text: tweet text
+
+        Returns:
+            tuple of the matched phrases in the track order
+        """
+        found = self.match_terms(text) if text else ()
+        if not found:
+            return ()
+        hits = {}
+        for term in found:
+            for ind in self.term_phrases[term]:
+                hits[ind] = hits.get(ind, 0) + 1
+        return tuple(self.phrases[ind] for ind in sorted(hits) if hits[ind] == self.phrase_sizes[ind])
+
+
+def naive_match(phrases, text):
+    """
+    Reference matcher for the benchmark: a substring check per term of every phrase (no token boundaries)
+
+    Args:
+        phrases: list of phrases (see parse_track)
+        text: tweet text
+
+    Returns:
+        tuple of the matched phrases
+    """
+    text = text.casefold()
+    return tuple(phrase for phrase in phrases if all(term in text for term in phrase.split(' ')))
+
+
+def route_names(phrases):
+    """
+    Build the filename parts of the routed outputs of the phrases (see route_filename)
+
+    Args:
+        phrases: list of phrases
+
+    Returns:
+        dict of phrase -> unique filename part (e.g. 'justin bieber' -> 'justin_bieber')
+    """
+    names = {}
+    used = {UNMATCHED_ROUTE}
+    for phrase in phrases:
+        name = FILENAME_UNSAFE.sub('_', phrase).strip('_') or 'phrase'
+        unique_name = name
+        ind = 1
+        while unique_name in used:
+            ind += 1
+            unique_name = f'{name}-{ind}'
+        used.add(unique_name)
+        names[phrase] = unique_name
+    return names
+
+
+def route_filename(filename, name):
+    """
+    Build the filename of a routed output. The filename may contain the `{phrase}` placeholder, otherwise the name
+    is inserted before the extension (output.csv -> output-justin_bieber.csv)
+
+    Args:
+        filename: output filename (template)
+        name: filename part of the phrase (see route_names) or UNMATCHED_ROUTE
+
+    Returns:
+        str, filename
+    """
+    if '{phrase}' in filename:
+        return filename.replace('{phrase}', name)
+
+    directory, base_name = os.path.split(filename)
+    base, dot, extension = base_name.partition('.')
+    return os.path.join(directory, f'{base}-{name}{dot}{extension}')
@@ -0,0 +1,304 @@
+import bisect
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (in seconds) of the histogram buckets: from 1 microsecond to 1 minute
+DEFAULT_BUCKETS = (0.000001, 0.000005, 0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5,
+                   1, 5, 10, 60)
+
+
+def format_labels(labels, **extra_labels):
+    """
+    Render labels in the Prometheus format, e.g. {stream="1"} (an empty string if there are no labels)
+    """
+    labels = dict(labels or {}, **extra_labels)
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels.items()) + '}'
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help_text='', labels=None):
+        """
+        Monotonically increasing value. Increments are locked, since a metric may be updated by several threads
+        (e.g. the processor and its background exporter), while the reporter only reads it.
+
+        Args:
+            name: metric name
+            help_text: metric description
+            labels: optional dict of label names and values (e.g. {'stream': '1'})
+        """
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels or {}
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, value=1):
+        with self._lock:
+            self.value += value
+
+    def samples(self):
+        return [(self.name + format_labels(self.labels), self.value)]
+
+
+class Gauge:
+    type = 'gauge'
+
+    def __init__(self, name, help_text='', labels=None, function=None):
+        """
+        Value that goes up and down (a set is a single assignment, so it needs no lock)
+
+        Args:
+            name: metric name
+            help_text: metric description
+            labels: optional dict of label names and values
+            function: optional callable that returns the current value (e.g. a queue size) on every collection
+        """
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels or {}
+        self.function = function
+        self._value = 0
+
+    def set(self, value):
+        self._value = value
+
+    @property
+    def value(self):
+        if self.function is None:
+            return self._value
+        try:
+            return self.function()
+        except NotImplementedError:
+            # e.g. multiprocessing.Queue.qsize on macOS
+            return None
+
+    def samples(self):
+        return [(self.name + format_labels(self.labels), self.value)]
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, help_text='', labels=None, buckets=DEFAULT_BUCKETS):
+        """
+        Distribution of the observed values over fixed buckets. Observations are locked (see Counter)
+
+        Args:
+            name: metric name
+            help_text: metric description
+            labels: optional dict of label names and values
+            buckets: sorted upper bounds of the buckets (the +Inf bucket is implied)
+        """
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels or {}
+        self.buckets = tuple(buckets)
+        # the last one is the +Inf bucket
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.bucket_counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    @property
+    def value(self):
+        return self.count
+
+    def quantile(self, fraction):
+        """
+        Estimate a quantile as the upper bound of the bucket it falls into
+
+        Args:
+            fraction: quantile as a fraction (e.g. 0.99)
+
+        Returns:
+            bucket upper bound (inf for the last bucket) or None if nothing was observed
+        """
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        cumulative = 0
+        for upper_bound, bucket_count in zip(self.buckets + (float('inf'), ), self.bucket_counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return upper_bound
+        return float('inf')
+
+    def samples(self):
+        samples = []
+        cumulative = 0
+        for upper_bound, bucket_count in zip(self.buckets, self.bucket_counts):
+            cumulative += bucket_count
+            samples.append((f'{self.name}_bucket' + format_labels(self.labels, le=f'{upper_bound:g}'), cumulative))
+        samples.append((f'{self.name}_bucket' + format_labels(self.labels, le='+Inf'), self.count))
+        samples.append((f'{self.name}_sum' + format_labels(self.labels), self.sum))
+        samples.append((f'{self.name}_count' + format_labels(self.labels), self.count))
+        return samples
+
+
+class MetricsRegistry:
+
+    def __init__(self, prefix='twitter_'):
+        """
+        Registry of the pipeline metrics shared by the streamer, the processor and the limiter.
+        Metrics are created on the first request and returned as is afterwards, so stages may share them by name
+        (and labels).
+
+        Args:
+            prefix: prefix of all metric names
+        """
+        self.prefix = prefix
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, metric_cls, name, help_text, labels, **kwargs):
+        name = self.prefix + name
+        key = name + format_labels(labels)
+        with self._lock:
+            metric = self.metrics.get(key)
+            if metric is None:
+                metric = self.metrics[key] = metric_cls(name, help_text, labels, **kwargs)
+            elif not isinstance(metric, metric_cls):
+                raise ValueError(f'Metric {key} is already registered as a {metric.type}')
+        return metric
+
+    def counter(self, name, help_text='', labels=None):
+        return self._get_or_create(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text='', labels=None, function=None):
+        gauge = self._get_or_create(Gauge, name, help_text, labels)
+        if function is not None:
+            gauge.function = function
+        return gauge
+
+    def histogram(self, name, help_text='', labels=None, buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, help_text, labels, buckets=buckets)
+
+    def get(self, name, labels=None):
+        """
+        Returns:
+            metric registered under the name (without the prefix) and labels or None
+        """
+        return self.metrics.get(self.prefix + name + format_labels(labels))
+
+    def snapshot(self):
+        """
+        Returns:
+            dict of metric name (without the prefix, with labels, e.g. 'lines_received_total{stream="1"}') ->
+            current value (observations count for histograms)
+        """
+        prefix_size = len(self.prefix)
+        return {name[prefix_size:]: metric.value for name, metric in list(self.metrics.items())}
+
+    def to_prometheus(self):
+        """
+        Render all metrics in the Prometheus text exposition format
+
+        Returns:
+            str
+        """
+        lines = []
+        described = set()
+        # samples of a metric are grouped together
+        for _, _, metric in sorted((metric.name, key, metric) for key, metric in list(self.metrics.items())):
+            if metric.name not in described:
+                described.add(metric.name)
+                if metric.help_text:
+                    lines.append(f'# HELP {metric.name} {metric.help_text}')
+                lines.append(f'# TYPE {metric.name} {metric.type}')
+            for sample_name, value in metric.samples():
+                if value is not None:
+                    lines.append(f'{sample_name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, filename):
+        """
+        Write all metrics to a Prometheus text file (e.g. for the node exporter textfile collector).
+        The file is replaced atomically, so a scraper never reads a partial file.
+
+        Args:
+            filename: path to the file
+
+        Returns:
+            None
+        """
+        tmp_filename = f'{filename}.{os.getpid()}.tmp'
+        with open(tmp_filename, 'w') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_filename, filename)
+
+
+class MetricsReporter:
+
+    def __init__(self, registry, interval=10, filename=None):
+        """
+        MetricsReporter periodically logs a summary of the metrics and writes them to a Prometheus text file
+
+        Args:
+            registry: MetricsRegistry instance
+            interval: number of seconds between reports
+            filename: Prometheus text file to write (not written if None)
+        """
+        self.registry = registry
+        self.interval = interval
+        self.filename = filename
+        self.thread = None
+        self._stopped = threading.Event()
+
+    def summary(self):
+        """
+        Returns:
+            str, one-line summary of all metrics (histograms are summarized by the count and the p50/p99 buckets)
+        """
+        prefix_size = len(self.registry.prefix)
+        items = []
+        for name, metric in sorted(list(self.registry.metrics.items())):
+            name = name[prefix_size:]
+            if isinstance(metric, Histogram):
+                items.append(f'{name}={metric.count} (p50<={self._format(metric.quantile(0.5))}, '
+                             f'p99<={self._format(metric.quantile(0.99))})')
+            else:
+                items.append(f'{name}={self._format(metric.value)}')
+        return ', '.join(items)
+
+    def report(self):
+        logger.info('Metrics: %s', self.summary())
+        if self.filename:
+            try:
+                self.registry.write_prometheus(self.filename)
+            except OSError:
+                logger.exception('Can not write metrics to "%s"', self.filename)
+
+    @staticmethod
+    def _format(value):
+        return f'{value:g}' if isinstance(value, float) else value
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.report()
+
+    def start(self):
+        self.thread = threading.Thread(name='metrics-reporter', target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop the periodic reports and emit the final one
+        """
+        self._stopped.set()
+        if self.thread:
+            self.thread.join()
+        self.report()
@@ -1,19 +1,76 @@
+import calendar
 import logging
-from datetime import datetime
+from functools import lru_cache
+from operator import attrgetter
 
 logger = logging.getLogger(__name__)
 
+# Many messages share the same creation date string, so the parsed values are memoized
+CREATED_AT_CACHE_SIZE = 65536
+MONTHS = {
+    'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+    'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12,
+}
+# Twitter snowflake epoch (milliseconds) and the smallest ID generated by snowflake
+TWITTER_EPOCH_MS = 1288834974657
+MIN_SNOWFLAKE_ID = 29700859247
+
+
+@lru_cache(maxsize=CREATED_AT_CACHE_SIZE)
+def parse_created_at(created_at):
+    """
+    Parse Twitter's fixed creation date format (e.g. "Sat Sep 14 19:57:20 +0000 2019") straight to epoch seconds.
+    Equivalent to `datetime.strptime(created_at, '%a %b %d %H:%M:%S %z %Y').timestamp()`, but much faster.
+
+    Args:
+        created_at: creation date string
+
+    Returns:
+        int, epoch seconds
+    """
+    try:
+        _, month, day, time_str, offset, year = created_at.split(' ')
+        hour, minute, second = time_str.split(':')
+        epoch = calendar.timegm((int(year), MONTHS[month], int(day), int(hour), int(minute), int(second)))
+        offset_seconds = int(offset[1:3]) * 3600 + int(offset[3:5]) * 60
+    except (AttributeError, ValueError, KeyError):
+        raise ValueError(f'Invalid creation date: {created_at!r}')
+
+    if offset[0] == '-':
+        return epoch + offset_seconds
+    return epoch - offset_seconds
+
+
+def snowflake_to_epoch(id_str):
+    """
+    Extract the creation time (epoch seconds) from a snowflake ID.
+
+    Args:
+        id_str: snowflake ID string
+
+    Returns:
+        int, epoch seconds or None if the ID was not generated by snowflake
+    """
+    try:
+        snowflake = int(id_str)
+    except (TypeError, ValueError):
+        return None
+    if snowflake < MIN_SNOWFLAKE_ID:
+        return None
+    return ((snowflake >> 22) + TWITTER_EPOCH_MS) // 1000
+
 
 class User:
     """
     Basic User model
     """
+    __slots__ = ('id_str', 'name', 'screen_name', 'created_at', '_tweets')
 
     def __init__(self, id_str=None, name=None, screen_name=None, created_at=None, **kwargs):
         self.id_str = id_str
         self.name = name
         self.screen_name = screen_name
-        self.created_at = datetime.strptime(created_at, '%a %b %d %H:%M:%S %z %Y')
+        self.created_at = created_at if isinstance(created_at, int) else parse_created_at(created_at)
 
         self._tweets = set()
 
@@ -44,23 +101,32 @@ class User:
     def add_tweet(self, tweet):
         self._tweets.add(tweet)
 
+    def clear_tweets(self):
+        self._tweets = set()
+
     @property
     def tweets(self):
-        return sorted(self._tweets, key=lambda tweet: tweet.created_at)
+        return sorted(self._tweets, key=attrgetter('created_at', 'id_str'))
 
 
 class Tweet:
     """
     Basic Tweet model
     """
+    __slots__ = ('id_str', 'created_at', 'text', 'user')
 
-    def __init__(self, id_str=None, created_at=None, text=None, **kwargs):
+    def __init__(self, id_str=None, created_at=None, text=None, use_snowflake=False, **kwargs):
         self.id_str = id_str
-        self.created_at = datetime.strptime(created_at, '%a %b %d %H:%M:%S %z %Y')
+        self.created_at = None
+        if use_snowflake:
+            self.created_at = snowflake_to_epoch(id_str)
+        if self.created_at is None:
+            self.created_at = created_at if isinstance(created_at, int) else parse_created_at(created_at)
         self.text = text
+        self.user = None
 
     @classmethod
-    def from_dict(cls, tweet_payload):
+    def from_dict(cls, tweet_payload, use_snowflake=False):
         tweet_fields = {'id_str', 'created_at', 'text'}
 
         if not set(tweet_payload.keys()) >= tweet_fields:
@@ -71,6 +137,7 @@ class Tweet:
             id_str=tweet_payload['id_str'],
             created_at=tweet_payload['created_at'],
             text=tweet_payload['text'],
+            use_snowflake=use_snowflake,
         )
 
     def __hash__(self):
@@ -81,3 +148,19 @@ class Tweet:
 
     def __repr__(self):
         return f'ID {self.id_str} {self.created_at}'
+
+
+class AnnotatedTweet(Tweet):
+    """
+    Tweet model with the matched track phrases and the collapsed reference, only built when the tweets are tagged,
+    routed or collapsed (so the plain tweets do not carry the extra slots)
+    """
+    __slots__ = ('matched', 'ref_type', 'ref')
+
+    def __init__(self, id_str=None, created_at=None, text=None, use_snowflake=False, **kwargs):
+        super().__init__(id_str, created_at, text, use_snowflake, **kwargs)
+        # track phrases the text matched (see matcher.TrackMatcher), None if not matched
+        self.matched = None
+        # the retweeted or quoted tweet ('retweet' or 'quote', canonical.CanonicalTweet), if collapsed
+        self.ref_type = None
+        self.ref = None
@@ -0,0 +1,234 @@
+import logging
+import pickle
+import queue
+import random
+import struct
+import tempfile
+import time
+
+from .metrics import MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+# A blocked producer checks the STOP event every that many seconds
+BLOCK_CHECK_INTERVAL = 0.5
+SPILL_FRAME = struct.Struct('<I')
+
+
+class BoundedInputQueue(queue.Queue):
+    """
+    Input queue holding at most `maxsize` items (raw messages or batches of them). Subclasses define what happens
+    to a new item when the queue is full, the `put` arguments other than the item are accepted for compatibility
+    with queue.Queue and ignored. Dropped and spilled messages (not batches) are counted in the metrics, under
+    the queue lock as several streamers may share the queue.
+    """
+    policy = None
+
+    def __init__(self, maxsize, stop_event=None, metrics=None, **kwargs):
+        """
+        Args:
+            maxsize: max number of items kept in memory
+            stop_event: STOP event of the pipeline, a blocked producer gives up once it is set
+            metrics: MetricsRegistry instance shared by the pipeline stages (a private one if None)
+        """
+        super().__init__(maxsize)
+        self.stop_event = stop_event
+        self.metrics = metrics or MetricsRegistry()
+        self.dropped = self.metrics.counter('input_dropped_total',
+                                            'Messages dropped by the input queue overflow policy')
+
+    @staticmethod
+    def _messages_count(item):
+        return len(item) if isinstance(item, list) else 1
+
+    def _put_locked(self, item):
+        self._put(item)
+        self.unfinished_tasks += 1
+        self.not_empty.notify()
+
+    def close(self):
+        pass
+
+
+class BlockingInputQueue(BoundedInputQueue):
+    """
+    Blocks the streamer till the processor catches up (the stream itself then falls behind and Twitter may
+    disconnect it as a stalled client). Messages are only dropped if the pipeline stops while the streamer waits.
+    """
+    policy = 'block'
+
+    def __init__(self, maxsize, stop_event=None, metrics=None, **kwargs):
+        super().__init__(maxsize, stop_event, metrics)
+        self.blocked_seconds = self.metrics.counter('input_blocked_seconds_total',
+                                                    'Time the streamer waited for the room in the input queue')
+
+    def put(self, item, block=True, timeout=None):
+        started = None
+        dropped = 0
+        while True:
+            try:
+                super().put(item, timeout=BLOCK_CHECK_INTERVAL)
+                break
+            except queue.Full:
+                if started is None:
+                    started = time.monotonic()
+                if self.stop_event is not None and self.stop_event.is_set():
+                    dropped = self._messages_count(item)
+                    break
+        if started is not None:
+            with self.mutex:
+                self.blocked_seconds.inc(time.monotonic() - started)
+                self.dropped.inc(dropped)
+
+
+class DropNewestInputQueue(BoundedInputQueue):
+    """
+    Drops new items while the queue is full
+    """
+    policy = 'drop_newest'
+
+    def put(self, item, block=True, timeout=None):
+        with self.not_full:
+            if self._qsize() >= self.maxsize:
+                self.dropped.inc(self._messages_count(item))
+            else:
+                self._put_locked(item)
+
+
+class DropOldestInputQueue(BoundedInputQueue):
+    """
+    Drops the oldest queued item to make room for a new one, so the processor keeps up with the live stream
+    """
+    policy = 'drop_oldest'
+
+    def put(self, item, block=True, timeout=None):
+        with self.not_full:
+            if self._qsize() >= self.maxsize:
+                self.dropped.inc(self._messages_count(self._get()))
+                self.unfinished_tasks -= 1
+            self._put_locked(item)
+
+
+class SampleInputQueue(BoundedInputQueue):
+    """
+    Keeps a uniform sample of the items arriving while the queue is full (reservoir sampling): the n-th item of
+    an overflow replaces a random queued item with the probability maxsize / (maxsize + n), otherwise it is
+    dropped. The order of the queued items is not kept.
+    """
+    policy = 'sample'
+
+    def __init__(self, maxsize, stop_event=None, metrics=None, seed=None, **kwargs):
+        super().__init__(maxsize, stop_event, metrics)
+        self.random = random.Random(seed)
+        # number of items arrived since the queue got full
+        self.overflow_count = 0
+
+    def put(self, item, block=True, timeout=None):
+        with self.not_full:
+            if self._qsize() < self.maxsize:
+                self.overflow_count = 0
+                self._put_locked(item)
+                return
+
+            self.overflow_count += 1
+            index = self.random.randrange(self.maxsize + self.overflow_count)
+            if index < self.maxsize:
+                self.dropped.inc(self._messages_count(self.queue[index]))
+                self.queue[index] = item
+            else:
+                self.dropped.inc(self._messages_count(item))
+
+
+class SpillInputQueue(BoundedInputQueue):
+    """
+    Keeps up to `maxsize` items in memory and appends the rest to a temporary file, reading them back in order as
+    the processor catches up. Nothing is dropped, the disk usage is bounded by the run limits only.
+    """
+    policy = 'spill'
+
+    def __init__(self, maxsize, stop_event=None, metrics=None, spill_dir=None, **kwargs):
+        """
+        Args:
+            maxsize: max number of items kept in memory
+            stop_event: STOP event of the pipeline
+            metrics: MetricsRegistry instance shared by the pipeline stages (a private one if None)
+            spill_dir: directory of the spill file (the system temporary directory if None)
+        """
+        super().__init__(maxsize, stop_event, metrics)
+        self.memory_size = maxsize
+        # the memory part is bounded by the spilling, so `put` never blocks
+        self.maxsize = 0
+        self.spill_dir = spill_dir
+        self.spill_file = None
+        self.spilled_items = 0
+        self.read_offset = 0
+        self.write_offset = 0
+        self.spilled = self.metrics.counter('input_spilled_total', 'Messages spilled to the disk by the input queue')
+        self.metrics.gauge('input_spill_bytes', 'Size of the not consumed part of the input queue spill file',
+                           function=lambda: self.write_offset - self.read_offset)
+
+    def _qsize(self):
+        return len(self.queue) + self.spilled_items
+
+    def _put(self, item):
+        # once spilling, new items go to the file too, so the order is kept
+        if not self.spilled_items and len(self.queue) < self.memory_size:
+            self.queue.append(item)
+            return
+
+        if self.spill_file is None:
+            self.spill_file = tempfile.TemporaryFile(prefix='twitter-input-', dir=self.spill_dir)
+            logger.warning('Input queue is full. Spilling messages to the disk')
+        data = pickle.dumps(item, pickle.HIGHEST_PROTOCOL)
+        self.spill_file.seek(self.write_offset)
+        self.spill_file.write(SPILL_FRAME.pack(len(data)) + data)
+        self.write_offset += SPILL_FRAME.size + len(data)
+        self.spilled_items += 1
+        self.spilled.inc(self._messages_count(item))
+
+    def _get(self):
+        item = self.queue.popleft()
+        if self.spilled_items:
+            self.spill_file.seek(self.read_offset)
+            size, = SPILL_FRAME.unpack(self.spill_file.read(SPILL_FRAME.size))
+            self.queue.append(pickle.loads(self.spill_file.read(size)))
+            self.read_offset += SPILL_FRAME.size + size
+            self.spilled_items -= 1
+            if not self.spilled_items:
+                # the spill is drained, reuse the file from the start
+                self.spill_file.truncate(0)
+                self.read_offset = self.write_offset = 0
+        return item
+
+    def close(self):
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+
+
+OVERFLOW_POLICIES = {
+    'block': BlockingInputQueue,
+    'drop_newest': DropNewestInputQueue,
+    'drop_oldest': DropOldestInputQueue,
+    'sample': SampleInputQueue,
+    'spill': SpillInputQueue,
+}
+
+
+def create_input_queue(policy='block', maxsize=None, **kwargs):
+    """
+    Instantiate the input queue
+
+    Args:
+        policy: one of OVERFLOW_POLICIES keys
+        maxsize: max number of items kept in memory (an unbounded queue.Queue if None)
+        kwargs: queue parameters (stop_event, metrics, spill_dir, seed); irrelevant ones are ignored
+
+    Returns:
+        queue.Queue instance
+    """
+    if policy not in OVERFLOW_POLICIES:
+        raise ValueError(f'Unknown overflow policy: {policy}')
+    if not maxsize:
+        return queue.Queue()
+    return OVERFLOW_POLICIES[policy](maxsize, **{key: value for key, value in kwargs.items() if value is not None})
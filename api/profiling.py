@@ -0,0 +1,215 @@
+import cProfile
+import logging
+import os
+import pstats
+import threading
+import tracemalloc
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Merged collapsed stacks file of all profiled threads (flamegraph.pl, speedscope, inferno etc.)
+COLLAPSED_FILENAME = 'profile.collapsed'
+# Call paths deeper than that are cut when the stacks are collapsed
+MAX_STACK_DEPTH = 128
+# Call paths taking less than that many seconds are not collapsed (the stacks are reconstructed from the caller ->
+# callee edges, so the number of paths grows fast)
+MIN_STACK_SECONDS = 1e-6
+# Number of the top allocation sites written per memory snapshot
+TOP_ALLOCATORS = 25
+
+
+def _frame_label(func):
+    filename, lineno, name = func
+    if filename == '~':
+        # built-in functions
+        label = name
+    else:
+        label = f'{name} ({os.path.basename(filename)}:{lineno})'
+    return label.replace(';', ',')
+
+
+def collapse_stats(stats, root):
+    """
+    Convert cProfile statistics into collapsed stacks. cProfile records the caller -> callee edges only, not
+    the whole stacks, so the self time of a function is split between its call paths in the proportion of
+    the time spent in every caller -> callee edge (as the profile viewers built on cProfile do).
+
+    Args:
+        stats: dict of function -> (primitive calls, calls, self time, cumulative time, callers) (pstats.Stats.stats)
+        root: name of the root frame of all stacks (e.g. the thread name)
+
+    Returns:
+        Counter of stack ('root;caller;callee') -> seconds
+    """
+    callees = {}
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+
+    stacks = Counter()
+
+    def walk(func, path, labels, share):
+        self_time = stats[func][2]
+        labels = labels + (_frame_label(func), )
+        if self_time * share > 0:
+            stacks[';'.join(labels)] += self_time * share
+        if len(labels) > MAX_STACK_DEPTH:
+            return
+        path = path | {func}
+        for callee, edge_time in callees.get(func, ()):
+            callee_time = stats[callee][3]
+            if callee in path or callee_time <= 0:
+                continue
+            callee_share = share * min(edge_time / callee_time, 1)
+            if callee_time * callee_share >= MIN_STACK_SECONDS:
+                walk(callee, path, labels, callee_share)
+
+    for func, (_, _, _, _, callers) in stats.items():
+        if not callers:
+            walk(func, frozenset(), (root, ), 1)
+    return stacks
+
+
+class ThreadProfiler:
+
+    def __init__(self, directory):
+        """
+        Profiles the pipeline threads with a cProfile profiler each (`python -m cProfile` only sees the main thread).
+        The thread targets are wrapped (see `wrap`), and `write` saves a pstats file per profiled name plus
+        the collapsed stacks of all of them (COLLAPSED_FILENAME) for the flame graph tools.
+
+        Python 3.12+ allows a single active profiler per interpreter, so only the first wrapped target running at
+        a time is profiled there.
+
+        Args:
+            directory: directory of the profile files (created if missing)
+        """
+        self.directory = directory
+        self._profiles = {}
+        self._lock = threading.Lock()
+
+    def wrap(self, name, target):
+        """
+        Wrap a callable, so its runs are profiled. The runs of the same name are accumulated into a single profile,
+        they are expected to run in one thread at a time.
+
+        Args:
+            name: profile name (the thread name, e.g. 'processor')
+            target: callable (the thread target)
+
+        Returns:
+            callable
+        """
+        with self._lock:
+            profile = self._profiles.setdefault(name, cProfile.Profile())
+
+        def profiled(*args, **kwargs):
+            try:
+                profile.enable()
+            except ValueError as exc:
+                logger.warning('Can not profile %s: %s', name, exc)
+                return target(*args, **kwargs)
+            try:
+                return target(*args, **kwargs)
+            finally:
+                profile.disable()
+
+        return profiled
+
+    def write(self):
+        """
+        Write the profile files: `<name>.prof` (pstats, see `python -m pstats`) per profiled name and the merged
+        collapsed stacks. Every stack starts with the profile name, values are microseconds.
+
+        Returns:
+            list of the written filenames
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        filenames = []
+        stacks = Counter()
+        for name, profile in self._profiles.items():
+            profile.create_stats()
+            if not profile.stats:
+                continue
+            filename = os.path.join(self.directory, f'{name}.prof')
+            profile.dump_stats(filename)
+            filenames.append(filename)
+            stats = pstats.Stats(profile)
+            logger.info('Profile of %s: %s calls in %.3f sec, the top functions by the cumulative time:', name,
+                        stats.total_calls, stats.total_tt)
+            top = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:5]
+            for func, (_, calls, self_time, cumulative_time, _) in top:
+                logger.info('    %.3f sec (%.3f sec self) in %s calls of %s', cumulative_time, self_time, calls,
+                            _frame_label(func))
+            stacks.update(collapse_stats(stats.stats, name))
+
+        filename = os.path.join(self.directory, COLLAPSED_FILENAME)
+        with open(filename, 'w') as f:
+            for stack, seconds in sorted(stacks.items()):
+                microseconds = round(seconds * 1e6)
+                if microseconds:
+                    f.write(f'{stack} {microseconds}\n')
+        filenames.append(filename)
+        logger.info('Profiles are written to %s', self.directory)
+        return filenames
+
+
+class MemoryTracer:
+
+    def __init__(self, directory, top=TOP_ALLOCATORS):
+        """
+        Traces the Python allocations with tracemalloc and writes the top allocation sites on every snapshot
+        (the processor takes one when an export starts, when the fetched messages are all in memory)
+
+        Args:
+            directory: directory of the snapshot files (created if missing)
+            top: number of the top allocation sites per snapshot
+        """
+        self.directory = directory
+        self.top = top
+        self.snapshots = 0
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started = True
+
+    def stop(self):
+        if self._started:
+            tracemalloc.stop()
+            self._started = False
+
+    def snapshot(self, label):
+        """
+        Take a snapshot and write its top allocation sites (by line) to `<number>-<label>.txt`
+
+        Args:
+            label: snapshot label (e.g. 'export')
+
+        Returns:
+            str, snapshot filename or None if not tracing
+        """
+        if not tracemalloc.is_tracing():
+            return None
+        current, peak = tracemalloc.get_traced_memory()
+        # the traces are grouped before the tracemalloc own allocations are skipped, filtering them is much slower
+        statistics = [statistic for statistic in tracemalloc.take_snapshot().statistics('lineno')
+                      if statistic.traceback[0].filename != tracemalloc.__file__][:self.top]
+        with self._lock:
+            self.snapshots += 1
+            number = self.snapshots
+
+        os.makedirs(self.directory, exist_ok=True)
+        filename = os.path.join(self.directory, f'{number:04d}-{label}.txt')
+        with open(filename, 'w') as f:
+            f.write(f'# traced memory: {current} bytes, peak: {peak} bytes\n')
+            for statistic in statistics:
+                f.write(f'{statistic}\n')
+        logger.info('Memory snapshot %s: %.1f MiB traced (peak %.1f MiB), the top allocators:', filename,
+                    current / 2 ** 20, peak / 2 ** 20)
+        for statistic in statistics[:3]:
+            logger.info('    %s', statistic)
+        return filename
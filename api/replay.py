@@ -0,0 +1,266 @@
+import json
+import logging
+import random
+import threading
+import time
+import urllib.parse as urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+FIRST_TWEET_ID = 1172962556291551233
+CONTROL_MESSAGES = (
+    {'limit': {'track': 42, 'timestamp_ms': '1568491040000'}},
+    {'delete': {'status': {'id': 1172962556291551000, 'id_str': '1172962556291551000', 'user_id': 1,
+                           'user_id_str': '1'}, 'timestamp_ms': '1568491040000'}},
+    {'scrub_geo': {'user_id': 1, 'user_id_str': '1', 'up_to_status_id': 1, 'up_to_status_id_str': '1'}},
+)
+# Number of the popular tweets the synthetic retweets and quotes refer to
+ORIGINAL_TWEETS = 200
+# Retweet texts are truncated to that many characters (the classic tweet length)
+RETWEET_TEXT_LENGTH = 140
+# Lines are written in chunks of that many lines when the replay rate is not limited
+UNLIMITED_RATE_CHUNK = 64
+KEEP_ALIVE_INTERVAL = 1
+
+
+def _synthetic_user(user_id):
+    return {
+        'id': user_id,
+        'id_str': str(user_id),
+        'name': f'User {user_id}',
+        'screen_name': f'user_{user_id}',
+        'location': None,
+        'description': 'Synthetic user generated for the replay benchmark',
+        'protected': False,
+        'verified': False,
+        'followers_count': user_id % 1000,
+        'friends_count': user_id % 500,
+        'statuses_count': user_id % 10000,
+        'created_at': time.strftime('%a %b %d %H:%M:%S +0000 %Y',
+                                    time.gmtime(1200000000 + user_id * 7919 % 300000000)),
+        'lang': None,
+    }
+
+
+def _synthetic_tweet(tweet_id, user_id, rng):
+    created_at = ((tweet_id >> 22) + 1288834974657) // 1000
+    return {
+        'created_at': time.strftime('%a %b %d %H:%M:%S +0000 %Y', time.gmtime(created_at)),
+        'id': tweet_id,
+        'id_str': str(tweet_id),
+        'text': f'RT @user_{rng.randrange(100)}: synthetic tweet #{rng.randrange(1000)} about bieber “{tweet_id}”',
+        'source': '<a href="http://twitter.com/download/iphone" rel="nofollow">Twitter for iPhone</a>',
+        'truncated': False,
+        'in_reply_to_status_id': None,
+        'in_reply_to_status_id_str': None,
+        'user': _synthetic_user(user_id),
+        'geo': None,
+        'coordinates': None,
+        'place': None,
+        'is_quote_status': False,
+        'retweet_count': 0,
+        'favorite_count': 0,
+        'entities': {'hashtags': [], 'urls': [], 'user_mentions': [], 'symbols': []},
+        'lang': 'en',
+        'timestamp_ms': str(created_at * 1000),
+    }
+
+
+def _synthetic_originals(seed):
+    """
+    Generate the popular tweets the synthetic retweets and quotes refer to (long texts, skewed popularity)
+    """
+    rng = random.Random(seed)
+    originals = []
+    for ind in range(ORIGINAL_TWEETS):
+        tweet = _synthetic_tweet(FIRST_TWEET_ID - (ind + 1 << 22), 10 ** 6 + ind, rng)
+        tweet['text'] = ' '.join(f'popular tweet {ind} about bieber with a long text' for _ in range(3))
+        originals.append(tweet)
+    return originals
+
+
+def _synthetic_reference(tweet, originals, quote, rng):
+    """
+    Turn a synthetic tweet into a retweet or a quote of one of the originals (the nested tweet follows the place
+    as in the stream payloads)
+    """
+    original = originals[int(len(originals) * rng.random() ** 3)]
+    if quote:
+        tweet['text'] = f'quoting it {rng.randrange(1000)}'
+    else:
+        text = f"RT @{original['user']['screen_name']}: {original['text']}"
+        tweet['text'] = text if len(text) <= RETWEET_TEXT_LENGTH else text[:RETWEET_TEXT_LENGTH - 1] + '…'
+    nested = {}
+    for key, value in tweet.items():
+        nested[key] = value
+        if key == 'place':
+            nested['quoted_status' if quote else 'retweeted_status'] = original
+    return nested
+
+
+def generate_stream(messages, control_ratio=0.1, duplicate_ratio=0.01, users=1000, seed=0, retweet_ratio=0,
+                    quote_ratio=0):
+    """
+    Generate a synthetic stream with the field layout of the Twitter stream payloads
+
+    Args:
+        messages: number of lines
+        control_ratio: share of control messages (limit, delete, scrub_geo)
+        duplicate_ratio: share of repeated tweets
+        users: number of distinct users
+        seed: random seed
+        retweet_ratio: share of retweets (of ORIGINAL_TWEETS popular tweets)
+        quote_ratio: share of quotes (of the same tweets)
+
+    Returns:
+        list of raw lines (without the line delimiters)
+    """
+    rng = random.Random(seed)
+    originals = _synthetic_originals(seed) if retweet_ratio or quote_ratio else None
+    lines = []
+    tweets = []
+    tweet_id = FIRST_TWEET_ID
+    for _ in range(messages):
+        chance = rng.random()
+        if chance < control_ratio:
+            lines.append(json.dumps(rng.choice(CONTROL_MESSAGES), separators=(',', ':')).encode())
+        elif chance < control_ratio + duplicate_ratio and tweets:
+            lines.append(rng.choice(tweets))
+        else:
+            # ~20 tweets per millisecond
+            tweet_id += rng.randrange(1, 100) << 17
+            tweet = _synthetic_tweet(tweet_id, 1000 + rng.randrange(users), rng)
+            reference_chance = chance - control_ratio - duplicate_ratio
+            if originals and 0 <= reference_chance < retweet_ratio + quote_ratio:
+                tweet = _synthetic_reference(tweet, originals, reference_chance >= retweet_ratio, rng)
+            tweet = json.dumps(tweet, ensure_ascii=False, separators=(',', ':')).encode()
+            tweets.append(tweet)
+            lines.append(tweet)
+    return lines
+
+
+def load_stream(filename):
+    """
+    Load a recorded stream: a file with a raw message per line (empty lines are skipped)
+
+    Args:
+        filename: path to the recorded stream
+
+    Returns:
+        list of raw lines
+    """
+    with open(filename, 'rb') as f:
+        return [line.rstrip(b'\r\n') for line in f if line.strip()]
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _write_chunk(self, data):
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+
+    def do_POST(self):
+        server = self.server
+        body = urlparse.parse_qs(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('ascii'))
+        delimited = body.get('delimited') == ['length']
+        if not self.path.endswith('/statuses/filter.json'):
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        try:
+            self._replay(server, delimited)
+            # keep the connection open as the real stream does, sending keep-alive lines
+            while not server.stopping.wait(KEEP_ALIVE_INTERVAL):
+                self._write_chunk(b'\r\n')
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            logger.debug('Replay client disconnected')
+        self.close_connection = True
+
+    def _replay(self, server, delimited=False):
+        lines = server.lines
+        rate = server.rate
+        chunk_size = 1 if rate else UNLIMITED_RATE_CHUNK
+        started = time.perf_counter()
+        for start in range(0, len(lines), chunk_size):
+            if server.stopping.is_set():
+                return
+            if rate:
+                delay = started + start / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            chunk = lines[start:start + chunk_size]
+            sent_at = time.perf_counter()
+            for line_ind in range(start, start + len(chunk)):
+                message_id = server.message_ids[line_ind]
+                if message_id is not None:
+                    server.sent_at.setdefault(message_id, sent_at)
+            if delimited:
+                self._write_chunk(b''.join(b'%d\r\n%s\r\n' % (len(line) + 2, line) for line in chunk))
+            else:
+                self._write_chunk(b'\r\n'.join(chunk) + b'\r\n')
+            self.wfile.flush()
+        server.replayed.set()
+
+    def log_message(self, *args):
+        pass
+
+
+class ReplayServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, lines, rate=None, host='127.0.0.1', port=0):
+        """
+        Local chunked-HTTP stand-in for the stream.twitter.com filter endpoint. Every connection replays the
+        given lines at the given rate (length-delimited if the request asks for `delimited=length`) and then keeps
+        the connection open with keep-alive lines.
+        Send time of every tweet (by its ID) is recorded to measure the end-to-end latency.
+
+        Args:
+            lines: list of raw lines to replay
+            rate: number of lines per second (unlimited if None)
+            host: host to bind to
+            port: port to bind to (random free port if 0)
+        """
+        super().__init__((host, port), ReplayHandler)
+        self.lines = lines
+        self.rate = rate
+        self.message_ids = [self._message_id(line) for line in lines]
+        self.sent_at = {}
+        self.stopping = threading.Event()
+        self.replayed = threading.Event()
+        self.thread = None
+
+    @staticmethod
+    def _message_id(line):
+        try:
+            message = json.loads(line)
+        except ValueError:
+            return None
+        if isinstance(message, dict) and 'id_str' in message and 'user' in message:
+            return message['id_str']
+        return None
+
+    @property
+    def url(self):
+        """
+        Root URL to pass as the stream root URL
+        """
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/1.1'
+
+    def start(self):
+        self.thread = threading.Thread(name='replay-server', target=self.serve_forever, daemon=True)
+        self.thread.start()
+        logger.info('Replay server is listening on %s', self.url)
+
+    def stop(self):
+        self.stopping.set()
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,285 @@
+import logging
+import multiprocessing
+import queue
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+logger = logging.getLogger(__name__)
+
+# Default size of the ring data area in bytes
+RING_BUFFER_SIZE = 32 << 20
+# Frames are prefixed with their length (little-endian uint32)
+FRAME_HEADER = struct.Struct('<I')
+# Length value that tells the reader to skip to the start of the data area
+WRAP_MARKER = 0xFFFFFFFF
+# Max number of seconds a side sleeps before checking the ring again (a safety net for a missed wakeup)
+POLL_INTERVAL = 0.01
+
+COUNTER = struct.Struct('<Q')
+# Header layout: the producer and the consumer fields live on separate cache lines
+HEAD_OFFSET = 0
+FRAMES_WRITTEN_OFFSET = 8
+WRITER_WAITING_OFFSET = 16
+TAIL_OFFSET = 64
+FRAMES_READ_OFFSET = 72
+READER_WAITING_OFFSET = 80
+CLOSED_OFFSET = 128
+HEADER_SIZE = 192
+
+
+class RingBuffer:
+
+    def __init__(self, size=RING_BUFFER_SIZE):
+        """
+        Byte ring buffer in shared memory with a single consumer, a replacement of the input queue when
+        the streamers and the processor run in different processes. Raw lines are copied into the shared memory
+        once and read back as memoryview slices of it, nothing is pickled.
+
+        Every line is a frame: its length (FRAME_HEADER) followed by the bytes. Frames never wrap around the end
+        of the data area: if a frame does not fit into the tail of the area, the producer leaves a WRAP_MARKER
+        there and starts over. The head (bytes written) and tail (bytes consumed) counters only grow, each of them
+        is written by its own side only. A side that has to wait (empty or full ring) raises its waiting flag and
+        sleeps on an Event the other side sets, so no syscalls are made while both sides keep up.
+
+        Several producer threads (one streamer per track group) may share the producer side: the writes are
+        serialized by a lock of the producer process, so a line or a list of lines is written as a whole.
+
+        The producer publishes a frame by storing the head after the frame bytes, so the consumer relies on
+        the stores being visible in the program order (as on x86-64).
+
+        Usage:
+            ring = RingBuffer()           # in the parent, before starting the child process
+            ring.put(line)                # producer side
+            line = ring.get(timeout=1)    # consumer side (a child process)
+            ring.close()
+            ring.unlink()                 # in the parent, once both sides are done
+
+        Args:
+            size: size of the data area in bytes (the longest line must fit into a half of it). The other side attaches
+            to the same block when the instance is passed to the child process
+        """
+        self.size = size
+        self._shm = shared_memory.SharedMemory(create=True, size=HEADER_SIZE + size)
+        self._buf = self._shm.buf
+        self._data = self._buf[HEADER_SIZE:HEADER_SIZE + size]
+        self._data_event = multiprocessing.Event()
+        self._space_event = multiprocessing.Event()
+        # size of the frame handed out by the last `get_view`, released on the next read
+        self._pending = 0
+        self._put_lock = threading.Lock()
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def __getstate__(self):
+        if self._pending:
+            raise ValueError('Can not pass a ring buffer with a frame being read')
+        return {'size': self.size, 'name': self._shm.name, 'data_event': self._data_event,
+                'space_event': self._space_event}
+
+    def __setstate__(self, state):
+        self.size = state['size']
+        self._shm = shared_memory.SharedMemory(name=state['name'])
+        self._buf = self._shm.buf
+        self._data = self._buf[HEADER_SIZE:HEADER_SIZE + self.size]
+        self._data_event = state['data_event']
+        self._space_event = state['space_event']
+        self._pending = 0
+        self._put_lock = threading.Lock()
+
+    def _load(self, offset):
+        return COUNTER.unpack_from(self._buf, offset)[0]
+
+    def _store(self, offset, value):
+        COUNTER.pack_into(self._buf, offset, value)
+
+    @property
+    def closed(self):
+        return bool(self._load(CLOSED_OFFSET))
+
+    def qsize(self):
+        """
+        Number of frames written but not consumed yet (0 once detached)
+        """
+        if self._buf is None:
+            return 0
+        return self._load(FRAMES_WRITTEN_OFFSET) - self._load(FRAMES_READ_OFFSET)
+
+    def empty(self):
+        return self._load(HEAD_OFFSET) == self._load(TAIL_OFFSET)
+
+    def _wait(self, offset, event, ready, deadline):
+        """
+        Sleep till the other side signals the event. The waiting flag is raised before the condition is checked
+        again, so a signal sent in between is not lost.
+
+        Returns:
+            bool, False if the deadline passed
+        """
+        self._store(offset, 1)
+        try:
+            event.clear()
+            if ready():
+                return True
+            timeout = POLL_INTERVAL
+            if deadline is not None:
+                timeout = min(timeout, deadline - time.monotonic())
+                if timeout <= 0:
+                    return False
+            event.wait(timeout)
+            return True
+        finally:
+            self._store(offset, 0)
+
+    def _put_frame(self, data, deadline):
+        length = len(data)
+        frame_size = FRAME_HEADER.size + length
+        # a frame skipping the tail of the data area then needs at most the whole ring, even if it is empty
+        if frame_size > self.size // 2:
+            raise ValueError(f'Frame of {length} bytes does not fit into the ring buffer of {self.size} bytes')
+        if self.closed:
+            return False
+
+        head = self._load(HEAD_OFFSET)
+        index = head % self.size
+        contiguous = self.size - index
+        required = frame_size if frame_size <= contiguous else contiguous + frame_size
+        while self.size - (head - self._load(TAIL_OFFSET)) < required:
+            if self.closed:
+                return False
+            if not self._wait(WRITER_WAITING_OFFSET, self._space_event,
+                              lambda: self.size - (head - self._load(TAIL_OFFSET)) >= required, deadline):
+                raise queue.Full
+
+        if frame_size > contiguous:
+            if contiguous >= FRAME_HEADER.size:
+                FRAME_HEADER.pack_into(self._data, index, WRAP_MARKER)
+            head += contiguous
+            index = 0
+        FRAME_HEADER.pack_into(self._data, index, length)
+        self._data[index + FRAME_HEADER.size:index + frame_size] = data
+        self._store(FRAMES_WRITTEN_OFFSET, self._load(FRAMES_WRITTEN_OFFSET) + 1)
+        self._store(HEAD_OFFSET, head + frame_size)
+
+        if self._load(READER_WAITING_OFFSET):
+            self._data_event.set()
+        return True
+
+    def put(self, item, timeout=None):
+        """
+        Write a raw line or a list of them (producer side, thread-safe). Blocks while the ring is full.
+        Lines put after the ring is closed are discarded.
+
+        Args:
+            item: bytes-like object or a list of them
+            timeout: max number of seconds to wait for the free space (no limit if None)
+
+        Returns:
+            None
+
+        Raises:
+            queue.Full if there is still no space after the timeout
+            ValueError if a line is longer than a half of the ring
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._put_lock:
+            for data in item if isinstance(item, list) else (item, ):
+                if not self._put_frame(data, deadline):
+                    logger.debug('Ring buffer is closed. Discarding the line')
+                    return
+
+    def _release(self):
+        if not self._pending:
+            return
+        self._store(FRAMES_READ_OFFSET, self._load(FRAMES_READ_OFFSET) + 1)
+        self._store(TAIL_OFFSET, self._load(TAIL_OFFSET) + self._pending)
+        self._pending = 0
+        if self._load(WRITER_WAITING_OFFSET):
+            self._space_event.set()
+
+    def get_view(self, timeout=None):
+        """
+        Read the next line without copying it (consumer side). The returned memoryview points into the shared
+        memory and is valid till the next read only.
+
+        Args:
+            timeout: max number of seconds to wait for a line (no limit if None)
+
+        Returns:
+            memoryview of the line or None if the ring is closed and drained
+
+        Raises:
+            queue.Empty if there is no line within the timeout
+        """
+        self._release()
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            tail = self._load(TAIL_OFFSET)
+            if self._load(HEAD_OFFSET) == tail:
+                if self.closed:
+                    return None
+                if not self._wait(READER_WAITING_OFFSET, self._data_event,
+                                  lambda: self._load(HEAD_OFFSET) != tail or self.closed, deadline):
+                    raise queue.Empty
+                continue
+
+            index = tail % self.size
+            contiguous = self.size - index
+            length = FRAME_HEADER.unpack_from(self._data, index)[0] if contiguous >= FRAME_HEADER.size else None
+            if length is None or length == WRAP_MARKER:
+                self._store(TAIL_OFFSET, tail + contiguous)
+                continue
+
+            self._pending = FRAME_HEADER.size + length
+            start = index + FRAME_HEADER.size
+            return self._data[start:start + length]
+
+    def get(self, timeout=None):
+        """
+        Read the next line as bytes (consumer side), a drop-in for `queue.Queue.get`
+
+        Args:
+            timeout: max number of seconds to wait for a line (no limit if None)
+
+        Returns:
+            bytes or None if the ring is closed and drained
+
+        Raises:
+            queue.Empty if there is no line within the timeout
+        """
+        view = self.get_view(timeout)
+        if view is None:
+            return None
+        with view:
+            line = bytes(view)
+        self._release()
+        return line
+
+    def close(self):
+        """
+        Mark the ring as closed (either side) and wake the other side up
+        """
+        self._store(CLOSED_OFFSET, 1)
+        self._data_event.set()
+        self._space_event.set()
+
+    def detach(self):
+        """
+        Release the shared memory mapping of this side (views returned by `get_view` must be released before)
+        """
+        self._pending = 0
+        self._data.release()
+        self._buf = None
+        self._shm.close()
+
+    def unlink(self):
+        """
+        Detach and destroy the shared memory block (call once, on the side that created the ring)
+        """
+        try:
+            self.detach()
+        finally:
+            self._shm.unlink()
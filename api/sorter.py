@@ -0,0 +1,115 @@
+import heapq
+import logging
+import pickle
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+
+class ExternalSorter:
+    """
+    Sort an arbitrary number of items with a bounded memory footprint.
+
+    Items are buffered in memory until the buffer reaches `buffer_size` entries. The buffer is then sorted and
+    spilled to a temporary file as a sorted run. Iterating over the sorter k-way-merges all the runs
+    (and whatever is left in the buffer) and yields the items in ascending order.
+    """
+
+    def __init__(self, buffer_size=100000, key=None, block_size=1000, tmp_dir=None):
+        """
+        Args:
+            buffer_size: max number of items kept in memory before a sorted run is spilled to disk
+            key: optional function that extracts a comparison key from the item
+            block_size: number of items pickled together (reduces per-item serialization overhead)
+            tmp_dir: directory for the temporary run files (system default if None)
+        """
+        if buffer_size < 1:
+            raise ValueError('buffer_size must be a positive number')
+        self.buffer_size = buffer_size
+        self.key = key
+        self.block_size = block_size
+        self.tmp_dir = tmp_dir
+        self._buffer = []
+        self._runs = []
+
+    def __len__(self):
+        return len(self._buffer) + sum(size for _, size in self._runs)
+
+    @property
+    def runs_count(self):
+        return len(self._runs)
+
+    def add(self, item):
+        """
+        Add an item to the sorter, spilling a sorted run to disk if the memory buffer is full.
+
+        Args:
+            item: item to be sorted
+
+        Returns:
+            None
+        """
+        self._buffer.append(item)
+        if len(self._buffer) >= self.buffer_size:
+            self._spill()
+
+    def _spill(self):
+        """
+        Sort the memory buffer and dump it to a temporary file as a sorted run.
+
+        Returns:
+            None
+        """
+        self._buffer.sort(key=self.key)
+        run_file = tempfile.TemporaryFile(dir=self.tmp_dir)
+        for start in range(0, len(self._buffer), self.block_size):
+            pickle.dump(self._buffer[start:start + self.block_size], run_file, pickle.HIGHEST_PROTOCOL)
+        run_file.seek(0)
+        self._runs.append((run_file, len(self._buffer)))
+        logger.debug('Spilled a sorted run of %s items to disk', len(self._buffer))
+        self._buffer = []
+
+    @staticmethod
+    def _read_run(run_file):
+        """
+        Read a sorted run back from disk block by block.
+
+        Args:
+            run_file: file object with pickled blocks of items
+
+        Returns:
+            yields items
+        """
+        while True:
+            try:
+                block = pickle.load(run_file)
+            except EOFError:
+                return
+            yield from block
+
+    def __iter__(self):
+        self._buffer.sort(key=self.key)
+        if not self._runs:
+            return iter(self._buffer)
+        logger.info('Merging %s sorted runs', len(self._runs))
+        runs = [self._read_run(run_file) for run_file, _ in self._runs]
+        runs.append(iter(self._buffer))
+        return heapq.merge(*runs, key=self.key)
+
+    def close(self):
+        """
+        Release the memory buffer and remove all temporary run files.
+
+        Returns:
+            None
+        """
+        for run_file, _ in self._runs:
+            run_file.close()
+        self._runs = []
+        self._buffer = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
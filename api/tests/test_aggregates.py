@@ -0,0 +1,98 @@
+import json
+import os
+import tempfile
+from collections import Counter
+from unittest import TestCase
+
+from api.aggregates import (RateCounter, StreamAggregator, aggregates_filename, create_aggregator,
+                            create_heavy_hitters)
+from api.bench import generate_items, run_benchmark
+from api.models import Tweet, User
+from api.replay import generate_stream
+
+
+class HeavyHittersTestCase(TestCase):
+
+    def test_guarantees(self):
+        """
+        Test that the counts of the top items are bounded by the errors and the frequent items are all monitored
+        """
+        items = generate_items(50000, distinct=5000, seed=1)
+        exact = Counter(items)
+        for name in ('space-saving', 'count-min'):
+            with self.subTest(name=name):
+                counter = create_heavy_hitters(name, size=200)
+                for item in items:
+                    counter.add(item)
+                self.assertEqual(len(counter), 200)
+                self.assertEqual(counter.total, len(items))
+                top = counter.top(20)
+                self.assertEqual([count for _, count, _ in top], sorted((count for _, count, _ in top), reverse=True))
+                for item, count, error in top:
+                    self.assertGreaterEqual(count, exact[item])
+                    self.assertLessEqual(count - error, exact[item])
+                self.assertEqual({item for item, _, _ in top[:10]}, {item for item, _ in exact.most_common(10)})
+
+        counter = create_heavy_hitters('space-saving', size=200)
+        for item in items:
+            counter.add(item)
+        for item, count in exact.items():
+            if count > len(items) / 200:
+                self.assertIn(item, counter)
+        with self.assertRaises(ValueError):
+            create_heavy_hitters('exact')
+
+    def test_rate_counter(self):
+        """
+        Test that only the last windows are kept and the older tweets are counted as late
+        """
+        rates = RateCounter(window=60, windows=2)
+        for created_at in (0, 59, 60, 125, 61, 10):
+            rates.add(created_at)
+        self.assertEqual(rates.snapshot(), [{'start': 60, 'tweets': 2}, {'start': 120, 'tweets': 1}])
+        self.assertEqual(rates.late, 1)
+
+    def test_aggregator(self):
+        """
+        Test the aggregated users, hashtags and mentions and the snapshot filename
+        """
+        aggregator = StreamAggregator(size=10, top=2)
+        users = [User(id_str=str(ind), name='Foo', screen_name=f'foo{ind}', created_at=1514800800)
+                 for ind in range(3)]
+        for ind, text in enumerate(('#Bieber rocks @Bar', 'love #bieber', 'me@example.com #2019 @bar @baz',
+                                    'no tags')):
+            tweet = Tweet(id_str=str(100 + ind), created_at=1568491040 + ind * 30, text=text)
+            tweet.user = users[ind % 2]
+            aggregator.add(tweet)
+
+        snapshot = aggregator.snapshot(final=True)
+        self.assertEqual(snapshot['tweets'], 4)
+        self.assertEqual([(user['screen_name'], user['count']) for user in snapshot['users']],
+                         [('foo0', 2), ('foo1', 2)])
+        self.assertEqual([(tag['hashtag'], tag['count']) for tag in snapshot['hashtags']], [('bieber', 2), ('2019', 1)])
+        self.assertEqual([(mention['screen_name'], mention['count']) for mention in snapshot['mentions']],
+                         [('bar', 2), ('baz', 1)])
+        self.assertEqual(sum(window['tweets'] for window in snapshot['rates']['windows']), 4)
+        json.dumps(snapshot)
+
+        self.assertEqual(aggregates_filename('out/output.csv'), os.path.join('out', 'output-_aggregates.json'))
+        self.assertEqual(aggregates_filename('tweets-{start}-{index}.jsonl.gz'), 'tweets-_aggregates.json')
+        self.assertEqual(create_aggregator('count-min', size=None, width=64).users.width, 64)
+
+    def test_pipeline(self):
+        """
+        Test that the snapshot written next to the output counts every accepted tweet
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, 'output.csv')
+            report = run_benchmark(generate_stream(500), filename=filename, aggregates='space-saving',
+                                   aggregates_options={'size': 50})
+            with open(os.path.join(tmp_dir, 'output-_aggregates.json'), encoding='utf-8') as f:
+                snapshot = json.load(f)
+
+        self.assertTrue(snapshot['final'])
+        self.assertEqual(snapshot['tweets'], report['messages'])
+        self.assertEqual(len(snapshot['users']), 50)
+        self.assertEqual(sum(window['tweets'] for window in snapshot['rates']['windows']), report['messages'])
+        self.assertGreater(report['metrics']['aggregates_bytes'], 0)
+        self.assertEqual(report['metrics']['aggregate_snapshots_total'], 1)
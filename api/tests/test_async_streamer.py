@@ -0,0 +1,108 @@
+import asyncio
+import json
+import os
+import queue
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase
+
+from api.async_streamer import AsyncTweetsStreamer
+from api.limiter import Limiter
+from api.tests.test_processor import make_tweet
+from api.tweets_processor import TweetsProcessor
+from api.twitter_api import TwitterAPI
+
+
+class ChunkedStreamHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    lines = []
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for line in self.lines:
+            # split every message into two chunks to test partial lines
+            middle = len(line) // 2
+            for chunk in (line[:middle], line[middle:]):
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+        self.wfile.write(b'0\r\n\r\n')
+
+    def log_message(self, *args):
+        pass
+
+
+class AsyncStreamerTestCase(TestCase):
+
+    def setUp(self):
+        ChunkedStreamHandler.lines = [b'\r\n'] + [json.dumps(make_tweet(str(ind))).encode() + b'\r\n'
+                                                  for ind in range(20)]
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), ChunkedStreamHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.stream_root_url = f'http://127.0.0.1:{self.server.server_port}/1.1'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_read_stream(self):
+        """
+        Test that the chunked stream is split into non-empty lines
+        """
+        async def read():
+            # the server closes the stream after the lines, the streamer gives up instead of reconnecting
+            streamer = AsyncTweetsStreamer('key', 'secret', asyncio.Queue(), asyncio.Event(), max_reconnects=0)
+            streamer.stream_root_url = self.stream_root_url
+            await streamer.filter_tweets('foo')
+            return [streamer.input_queue.get_nowait() for _ in range(streamer.input_queue.qsize())]
+
+        lines = asyncio.run(read())
+        self.assertEqual(lines, [line.rstrip() for line in ChunkedStreamHandler.lines[1:]])
+
+    def test_pipeline(self):
+        """
+        Test that the async pipeline stops at the message limit and exports the messages
+        """
+        async def run(filename):
+            stop_event = asyncio.Event()
+            input_queue = asyncio.Queue()
+            message_queue = queue.Queue(10)
+            streamer = AsyncTweetsStreamer('key', 'secret', input_queue, stop_event)
+            streamer.stream_root_url = self.stream_root_url
+            limiter = Limiter(30, 10, None, stop_event)
+            processor = TweetsProcessor(input_queue, message_queue, None, stop_event, filename=filename,
+                                        limiter=limiter)
+            streamer_task = asyncio.ensure_future(streamer.filter_tweets('foo'))
+            await asyncio.gather(limiter.start_async(), processor.start_async())
+            streamer_task.cancel()
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, 'output.csv')
+            asyncio.run(run(filename))
+            with open(filename) as f:
+                self.assertEqual(len(f.readlines()), 11)
+
+    def test_closed_stream(self):
+        """
+        Test that a closed stream is reconnected and the run without limits finishes once the stream gave up
+        """
+        ChunkedStreamHandler.lines = []
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            api = TwitterAPI('key', 'secret', time_limit=None, message_limit=None, engine='asyncio', auth_cls=None,
+                             filename=os.path.join(tmp_dir, 'output.csv'), stream_root_url=self.stream_root_url,
+                             max_reconnects=2)
+            thread = threading.Thread(target=api.filter_tweets, args=('foo', ), daemon=True)
+            thread.start()
+            thread.join(10)
+            self.assertFalse(thread.is_alive())
+        self.assertEqual(api.streamer.reconnects, 2)
+        self.assertTrue(api.stop_event.is_set())
+
+    def test_unsupported_options(self):
+        """
+        Test that the options the asyncio engine would silently ignore are rejected
+        """
+        with self.assertRaises(ValueError):
+            TwitterAPI('key', 'secret', engine='asyncio', batch_size=100)
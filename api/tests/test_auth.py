@@ -0,0 +1,73 @@
+import os
+import stat
+import tempfile
+from unittest import TestCase
+
+from api.auth import CachedAuthenticator, CredentialsCache
+
+
+class FakePINAuthenticator:
+    calls = 0
+
+    def __init__(self, api_key, api_secret_key):
+        self.api_key = api_key
+
+    def authenticate(self):
+        FakePINAuthenticator.calls += 1
+        return f'token-{FakePINAuthenticator.calls}', f'secret-{FakePINAuthenticator.calls}'
+
+
+class AuthTestCase(TestCase):
+
+    def setUp(self):
+        FakePINAuthenticator.calls = 0
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.cache_file = os.path.join(self.tmp_dir.name, 'cache', 'credentials.json')
+
+    def _authenticator(self):
+        return CachedAuthenticator('key', 'secret', cache_file=self.cache_file, fallback_cls=FakePINAuthenticator)
+
+    def test_credentials_cache(self):
+        """
+        Test that the credentials cache keeps tokens per API key in a file readable by its owner only
+        """
+        cache = CredentialsCache(self.cache_file)
+        self.assertIsNone(cache.load('key'))
+        cache.save('key', 'token', 'secret')
+        cache.save('other', 'other-token', 'other-secret')
+        self.assertEqual(cache.load('key'), ('token', 'secret'))
+
+        self.assertEqual(stat.S_IMODE(os.stat(self.cache_file).st_mode), 0o600)
+        self.assertEqual(stat.S_IMODE(os.stat(os.path.dirname(self.cache_file)).st_mode), 0o700)
+
+        cache.remove('key')
+        self.assertIsNone(cache.load('key'))
+        self.assertEqual(cache.load('other'), ('other-token', 'other-secret'))
+
+    def test_tokens_are_reused(self):
+        """
+        Test that the PIN flow runs once and the cached tokens are reused by the next runs
+        """
+        self.assertEqual(self._authenticator().authenticate(), ('token-1', 'secret-1'))
+        authenticator = self._authenticator()
+        self.assertEqual(authenticator.authenticate(), ('token-1', 'secret-1'))
+        self.assertTrue(authenticator.from_cache)
+        self.assertIsNotNone(authenticator.provide_auth())
+        self.assertEqual(FakePINAuthenticator.calls, 1)
+
+    def test_rejected_tokens(self):
+        """
+        Test that rejected cached tokens are replaced with the PIN flow, while fresh tokens are not retried
+        """
+        CredentialsCache(self.cache_file).save('key', 'stale', 'stale')
+        authenticator = self._authenticator()
+        authenticator.authenticate()
+        self.assertEqual(FakePINAuthenticator.calls, 0)
+
+        self.assertTrue(authenticator.invalidate())
+        self.assertEqual(FakePINAuthenticator.calls, 1)
+        self.assertEqual(CredentialsCache(self.cache_file).load('key'), ('token-1', 'secret-1'))
+
+        self.assertFalse(authenticator.invalidate())
+        self.assertEqual(FakePINAuthenticator.calls, 1)
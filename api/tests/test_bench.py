@@ -0,0 +1,55 @@
+import json
+from unittest import TestCase
+
+from api.bench import percentile, run_benchmark
+from api.replay import generate_stream
+
+
+class BenchTestCase(TestCase):
+
+    def test_percentile(self):
+        """
+        Test the nearest-rank percentile
+        """
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 0.5), 50)
+        self.assertEqual(percentile(values, 0.99), 99)
+        self.assertEqual(percentile(values, 1), 100)
+        self.assertIsNone(percentile([], 0.5))
+
+    def test_generate_stream(self):
+        """
+        Test that the synthetic stream is deterministic and contains tweets, control messages and duplicates
+        """
+        lines = generate_stream(500, control_ratio=0.2, duplicate_ratio=0.1, seed=1)
+        self.assertEqual(lines, generate_stream(500, control_ratio=0.2, duplicate_ratio=0.1, seed=1))
+        messages = [json.loads(line) for line in lines]
+        tweet_ids = [message['id_str'] for message in messages if 'user' in message]
+        self.assertTrue(len(tweet_ids) < len(lines))
+        self.assertTrue(len(set(tweet_ids)) < len(tweet_ids))
+
+    def test_run_benchmark(self):
+        """
+        Test that all unique tweets of the replayed stream go through the pipeline
+        """
+        lines = generate_stream(300)
+        unique_tweets = len({json.loads(line)['id_str'] for line in lines if b'"user"' in line})
+        for options in ({}, {'batch_size': 64, 'fast_parse': True}):
+            with self.subTest(**options):
+                report = run_benchmark(lines, time_limit=10, **options)
+                self.assertEqual(report['messages'], unique_tweets)
+                self.assertLess(report['total_seconds'], 10)
+                self.assertIsNotNone(report['latency_p99'])
+
+    def test_run_benchmark_multiple_streams(self):
+        """
+        Test that the tweets delivered by several streams are deduplicated by the shared processor
+        """
+        lines = generate_stream(300)
+        unique_tweets = len({json.loads(line)['id_str'] for line in lines if b'"user"' in line})
+        for engine in ('threads', 'asyncio'):
+            with self.subTest(engine=engine):
+                report = run_benchmark(lines, track=['bieber', 'justin'], time_limit=10, engine=engine)
+                self.assertEqual(report['messages'], unique_tweets)
+                self.assertGreater(report['metrics']['lines_received_total{stream="0"}'], 0)
+                self.assertGreater(report['metrics']['lines_received_total{stream="1"}'], 0)
@@ -0,0 +1,82 @@
+import csv
+import os
+import tempfile
+from unittest import TestCase
+
+from api.bench import run_benchmark
+from api.canonical import CanonicalTable
+from api.decoder import TweetRecord
+from api.models import AnnotatedTweet
+from api.replay import generate_stream
+
+
+def make_record(id_str, text, ref_type=None, ref_id_str=None):
+    return TweetRecord(id_str, 1568491040, text, '42', 1514800800, 'Foo', 'foo', ref_type, ref_id_str,
+                       'original text', 'bar')
+
+
+def read_tsv(filename):
+    with open(filename, newline='', encoding='utf-8') as f:
+        return list(csv.reader(f, delimiter='\t'))
+
+
+class CanonicalTableTestCase(TestCase):
+
+    def test_collapse(self):
+        """
+        Test that the retweets of a tweet share a single text and quotes are only kept to be normalized
+        """
+        table = CanonicalTable()
+        tweets = []
+        for record in (make_record('1', ''.join(['RT @bar: ', 'original text']), 'retweet', '100'),
+                       make_record('2', ''.join(['RT @bar: ', 'original text']), 'retweet', '100'),
+                       make_record('3', 'RT @bar: original', 'retweet', '100'),
+                       make_record('4', 'quoting', 'quote', '100'),
+                       make_record('5', 'plain')):
+            tweet = AnnotatedTweet(id_str=record.id_str, created_at=record.created_at, text=record.text)
+            table.collapse(tweet, record)
+            tweets.append(tweet)
+
+        canonical = tweets[0].ref
+        self.assertEqual(len(table), 1)
+        self.assertIsNone(canonical.text)
+        self.assertIs(tweets[1].text, tweets[0].text)
+        self.assertEqual(tweets[2].text, 'RT @bar: original')
+        self.assertIs(tweets[2].ref, canonical)
+        self.assertIsNone(tweets[3].ref)
+        self.assertIsNone(tweets[4].ref)
+        self.assertEqual(table.collapsed.value, 1)
+
+        table = CanonicalTable(keep_text=True)
+        tweet = AnnotatedTweet(id_str='4', created_at=1568491040, text='quoting')
+        table.collapse(tweet, make_record('4', 'quoting', 'quote', '100'))
+        self.assertEqual((tweet.ref_type, tweet.ref.text, tweet.ref.retweet_text), ('quote', 'original text', None))
+
+    def test_pipeline(self):
+        """
+        Test that the normalized output expanded with its canonical table matches the expanded output
+        """
+        lines = generate_stream(1000, control_ratio=0, duplicate_ratio=0, retweet_ratio=0.7, quote_ratio=0.1)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            expanded = os.path.join(tmp_dir, 'expanded.csv')
+            normalized = os.path.join(tmp_dir, 'normalized.csv')
+            run_benchmark(lines, filename=expanded, collapse='expand')
+            report = run_benchmark(lines, filename=normalized, collapse='normalize', sort_buffer_size=100)
+            expanded_rows = read_tsv(expanded)
+            normalized_rows = read_tsv(normalized)
+            canonical_rows = read_tsv(os.path.join(tmp_dir, 'normalized-_canonical.csv'))
+
+        self.assertEqual(normalized_rows[0][-2:], ['Reference type', 'Referenced message ID'])
+        canonical = {row[0]: row for row in canonical_rows[1:]}
+        restored = []
+        for row in normalized_rows[1:]:
+            ref_type, ref_id_str = row[-2:]
+            if ref_type:
+                self.assertIn(ref_id_str, canonical)
+            if ref_type == 'retweet' and not row[2]:
+                row[2] = canonical[ref_id_str][3]
+            restored.append(row[:-2])
+        # the in-memory and the external sorts order the tweets of the same second differently
+        self.assertEqual(sorted(restored), sorted(expanded_rows[1:]))
+        self.assertGreater(report['metrics']['collapsed_retweets_total'], 500)
+        self.assertGreater(report['metrics']['normalized_text_bytes_total'], 0)
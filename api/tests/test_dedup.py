@@ -0,0 +1,69 @@
+from unittest import TestCase
+
+from api.dedup import BloomDeduplicator, LRUDeduplicator, SetDeduplicator, WindowDeduplicator, create_deduplicator
+
+
+# snowflake ID created at the given millisecond offset from the snowflake epoch
+def snowflake(ms, sequence=0):
+    return (ms << 22) | sequence
+
+
+class DeduplicatorTestCase(TestCase):
+
+    def test_exact_backends(self):
+        """
+        Test that every backend detects recent duplicates
+        """
+        for deduplicator in (SetDeduplicator(), LRUDeduplicator(size=100), WindowDeduplicator(window=60),
+                             BloomDeduplicator(size=100)):
+            ids = [snowflake(1000 + ind, ind) for ind in range(50)]
+            self.assertTrue(all(deduplicator.add(message_id) for message_id in ids))
+            self.assertFalse(any(deduplicator.add(message_id) for message_id in ids))
+            self.assertIn(ids[0], deduplicator)
+            self.assertGreater(deduplicator.memory_usage(), 0)
+
+    def test_lru_evicts(self):
+        """
+        Test that LRU backend keeps only the given number of IDs
+        """
+        deduplicator = LRUDeduplicator(size=10)
+        for message_id in range(20):
+            deduplicator.add(message_id)
+        self.assertEqual(len(deduplicator), 10)
+        self.assertNotIn(0, deduplicator)
+        self.assertIn(19, deduplicator)
+
+    def test_window_evicts(self):
+        """
+        Test that window backend releases IDs that fall out of the window
+        """
+        deduplicator = WindowDeduplicator(window=10, buckets=10)
+        deduplicator.add(snowflake(0))
+        deduplicator.add(snowflake(5000))
+        deduplicator.add(snowflake(20000))
+        self.assertNotIn(snowflake(0), deduplicator)
+        self.assertIn(snowflake(20000), deduplicator)
+        self.assertEqual(len(deduplicator), 1)
+        # late IDs are considered new
+        self.assertTrue(deduplicator.add(snowflake(0)))
+
+    def test_bloom_error_rate(self):
+        """
+        Test that the scalable Bloom filter keeps the false-positive rate below the given one
+        """
+        deduplicator = BloomDeduplicator(size=1000, error_rate=0.01)
+        for message_id in range(10000):
+            deduplicator.add(snowflake(message_id))
+        self.assertGreater(len(deduplicator.filters), 1)
+        false_positives = sum(snowflake(message_id) in deduplicator for message_id in range(10000, 20000))
+        self.assertLess(false_positives / 10000, 0.01)
+
+    def test_create_deduplicator(self):
+        """
+        Test that deduplicators are created by name with relevant parameters only
+        """
+        deduplicator = create_deduplicator('lru', size=5, error_rate=None, window=10)
+        self.assertIsInstance(deduplicator, LRUDeduplicator)
+        self.assertEqual(deduplicator.size, 5)
+        with self.assertRaises(ValueError):
+            create_deduplicator('foo')
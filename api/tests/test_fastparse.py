@@ -0,0 +1,102 @@
+import json
+from unittest import TestCase
+
+from api.decoder import decode_message
+from api.fastparse import extract_fields, is_control_message, parse_message
+
+
+def make_stream_tweet(id_str, text, user_id_str='42', retweeted_status=None):
+    """
+    Build a tweet with the field layout of the stream payloads
+    """
+    tweet = {
+        'created_at': 'Sat Sep 14 19:57:20 +0000 2019',
+        'id': int(id_str),
+        'id_str': id_str,
+        'text': text,
+        'source': '<a href="http://twitter.com" rel="nofollow">Twitter "Web" App</a>',
+        'in_reply_to_status_id_str': None,
+        'user': {
+            'id': int(user_id_str),
+            'id_str': user_id_str,
+            'name': 'Foo "Bar" ❤',
+            'screen_name': 'foo_bar',
+            'description': '"id_str":"1" \\ "created_at":"never"',
+            'created_at': 'Mon Jan 01 10:00:00 +0000 2018',
+        },
+        'geo': None,
+    }
+    if retweeted_status:
+        tweet['retweeted_status'] = retweeted_status
+    tweet['entities'] = {'hashtags': [], 'user_mentions': []}
+    return tweet
+
+
+class FastParseTestCase(TestCase):
+
+    def test_control_messages(self):
+        """
+        Test that control messages are detected by their leading key
+        """
+        for message in (b'{"limit":{"track":1,"timestamp_ms":"1568491040000"}}',
+                        b'{"delete":{"status":{"id":1,"id_str":"1"}}}',
+                        b'{"scrub_geo":{"user_id":1}}', b'{"warning":{"code":"FALLING_BEHIND"}}'):
+            self.assertTrue(is_control_message(message))
+            self.assertEqual(parse_message(message), ('control', None))
+        self.assertFalse(is_control_message(b'{"created_at":"Sat Sep 14 19:57:20 +0000 2019"}'))
+
+    def test_fast_path_matches_json(self):
+        """
+        Test that the fast path extracts the same fields as the full parser
+        """
+        original = make_stream_tweet('1172962556291551200', 'original "text"', user_id_str='7')
+        messages = [
+            make_stream_tweet('1172962556291551233', 'RT @foo: "quoted" \\ text “😀', retweeted_status=original),
+            make_stream_tweet('1172962556291551234', 'plain text'),
+        ]
+        for tweet in messages:
+            for ensure_ascii in (True, False):
+                message = json.dumps(tweet, ensure_ascii=ensure_ascii, separators=(',', ':')).encode()
+                status, _ = parse_message(message)
+                self.assertEqual(status, 'tweet')
+                self.assertEqual(decode_message(message, fast_parse=True), decode_message(message))
+                self.assertEqual(extract_fields(message)[:3], (tweet['id_str'], tweet['created_at'], tweet['text']))
+
+    def test_fallback(self):
+        """
+        Test that payloads of unexpected layout fall back to the full parser
+        """
+        tweet = make_stream_tweet('1172962556291551233', 'text')
+        reordered = dict(reversed(list(tweet.items())))
+        message = json.dumps(reordered).encode()
+        self.assertEqual(parse_message(message), (None, None))
+        self.assertEqual(decode_message(message, fast_parse=True), decode_message(message))
+
+        # user object without a creation date: the date of the retweeted status must not be taken
+        tweet = make_stream_tweet('1172962556291551233', 'text',
+                                  retweeted_status=make_stream_tweet('1172962556291551200', 'text'))
+        del tweet['user']['created_at']
+        message = json.dumps(tweet, separators=(',', ':')).encode()
+        self.assertEqual(parse_message(message), (None, None))
+        self.assertIsNone(decode_message(message, fast_parse=True))
+
+    def test_references(self):
+        """
+        Test that the fast path extracts the retweeted and quoted tweets as the full parser does
+        """
+        original = make_stream_tweet('1172962556291551200', 'original "text" ❤', user_id_str='7')
+        quote = make_stream_tweet('1172962556291551233', 'quoting')
+        quote['quoted_status'] = original
+        messages = [
+            make_stream_tweet('1172962556291551234', 'RT @foo_bar: original "text" ❤', retweeted_status=original),
+            quote,
+            make_stream_tweet('1172962556291551235', 'plain text'),
+        ]
+        expected = [('retweet', '1172962556291551200', 'original "text" ❤', 'foo_bar'),
+                    ('quote', '1172962556291551200', 'original "text" ❤', 'foo_bar'), (None, None, None, None)]
+        for tweet, reference in zip(messages, expected):
+            message = json.dumps(tweet, separators=(',', ':')).encode()
+            record = decode_message(message, fast_parse=True, references=True)
+            self.assertEqual(record, decode_message(message, references=True))
+            self.assertEqual(tuple(record[7:]), reference)
+            self.assertEqual(decode_message(message, fast_parse=True).ref_type, None)
@@ -0,0 +1,72 @@
+import io
+import json
+import random
+from unittest import TestCase
+
+from api.bench import run_benchmark, run_framing_benchmark
+from api.framing import ChunkReader, iter_delimited
+from api.replay import generate_stream
+from api.tests.test_processor import make_tweet
+
+
+def delimited_capture(lines, keep_alive_every=3):
+    return b''.join(b'\r\n' * (ind % keep_alive_every == 0) + b'%d\r\n%s\r\n' % (len(line) + 2, line)
+                    for ind, line in enumerate(lines))
+
+
+class FramingTestCase(TestCase):
+
+    def test_iter_delimited(self):
+        """
+        Test that messages split across random chunks are framed by their lengths, growing a small buffer
+        """
+        lines = generate_stream(300)
+        capture = delimited_capture(lines)
+        rng = random.Random(1)
+        sizes = [rng.randrange(1, 3000) for _ in range(len(capture))]
+        offsets = [0]
+        while offsets[-1] < len(capture):
+            offsets.append(offsets[-1] + sizes[len(offsets)])
+        chunks = [capture[start:stop] for start, stop in zip(offsets, offsets[1:])]
+
+        for buffer_size in (64, 1 << 16):
+            with self.subTest(buffer_size=buffer_size):
+                messages = [bytes(message) for message in iter_delimited(ChunkReader(chunks).readinto, buffer_size)]
+                self.assertEqual([message for message in messages if message], lines)
+                self.assertEqual(messages.count(b''), 100)
+
+    def test_invalid_prefix(self):
+        """
+        Test that a newline-delimited stream is rejected
+        """
+        with self.assertRaises(ValueError):
+            list(iter_delimited(io.BytesIO(b'{"id": 1}\r\n').readinto))
+
+    def test_truncated_stream(self):
+        """
+        Test that a message cut by the end of the stream is not yielded
+        """
+        messages = list(iter_delimited(io.BytesIO(b'5\r\nabc\r\n10\r\nabc').readinto))
+        self.assertEqual([bytes(message) for message in messages], [b'abc'])
+
+    def test_run_framing_benchmark(self):
+        """
+        Test that all framings split the capture into the same number of lines
+        """
+        report = run_framing_benchmark(generate_stream(200), repeat=1)
+        self.assertEqual(set(report), {'iter_lines', 'iter_lines-64k', 'delimited'})
+
+    def test_delimited_stream(self):
+        """
+        Test that all unique tweets of the length-delimited stream go through the pipeline, and the messages
+        decoded by the streamer are accounted by their size in bytes
+        """
+        tweet = make_tweet('1187000000000000000')
+        tweet['text'] = 'caf\u00e9 \U0001f600'
+        lines = generate_stream(300) + [json.dumps(tweet, ensure_ascii=False).encode()]
+        tweet_lines = {line for line in lines if b'"user"' in line}
+        for options in ({}, {'fast_parse': True}, {'batch_size': 20, 'decode_workers': 2}):
+            with self.subTest(**options):
+                report = run_benchmark(lines, time_limit=10, delimited=True, **options)
+                self.assertEqual(report['messages'], len(tweet_lines))
+                self.assertEqual(report['metrics']['limiter_bytes'], sum(map(len, tweet_lines)))
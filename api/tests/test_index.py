@@ -0,0 +1,76 @@
+import csv
+import io
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from api.bench import generate_rows
+from api.index import OutputIndex, index_filename
+from api.writers import create_writer
+
+
+class OutputIndexTestCase(TestCase):
+
+    def setUp(self):
+        rows = generate_rows(500) + [
+            ('1172962556291551999', 1568491040, 'tab\there\nnew line ünï', '42', 1514800800, 'Name "ñ"\nquoted',
+             'screen\tname'),
+        ]
+        # the processor output is grouped by user and ordered by the user creation date
+        self.rows = sorted(rows, key=lambda row: (row[4], row[3]))
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def _write(self, name, rows=None):
+        filename = os.path.join(self.tmp_dir.name, f'output.{name}')
+        with create_writer(name, filename, index=True) as writer:
+            writer.write_rows(iter(rows or self.rows))
+        return filename
+
+    @staticmethod
+    def _parse(name, data):
+        text = data.decode('utf-8')
+        if name == 'tsv':
+            return [(row[0], row[3]) for row in csv.reader(io.StringIO(text, newline=''), delimiter='\t')]
+        return [(row['id_str'], row['user_id_str']) for row in map(json.loads, text.splitlines())]
+
+    def test_lookups(self):
+        """
+        Test that the user and the user creation date lookups return exactly the matching rows
+        """
+        user_ids = sorted({row[3] for row in self.rows})
+        epochs = sorted({row[4] for row in self.rows})
+        from_epoch, to_epoch = epochs[len(epochs) // 4], epochs[len(epochs) // 2]
+        for name in ('tsv', 'jsonl'):
+            with self.subTest(name=name), OutputIndex(self._write(name)) as index:
+                self.assertEqual(index.output_format, name)
+                self.assertEqual(index.users_count, len(user_ids))
+                for user_id in ('42', user_ids[0], user_ids[-1]):
+                    start, end, epoch = index.find_user(user_id)
+                    self.assertEqual(self._parse(name, b''.join(index.read(start, end, chunk_size=100))),
+                                     [(row[0], row[3]) for row in self.rows if row[3] == user_id])
+                self.assertIsNone(index.find_user('1'))
+
+                start, end = index.epoch_range(from_epoch, to_epoch)
+                self.assertEqual(self._parse(name, b''.join(index.read(start, end))),
+                                 [(row[0], row[3]) for row in self.rows if from_epoch <= row[4] <= to_epoch])
+                start, end = index.epoch_range(to_epoch, from_epoch)
+                self.assertEqual(start, end)
+                self.assertEqual(bool(index.header()), name == 'tsv')
+
+    def test_invalid(self):
+        """
+        Test the unsupported formats, unordered rows (no index) and an index of a rewritten file
+        """
+        with self.assertRaises(ValueError):
+            create_writer('tsv.gz', os.path.join(self.tmp_dir.name, 'output.tsv.gz'), index=True)
+
+        filename = self._write('tsv', rows=list(reversed(self.rows)))
+        self.assertFalse(os.path.exists(index_filename(filename)))
+
+        filename = self._write('jsonl')
+        with open(filename, 'a') as f:
+            f.write('\n')
+        with self.assertRaises(ValueError):
+            OutputIndex(filename)
@@ -0,0 +1,147 @@
+import json
+import os
+import queue
+import tempfile
+from unittest import TestCase
+
+from api.auth import NoAuthenticator
+from api.journal import FRAME_HEADER, Journal, segment_filename
+from api.replay import ReplayServer, generate_stream
+from api.twitter_api import TwitterAPI
+
+
+class JournalTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.directory = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_resume(self):
+        """
+        Test that lines span the segments and a resumed journal reads on from the committed cursor
+        """
+        lines = [bytes([65 + ind % 26]) * (10 + ind % 50) for ind in range(300)]
+        journal = Journal(self.directory, segment_size=1024, fsync='always', retain_segments=None)
+        journal.put(lines[:100])
+        for line in lines[100:]:
+            journal.put(line)
+        self.assertEqual(journal.qsize(), 300)
+        self.assertEqual([journal.get(timeout=0) for _ in range(120)], lines[:120])
+        journal.commit(journal.tell())
+        self.assertEqual(journal.get(timeout=0), lines[120])
+        journal.close()
+        self.assertGreater(len(journal.segments()), 5)
+
+        journal = Journal(self.directory, segment_size=1024, resume=True, retain_segments=None)
+        self.assertEqual(journal.qsize(), 180)
+        self.assertEqual(list(journal.iter_committed()), lines[:120])
+        journal.put(b'new')
+        self.assertEqual([journal.get(timeout=0) for _ in range(181)], lines[120:] + [b'new'])
+        with self.assertRaises(queue.Empty):
+            journal.get(timeout=0.01)
+        journal.close()
+
+        # without resume the reader starts at the end
+        journal = Journal(self.directory, segment_size=1024)
+        self.assertTrue(journal.empty())
+        journal.close()
+
+    def test_segment_removal(self):
+        """
+        Test that the committed segments but the retained ones are removed and not replayed by a resumed run
+        """
+        lines = [b'%04d' % ind * 10 for ind in range(100)]
+        journal = Journal(self.directory, segment_size=256, retain_segments=1)
+        journal.put(lines)
+        segments = journal.segments()
+        self.assertGreater(len(segments), 10)
+        self.assertEqual([journal.get(timeout=0) for _ in range(60)], lines[:60])
+        journal.commit(journal.tell())
+        committed_segment = journal.tell()[0]
+        self.assertEqual(journal.segments(), segments[committed_segment - 1:])
+        self.assertEqual(journal.segments_removed.value, committed_segment - 1)
+        journal.close()
+
+        journal = Journal(self.directory, segment_size=256, resume=True)
+        committed = list(journal.iter_committed())
+        self.assertLess(len(committed), 60)
+        self.assertEqual(committed, lines[60 - len(committed):60])
+        self.assertEqual([journal.get(timeout=0) for _ in range(40)], lines[60:])
+        journal.close()
+
+    def test_torn_frame(self):
+        """
+        Test that a frame torn by a crash ends the journal and is overwritten by the next run
+        """
+        journal = Journal(self.directory)
+        journal.put([b'first', b'second'])
+        journal.close()
+        with open(segment_filename(self.directory, 0), 'r+b') as f:
+            f.seek(FRAME_HEADER.size + len(b'first') + FRAME_HEADER.size)
+            f.write(b'X')
+
+        journal = Journal(self.directory, resume=True)
+        journal.put(b'third')
+        self.assertEqual([journal.get(timeout=0) for _ in range(2)], [b'first', b'third'])
+        journal.close()
+
+    def test_quiet_stream_sync(self):
+        """
+        Test that the lines written within the sync interval are synced by the waiting reader on a quiet stream
+        """
+        journal = Journal(self.directory, fsync_interval=0.2)
+        try:
+            journal.put(b'first')
+            journal.put(b'second')
+            self.assertEqual(journal.syncs.value, 0)
+            self.assertEqual(journal.get(timeout=0), b'first')
+            self.assertEqual(journal.get(timeout=0), b'second')
+            with self.assertRaises(queue.Empty):
+                journal.get(timeout=0.5)
+            self.assertEqual(journal.syncs.value, 1)
+        finally:
+            journal.close()
+
+    def test_limits(self):
+        """
+        Test a line longer than a segment and the unsupported options
+        """
+        journal = Journal(self.directory, segment_size=64)
+        with self.assertRaises(ValueError):
+            journal.put(b'x' * 64)
+        journal.close()
+        with self.assertRaises(ValueError):
+            Journal(self.directory, fsync='sometimes')
+        with self.assertRaises(ValueError):
+            TwitterAPI('key', 'secret', engine='asyncio', journal_dir=self.directory)
+        with self.assertRaises(ValueError):
+            TwitterAPI('key', 'secret', resume=True)
+
+    def test_resume_pipeline(self):
+        """
+        Test that a run resumed after a crash exports the journal lines that were not exported, and the next
+        resumed run does not export them again
+        """
+        lines = generate_stream(1000)
+        unique_tweets = len({json.loads(line)['id_str'] for line in lines if b'"user"' in line})
+        # lines of the crashed run, never committed
+        journal = Journal(self.directory, segment_size=1 << 16)
+        journal.put(lines)
+        journal.close()
+
+        server = ReplayServer(lines)
+        server.start()
+        try:
+            filename = os.path.join(self.directory, 'output.csv')
+            for message_limit, expected in ((unique_tweets, unique_tweets), (None, 0)):
+                api = TwitterAPI('key', 'secret', time_limit=2, message_limit=message_limit, filename=filename,
+                                 auth_cls=NoAuthenticator, stream_root_url=server.url, journal_dir=self.directory,
+                                 resume=True, journal_segment_size=1 << 16, journal_retain_segments=None)
+                api.filter_tweets('bieber')
+                with open(filename) as f:
+                    self.assertEqual(len(f.readlines()) - 1, expected)
+        finally:
+            server.stop()
@@ -0,0 +1,84 @@
+import time
+from threading import Barrier, Event, Thread
+from unittest import TestCase
+
+from api.limiter import Limiter
+
+
+class LimiterTestCase(TestCase):
+
+    def test_message_limit(self):
+        """
+        Test that the STOP event is set exactly when the message limit is reached
+        """
+        stop_event = Event()
+        limiter = Limiter(30, 3, None, stop_event)
+        self.assertTrue(limiter.accept(10, '1'))
+        self.assertTrue(limiter.accept(10, '1'))
+        self.assertFalse(stop_event.is_set())
+        self.assertTrue(limiter.accept(10, '1'))
+        self.assertTrue(stop_event.is_set())
+        self.assertFalse(limiter.accept(10, '1'))
+
+    def test_zero_limits(self):
+        """
+        Test that zero limits stop the run right away instead of being taken for no limits
+        """
+        stop_event = Event()
+        limiter = Limiter(30, 0, None, stop_event)
+        self.assertFalse(limiter.accept(10, '1'))
+        self.assertTrue(stop_event.is_set())
+
+        stop_event = Event()
+        limiter = Limiter(0, None, Barrier(1), stop_event)
+        limiter.start()
+        self.assertTrue(stop_event.is_set())
+
+    def test_byte_limit(self):
+        """
+        Test that the STOP event is set when the byte budget is exhausted
+        """
+        stop_event = Event()
+        limiter = Limiter(30, 100, None, stop_event, byte_limit=25)
+        self.assertTrue(limiter.accept(10, '1'))
+        self.assertTrue(limiter.accept(10, '2'))
+        self.assertFalse(limiter.accept(10, '3'))
+        self.assertTrue(stop_event.is_set())
+        self.assertEqual(limiter.bytes_count, 20)
+
+    def test_user_message_limit(self):
+        """
+        Test that messages of users who reached the per-user cap are skipped without stopping
+        """
+        stop_event = Event()
+        limiter = Limiter(30, 100, None, stop_event, user_message_limit=2)
+        self.assertTrue(limiter.accept(10, '1'))
+        self.assertTrue(limiter.accept(10, '1'))
+        self.assertFalse(limiter.accept(10, '1'))
+        self.assertTrue(limiter.accept(10, '2'))
+        self.assertFalse(stop_event.is_set())
+
+    def test_stop_latency(self):
+        """
+        Test that the limiter thread wakes up as soon as the STOP event is set
+        """
+        stop_event = Event()
+        limiter = Limiter(30, 1, Barrier(1), stop_event)
+        thread = Thread(target=limiter.start)
+        thread.start()
+        started = time.monotonic()
+        limiter.accept(10, '1')
+        thread.join(1)
+        self.assertFalse(thread.is_alive())
+        self.assertLess(time.monotonic() - started, 0.1)
+
+    def test_time_limit(self):
+        """
+        Test that the STOP event is set when the time is out
+        """
+        stop_event = Event()
+        limiter = Limiter(0.2, 100, Barrier(1), stop_event)
+        started = time.monotonic()
+        limiter.start()
+        self.assertTrue(stop_event.is_set())
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
@@ -0,0 +1,72 @@
+import csv
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from api.bench import run_benchmark
+from api.matcher import TrackMatcher, parse_track, route_filename, route_names
+from api.replay import generate_stream
+
+
+class TrackMatcherTestCase(TestCase):
+
+    def test_match(self):
+        """
+        Test the Twitter matching rules: case folding, token boundaries, punctuated terms and phrases of several terms
+        """
+        matcher = TrackMatcher(['Bieber, #music', 'justin  bieber,twitter,c++'])
+        self.assertEqual(matcher.phrases, ['bieber', '#music', 'justin bieber', 'twitter', 'c++'])
+        cases = (
+            ('BIEBER!', ('bieber', )),
+            ('#bieber @bieber http://bieber.com', ('bieber', )),
+            ('BieberFever #nobieber', ()),
+            ('Bieber, meet Justin', ('bieber', 'justin bieber')),
+            ('#music and music', ('#music', )),
+            ('music #musical', ()),
+            ("twitter's tweets, not TwitterTracker", ('twitter', )),
+            ('I code c++ daily', ('c++', )),
+            ('', ()),
+        )
+        for text, matched in cases:
+            with self.subTest(text=text):
+                self.assertEqual(matcher.match(text), matched)
+
+    def test_route_filename(self):
+        """
+        Test the routed output filenames: unique safe names, the placeholder and the inserted name
+        """
+        names = route_names(parse_track('justin bieber,justin/bieber,#music,%%'))
+        self.assertEqual(names, {'justin bieber': 'justin_bieber', 'justin/bieber': 'justin_bieber-2',
+                                 '#music': '#music', '%%': 'phrase'})
+        self.assertEqual(route_filename('./data/out.csv.gz', '#music'), './data/out-#music.csv.gz')
+        self.assertEqual(route_filename('out-{phrase}.csv', '_unmatched'), 'out-_unmatched.csv')
+
+    def test_pipeline(self):
+        """
+        Test the tagged output and the routed outputs of the full pipeline
+        """
+        lines = generate_stream(500, control_ratio=0, duplicate_ratio=0)
+        texts = {json.loads(line)['id_str']: json.loads(line)['text'] for line in lines}
+        hashtags = sorted({text.split(' ')[4] for text in texts.values()})[:2]
+        track = [f'bieber,{hashtags[0]}', f'{hashtags[1]},nothing']
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, 'output.jsonl')
+            run_benchmark(lines, track=track, filename=filename, output_format='jsonl', tag=True)
+            with open(filename) as f:
+                rows = [json.loads(line) for line in f]
+            self.assertEqual(len(rows), len(texts))
+            for row in rows:
+                expected = ['bieber'] + [tag for tag in hashtags if f'{tag} ' in texts[row['id_str']]]
+                self.assertEqual(row['matched'], expected)
+
+            filename = os.path.join(tmp_dir, 'routed-{phrase}.csv')
+            run_benchmark(lines, track=track, filename=filename, route=True, sort_buffer_size=100)
+            self.assertEqual(sorted(os.listdir(tmp_dir)),
+                             sorted(['output.jsonl', 'routed-bieber.csv'] + [f'routed-{tag}.csv' for tag in hashtags]))
+            for name in hashtags + ['bieber']:
+                with open(os.path.join(tmp_dir, f'routed-{name}.csv'), newline='') as f:
+                    rows = list(csv.reader(f, delimiter='\t'))[1:]
+                self.assertEqual(len(rows[0]), 7)
+                self.assertEqual(sorted(row[0] for row in rows),
+                                 sorted(id_str for id_str, text in texts.items() if f'{name} ' in text))
@@ -0,0 +1,150 @@
+import json
+import os
+import sys
+import tempfile
+from queue import Queue
+from threading import Event, Thread
+from unittest import TestCase
+
+from api.metrics import MetricsRegistry
+from api.tests.test_processor import make_tweet
+from api.tweets_processor import TweetsProcessor
+from api.tweets_streamer import TweetsStreamer
+
+
+class MetricsRegistryTestCase(TestCase):
+
+    def test_metrics_are_shared_by_name(self):
+        """
+        Test that requesting a metric twice returns the same instance and a type clash is rejected
+        """
+        registry = MetricsRegistry()
+        registry.counter('lines_total').inc(2)
+        registry.counter('lines_total').inc()
+        self.assertEqual(registry.snapshot(), {'lines_total': 3})
+        with self.assertRaises(ValueError):
+            registry.gauge('lines_total')
+
+    def test_histogram(self):
+        """
+        Test histogram buckets and quantile estimates
+        """
+        histogram = MetricsRegistry().histogram('latency_seconds', buckets=(0.1, 1, 10))
+        for value in (0.05, 0.5, 0.5, 5, 50):
+            histogram.observe(value)
+        self.assertEqual(histogram.bucket_counts, [1, 2, 1, 1])
+        self.assertEqual(histogram.quantile(0.5), 1)
+        self.assertEqual(histogram.quantile(1), float('inf'))
+
+    def test_concurrent_updates(self):
+        """
+        Test that no update is lost when several threads update the same metrics
+        """
+        registry = MetricsRegistry()
+        counter = registry.counter('lines_total')
+        histogram = registry.histogram('latency_seconds', buckets=(0.1, 1))
+
+        def update():
+            for _ in range(20000):
+                counter.inc()
+                histogram.observe(0.5)
+
+        switch_interval = sys.getswitchinterval()
+        # switch the threads as often as possible to expose the races
+        sys.setswitchinterval(1e-6)
+        try:
+            threads = [Thread(target=update) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(switch_interval)
+        self.assertEqual(counter.value, 80000)
+        self.assertEqual((histogram.count, histogram.bucket_counts), (80000, [0, 80000, 0]))
+        self.assertEqual(histogram.sum, 40000)
+
+    def test_prometheus_file(self):
+        """
+        Test the Prometheus text format output
+        """
+        registry = MetricsRegistry()
+        registry.counter('lines_total', 'Lines received').inc(5)
+        registry.gauge('queue_depth', function=lambda: 7)
+        registry.histogram('decode_seconds', buckets=(0.001, 0.01)).observe(0.005)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, 'metrics.prom')
+            registry.write_prometheus(filename)
+            with open(filename) as f:
+                lines = f.read().splitlines()
+            self.assertEqual(os.listdir(tmp_dir), ['metrics.prom'])
+
+        self.assertIn('# HELP twitter_lines_total Lines received', lines)
+        self.assertIn('# TYPE twitter_lines_total counter', lines)
+        self.assertIn('twitter_lines_total 5', lines)
+        self.assertIn('twitter_queue_depth 7', lines)
+        self.assertIn('twitter_decode_seconds_bucket{le="0.001"} 0', lines)
+        self.assertIn('twitter_decode_seconds_bucket{le="0.01"} 1', lines)
+        self.assertIn('twitter_decode_seconds_bucket{le="+Inf"} 1', lines)
+        self.assertIn('twitter_decode_seconds_count 1', lines)
+
+    def test_labels(self):
+        """
+        Test that labeled metrics are kept apart and share the HELP and TYPE lines
+        """
+        registry = MetricsRegistry()
+        registry.counter('lines_total', 'Lines received', {'stream': '0'}).inc(2)
+        registry.counter('lines_total', 'Lines received', {'stream': '1'}).inc(3)
+        self.assertEqual(registry.snapshot(), {'lines_total{stream="0"}': 2, 'lines_total{stream="1"}': 3})
+
+        lines = registry.to_prometheus().splitlines()
+        self.assertEqual(lines, [
+            '# HELP twitter_lines_total Lines received',
+            '# TYPE twitter_lines_total counter',
+            'twitter_lines_total{stream="0"} 2',
+            'twitter_lines_total{stream="1"} 3',
+        ])
+
+
+class PipelineMetricsTestCase(TestCase):
+
+    def test_processor_metrics(self):
+        """
+        Test that the processor accounts accepted, duplicated, invalid and control messages
+        """
+        registry = MetricsRegistry()
+        processor = TweetsProcessor(Queue(), Queue(), None, Event(), metrics=registry)
+        messages = [
+            json.dumps(make_tweet('1172962556291551233')).encode(),
+            json.dumps(make_tweet('1172962556291551233')).encode(),
+            json.dumps(make_tweet('1172962556291551234')).encode(),
+            b'{"limit":{"track":42,"timestamp_ms":"1568491040000"}}',
+            b'{"foo":"bar"}',
+            b'not a json',
+        ]
+        processor._process_batch(messages)
+
+        snapshot = registry.snapshot()
+        self.assertEqual(snapshot['accepted_messages_total'], 2)
+        self.assertEqual(snapshot['duplicate_messages_total'], 1)
+        self.assertEqual(snapshot['control_messages_total'], 1)
+        self.assertEqual(snapshot['invalid_messages_total'], 2)
+        self.assertEqual(snapshot['decode_seconds'], 5)
+        self.assertEqual(snapshot['stream_lag_seconds'], 2)
+        self.assertEqual(snapshot['input_queue_depth'], 0)
+
+    def test_streamer_metrics(self):
+        """
+        Test that the streamer accounts received lines and limit notices
+        """
+        registry = MetricsRegistry()
+        streamer = TweetsStreamer('key', 'secret', None, Queue(), Event(), metrics=registry)
+        for line in (b'{"limit":{"track":42}}', b'{"id_str":"1"}', b'{"limit":{"track":50}}'):
+            streamer._observe_line(line)
+
+        snapshot = registry.snapshot()
+        self.assertEqual(snapshot['lines_received_total'], 3)
+        self.assertEqual(snapshot['bytes_received_total'], 58)
+        self.assertEqual(snapshot['limit_notices_total'], 2)
+        self.assertEqual(snapshot['limit_undelivered'], 50)
@@ -0,0 +1,53 @@
+import sys
+from datetime import datetime
+from unittest import TestCase
+
+from api.models import AnnotatedTweet, Tweet, User, parse_created_at, snowflake_to_epoch
+
+
+class ModelsTestCase(TestCase):
+
+    def test_parse_created_at(self):
+        """
+        Test that the fast parser is equivalent to strptime
+        """
+        for created_at in ('Sat Sep 14 19:57:20 +0000 2019', 'Tue Feb 29 00:00:01 +0000 2000',
+                           'Wed Dec 31 23:59:59 +0530 2014', 'Thu Jan 01 00:00:00 -0800 2015'):
+            expected = datetime.strptime(created_at, '%a %b %d %H:%M:%S %z %Y').timestamp()
+            self.assertEqual(parse_created_at(created_at), expected)
+
+    def test_parse_created_at_invalid(self):
+        """
+        Test that invalid creation dates are rejected
+        """
+        for created_at in ('today', '', None, 'Sat Foo 14 19:57:20 +0000 2019'):
+            with self.assertRaises(ValueError):
+                parse_created_at(created_at)
+
+    def test_snowflake_to_epoch(self):
+        """
+        Test the creation time extraction from the snowflake ID
+        """
+        self.assertEqual(snowflake_to_epoch('1172962556291551233'), 1568491040)
+        self.assertIsNone(snowflake_to_epoch('20'))
+        self.assertIsNone(snowflake_to_epoch('foo'))
+
+    def test_user_tweets_order(self):
+        """
+        Test that user's tweets are ordered by the creation date
+        """
+        user = User(id_str='1', name='Foo', screen_name='foo', created_at='Sat Sep 14 19:57:20 +0000 2019')
+        user.add_tweet(Tweet(id_str='2', created_at='Sat Sep 14 19:57:22 +0000 2019', text='bar'))
+        user.add_tweet(Tweet(id_str='1', created_at='Sat Sep 14 19:57:21 +0000 2019', text='bar'))
+        self.assertEqual([tweet.id_str for tweet in user.tweets], ['1', '2'])
+
+    def test_annotated_tweet(self):
+        """
+        Test that only the annotated tweets carry the matched phrases and the reference slots
+        """
+        tweet = Tweet(id_str='1', created_at=1568491040, text='bar')
+        annotated = AnnotatedTweet(id_str='1', created_at=1568491040, text='bar')
+        self.assertFalse(hasattr(tweet, 'matched'))
+        self.assertEqual((annotated.matched, annotated.ref_type, annotated.ref), (None, None, None))
+        self.assertEqual(annotated, tweet)
+        self.assertLess(sys.getsizeof(tweet), sys.getsizeof(annotated))
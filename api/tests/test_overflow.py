@@ -0,0 +1,125 @@
+import json
+import queue
+import tempfile
+import threading
+from unittest import TestCase
+
+from api.bench import run_benchmark
+from api.metrics import MetricsRegistry
+from api.overflow import (BlockingInputQueue, DropNewestInputQueue, DropOldestInputQueue, SampleInputQueue,
+                          SpillInputQueue, create_input_queue)
+from api.replay import generate_stream
+from api.twitter_api import TwitterAPI
+
+
+def drain(input_queue):
+    items = []
+    while not input_queue.empty():
+        items.append(input_queue.get(timeout=0))
+    return items
+
+
+class OverflowPolicyTestCase(TestCase):
+
+    def setUp(self):
+        self.metrics = MetricsRegistry()
+
+    def dropped(self):
+        return self.metrics.get('input_dropped_total').value
+
+    def test_drop_policies(self):
+        """
+        Test that drop_newest keeps the first items and drop_oldest the last ones, batches are counted by messages
+        """
+        input_queue = DropNewestInputQueue(3, metrics=self.metrics)
+        for item in range(5):
+            input_queue.put(item)
+        input_queue.put([5, 6])
+        self.assertEqual(drain(input_queue), [0, 1, 2])
+        self.assertEqual(self.dropped(), 4)
+
+        self.metrics = MetricsRegistry()
+        input_queue = DropOldestInputQueue(3, metrics=self.metrics)
+        input_queue.put([0, 1])
+        for item in range(2, 6):
+            input_queue.put(item)
+        self.assertEqual(drain(input_queue), [3, 4, 5])
+        self.assertEqual(self.dropped(), 3)
+
+    def test_sample(self):
+        """
+        Test that the sample keeps the queue size and takes items from the whole overflow
+        """
+        input_queue = SampleInputQueue(100, metrics=self.metrics, seed=1)
+        for item in range(10000):
+            input_queue.put(item)
+        items = drain(input_queue)
+        self.assertEqual(len(items), 100)
+        self.assertEqual(self.dropped(), 9900)
+        self.assertEqual(len(set(items)), 100)
+        # a uniform sample of 0..9999 has ~50 items in the second half
+        self.assertGreater(sum(item >= 5000 for item in items), 25)
+
+    def test_spill(self):
+        """
+        Test that spilled items come back in order and the spill file is reused once drained
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_queue = SpillInputQueue(2, metrics=self.metrics, spill_dir=tmp_dir)
+            for item in range(5):
+                input_queue.put(item)
+            input_queue.put([b'a', b'b'])
+            self.assertEqual(input_queue.qsize(), 6)
+            self.assertEqual(self.metrics.get('input_spilled_total').value, 5)
+            self.assertGreater(self.metrics.get('input_spill_bytes').value, 0)
+            self.assertEqual([input_queue.get(timeout=0) for _ in range(3)], [0, 1, 2])
+            input_queue.put(6)
+            self.assertEqual(drain(input_queue), [3, 4, [b'a', b'b'], 6])
+            self.assertEqual(self.metrics.get('input_spill_bytes').value, 0)
+            self.assertEqual(self.dropped(), 0)
+            input_queue.close()
+
+    def test_block(self):
+        """
+        Test that a blocked put waits for a get and gives up once the pipeline stops
+        """
+        stop_event = threading.Event()
+        input_queue = BlockingInputQueue(1, stop_event=stop_event, metrics=self.metrics)
+        input_queue.put(0)
+        timer = threading.Timer(0.1, input_queue.get)
+        timer.start()
+        input_queue.put(1)
+        timer.join()
+        self.assertEqual(drain(input_queue), [1])
+
+        input_queue.put(2)
+        stop_event.set()
+        input_queue.put(3)
+        self.assertEqual(drain(input_queue), [2])
+        self.assertEqual(self.dropped(), 1)
+        self.assertGreater(self.metrics.get('input_blocked_seconds_total').value, 0)
+
+    def test_create_input_queue(self):
+        """
+        Test the registry defaults and the rejected options
+        """
+        self.assertIs(type(create_input_queue('drop_oldest', None)), queue.Queue)
+        self.assertIsInstance(create_input_queue('sample', 10, spill_dir=None), SampleInputQueue)
+        with self.assertRaises(ValueError):
+            create_input_queue('unknown', 10)
+        with self.assertRaises(ValueError):
+            TwitterAPI('key', 'secret', engine='asyncio', input_queue_size=10, overflow_policy='spill')
+        with self.assertRaises(ValueError):
+            TwitterAPI('key', 'secret', processor_process=True, input_queue_size=10, overflow_policy='sample')
+
+    def test_pipeline(self):
+        """
+        Test that no tweet is lost by the pipeline with a small input queue when blocking or spilling
+        """
+        lines = generate_stream(2000)
+        unique_tweets = len({json.loads(line)['id_str'] for line in lines if b'"user"' in line})
+        for policy in ('block', 'spill'):
+            with self.subTest(policy=policy):
+                report = run_benchmark(lines, time_limit=20, input_queue_size=5, overflow_policy=policy)
+                self.assertEqual(report['messages'], unique_tweets)
+                self.assertEqual(report['metrics']['input_dropped_total'], 0)
@@ -1,9 +1,28 @@
+import csv
 import json
+import os
+import tempfile
 from queue import Queue
 from threading import Event, Timer
 from unittest import TestCase
 
+from api.dedup import SetDeduplicator, WindowDeduplicator
 from api.tweets_processor import TweetsProcessor
+from api.twitter_api import TwitterAPI
+
+
+def make_tweet(id_str, user_id_str='1', created_at='Sat Sep 14 19:57:20 +0000 2019'):
+    return {
+        'id_str': id_str,
+        'created_at': created_at,
+        'text': 'Foo Bar',
+        'user': {
+            'id_str': user_id_str,
+            'name': f'User {user_id_str}',
+            'screen_name': f'user{user_id_str}',
+            'created_at': 'Mon Jan 01 10:00:00 +0000 2018',
+        },
+    }
 
 
 class ProcessorTestCase(TestCase):
@@ -34,6 +53,24 @@ class ProcessorTestCase(TestCase):
             TweetsProcessor._check_is_tweet({'id_str': '123', 'created_at': 'Foo', 'text': 'bar', 'user': {}})
         )
 
+    def test_null_ids(self):
+        """
+        Test that tweets with a null tweet or user ID are skipped (on both parsing paths) instead of stopping
+        the processor, and are not restored to the deduplicator
+        """
+        null_tweet_id = make_tweet('1')
+        null_tweet_id['id_str'] = None
+        null_user_id = make_tweet('2')
+        null_user_id['user']['id_str'] = None
+        messages = [json.dumps(null_tweet_id).encode(), json.dumps(null_user_id).encode()]
+        for fast_parse in (False, True):
+            message_queue = Queue()
+            processor = TweetsProcessor(Queue(), message_queue, None, Event(), fast_parse=fast_parse)
+            for message in messages:
+                processor._process_message(message)
+            self.assertTrue(message_queue.empty())
+            self.assertEqual(processor.restore_deduplicator(messages), 0)
+
     def test_message_queue_limit(self):
         """
         Test that processor terminates when the message queue is full
@@ -45,12 +82,7 @@ class ProcessorTestCase(TestCase):
 
         # Add 15 valid messages to the input queue
         for ind in range(15):
-            tweet = json.dumps({
-                'id_str': str(ind),
-                'created_at': 'today',
-                'text': 'Foo Bar',
-                'user': {}
-            }).encode()
+            tweet = json.dumps(make_tweet(str(ind))).encode()
             input_queue.put(tweet)
 
         processor = TweetsProcessor(input_queue, message_queue, barrier, stop_event)
@@ -71,12 +103,7 @@ class ProcessorTestCase(TestCase):
 
         # Add 15 valid messages to the input queue
         for _ in range(15):
-            tweet = json.dumps({
-                'id_str': '123',
-                'created_at': 'today',
-                'text': 'Foo Bar',
-                'user': {}
-            }).encode()
+            tweet = json.dumps(make_tweet('123')).encode()
             input_queue.put(tweet)
 
         processor = TweetsProcessor(input_queue, message_queue, barrier, stop_event)
@@ -100,3 +127,154 @@ class ProcessorTestCase(TestCase):
 
         # Input queue must be empty
         self.assertTrue(input_queue.empty())
+
+    def test_external_sort_export(self):
+        """
+        Test that the external merge sort export produces the same file as the in-memory export
+        """
+        tweets = []
+        for ind in range(50):
+            tweet = make_tweet(str(1000 + ind), str(ind % 7), f'Sat Sep 14 19:{ind % 60:02d}:20 +0000 2019')
+            tweet['user']['created_at'] = f'Mon Jan 0{ind % 7 + 1} 10:00:00 +0000 2018'
+            tweets.append(tweet)
+
+        outputs = []
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for sort_buffer_size in (None, 8):
+                message_queue = Queue()
+                filename = os.path.join(tmp_dir, f'output_{sort_buffer_size}.csv')
+                processor = TweetsProcessor(Queue(), message_queue, None, Event(), filename=filename,
+                                            sort_buffer_size=sort_buffer_size)
+                for tweet in tweets:
+                    message_queue.put(processor._project(tweet))
+                processor._output_data()
+                with open(filename) as f:
+                    outputs.append(f.read())
+
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertEqual(len(outputs[0].splitlines()), 51)
+
+    def test_export_order_ties(self):
+        """
+        Test that users and tweets with equal creation dates are ordered by their IDs by both exports
+        """
+        tweets = [make_tweet(str(1000 + ind), str(10 + ind % 3)) for ind in (7, 2, 5, 0, 3, 8, 1, 6, 4)]
+        expected = [(user_id, str(1000 + ind)) for user_id in ('10', '11', '12') for ind in range(9)
+                    if str(10 + ind % 3) == user_id]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for sort_buffer_size in (None, 4):
+                message_queue = Queue()
+                filename = os.path.join(tmp_dir, f'output_{sort_buffer_size}.csv')
+                processor = TweetsProcessor(Queue(), message_queue, None, Event(), filename=filename,
+                                            sort_buffer_size=sort_buffer_size)
+                for tweet in tweets:
+                    message_queue.put(processor._project(tweet))
+                processor._output_data()
+                with open(filename, newline='') as f:
+                    rows = list(csv.reader(f, delimiter='\t'))[1:]
+                self.assertEqual([(row[3], row[0]) for row in rows], expected)
+
+    def test_project_interns_users(self):
+        """
+        Test that messages are projected to compact records sharing a single User instance per user
+        """
+        processor = TweetsProcessor(Queue(), Queue(), None, Event())
+        first = processor._project(make_tweet('1'))
+        second = processor._project(make_tweet('2'))
+        self.assertIs(first.user, second.user)
+        self.assertEqual(first.created_at, 1568491040)
+        self.assertFalse(hasattr(first, '__dict__'))
+
+        self.assertIsNone(processor._project({'id_str': '3', 'created_at': 'today', 'text': 'Foo', 'user': {}}))
+        self.assertIsNone(processor._project(make_tweet('3', user_id_str='2', created_at='today')))
+
+    def test_batched_input(self):
+        """
+        Test that processor handles batches of messages and stops in the middle of a batch at the limit
+        """
+        input_queue = Queue()
+        message_queue = Queue(10)
+        stop_event = Event()
+
+        batch = [json.dumps(make_tweet(str(ind))).encode() for ind in range(15)]
+        input_queue.put(batch[:5])
+        input_queue.put(batch[5:])
+
+        processor = TweetsProcessor(input_queue, message_queue, None, stop_event)
+        processor._accumulate_messages()
+
+        self.assertTrue(message_queue.full())
+        self.assertTrue(input_queue.empty())
+
+    def test_decode_workers(self):
+        """
+        Test that messages decoded in worker processes are deduplicated and limited globally
+        """
+        input_queue = Queue()
+        message_queue = Queue(10)
+        stop_event = Event()
+
+        for ind in range(30):
+            input_queue.put([json.dumps(make_tweet(str(ind % 12))).encode(), b'{"limit": {"track": 1}}'])
+
+        processor = TweetsProcessor(input_queue, message_queue, None, stop_event, decode_workers=2)
+        processor._accumulate_messages()
+
+        self.assertTrue(message_queue.full())
+        ids = [message_queue.get().id_str for _ in range(10)]
+        self.assertEqual(len(set(ids)), 10)
+
+    def test_rotation_by_messages(self):
+        """
+        Test that the continuous mode exports every window of messages to its own file and releases the users
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, 'output-{index}.csv')
+            processor = TweetsProcessor(Queue(), Queue(), None, Event(), filename=filename, rotate_messages=4)
+            processor._start_rotation()
+            processor._process_batch([json.dumps(make_tweet(str(ind), str(ind % 3))).encode() for ind in range(10)])
+            self.assertEqual(processor.window_index, 2)
+            self.assertEqual(len(processor.users), 2)
+            processor._finish_rotation()
+
+            self.assertEqual(sorted(os.listdir(tmp_dir)), ['output-0.csv', 'output-1.csv', 'output-2.csv'])
+            lines_count = []
+            for ind in range(3):
+                with open(os.path.join(tmp_dir, f'output-{ind}.csv')) as f:
+                    lines_count.append(len(f.read().splitlines()))
+            self.assertEqual(lines_count, [5, 5, 3])
+            self.assertEqual(processor.windows_exported.value, 3)
+
+    def test_rotation_by_time(self):
+        """
+        Test that the continuous mode rotates the output once the time window is over, skipping empty windows
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            processor = TweetsProcessor(Queue(), Queue(), None, Event(), filename=os.path.join(tmp_dir, 'out.csv'),
+                                        rotate_seconds=60)
+            processor._start_rotation()
+            processor._process_message(json.dumps(make_tweet('1')).encode())
+            processor._check_rotation()
+            self.assertEqual(processor.window_index, 0)
+
+            processor._window_deadline -= 60
+            processor._check_rotation()
+            processor._window_deadline -= 60
+            processor._check_rotation()
+            processor._finish_rotation()
+
+            self.assertEqual(processor.window_index, 3)
+            files = os.listdir(tmp_dir)
+            self.assertEqual(len(files), 1)
+            self.assertRegex(files[0], r'^out-\d{8}T\d{6}-000000\.csv$')
+
+    def test_continuous_mode_deduplicator(self):
+        """
+        Test that the continuous mode deduplicates with the bounded window backend unless another one is chosen
+        """
+        self.assertIsInstance(TwitterAPI('key', 'secret')._processor_kwargs()['deduplicator'], SetDeduplicator)
+        api = TwitterAPI('key', 'secret', rotate_seconds=60)
+        self.assertIsInstance(api._processor_kwargs()['deduplicator'], WindowDeduplicator)
+        api = TwitterAPI('key', 'secret', rotate_messages=100, dedup='set')
+        self.assertIsInstance(api._processor_kwargs()['deduplicator'], SetDeduplicator)
@@ -0,0 +1,55 @@
+import os
+import pstats
+import tempfile
+from unittest import TestCase
+
+from api.bench import run_benchmark
+from api.profiling import COLLAPSED_FILENAME, ThreadProfiler, collapse_stats
+from api.replay import generate_stream
+
+
+def _leaf(count):
+    return sum(i * i for i in range(count))
+
+
+def _branch():
+    return _leaf(20000) + _leaf(10000)
+
+
+def _root():
+    return _branch() + _leaf(30000)
+
+
+class ProfilingTestCase(TestCase):
+
+    def test_collapse_stats(self):
+        """
+        Test that the collapsed stacks follow the call paths and keep the total profiled time
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            profiler = ThreadProfiler(tmp_dir)
+            profiler.wrap('worker', _root)()
+            profiler.write()
+            stats = pstats.Stats(os.path.join(tmp_dir, 'worker.prof'))
+
+        stacks = collapse_stats(stats.stats, 'worker')
+        self.assertAlmostEqual(sum(stacks.values()), stats.total_tt, delta=stats.total_tt * 0.01)
+        paths = {tuple(frame.split(' ')[0] for frame in stack.split(';')) for stack in stacks}
+        self.assertIn(('worker', '_root', '_branch', '_leaf'), paths)
+        self.assertIn(('worker', '_root', '_leaf'), paths)
+        self.assertTrue(all(path[0] == 'worker' for path in paths))
+
+    def test_pipeline(self):
+        """
+        Test the profiles of the pipeline threads and the memory snapshot of the export
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            profile_dir = os.path.join(tmp_dir, 'profile')
+            memory_dir = os.path.join(tmp_dir, 'memory')
+            run_benchmark(generate_stream(500), profile_dir=profile_dir, trace_memory_dir=memory_dir)
+            self.assertEqual(sorted(os.listdir(profile_dir)),
+                             sorted([COLLAPSED_FILENAME, 'limiter.prof', 'processor.prof', 'streamer.prof']))
+            with open(os.path.join(profile_dir, COLLAPSED_FILENAME)) as f:
+                roots = {line.split(';')[0] for line in f}
+            self.assertEqual(roots, {'limiter', 'processor', 'streamer'})
+            self.assertEqual(os.listdir(memory_dir), ['0001-export.txt'])
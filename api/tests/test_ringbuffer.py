@@ -0,0 +1,177 @@
+import json
+import multiprocessing
+import os
+import queue
+import tempfile
+import threading
+from threading import Event
+from unittest import TestCase
+
+from api.auth import NoAuthenticator
+from api.bench import _consume_ring
+from api.replay import ReplayServer, generate_stream
+from api.ringbuffer import RingBuffer
+from api.tests.test_processor import make_tweet
+from api.tweets_processor import TweetsProcessor
+from api.twitter_api import TwitterAPI
+
+
+class RingBufferTestCase(TestCase):
+
+    def setUp(self):
+        self.ring = RingBuffer(64)
+
+    def tearDown(self):
+        self.ring.unlink()
+
+    def test_wrap_around(self):
+        """
+        Test that frames of various sizes keep their order and content when the ring wraps around
+        """
+        lines = [bytes([65 + ind % 26]) * (ind % 29) for ind in range(200)]
+        received = []
+        for line in lines:
+            self.ring.put(line)
+            received.append(self.ring.get(timeout=0))
+        self.assertEqual(received, lines)
+        self.assertEqual(self.ring.qsize(), 0)
+        self.assertTrue(self.ring.empty())
+
+    def test_batches_and_views(self):
+        """
+        Test that a list is written as separate frames and a view is released on the next read
+        """
+        self.ring.put([b'first', b'second'])
+        self.assertEqual(self.ring.qsize(), 2)
+        view = self.ring.get_view(timeout=0)
+        self.assertEqual(view.tobytes(), b'first')
+        self.assertEqual(self.ring.qsize(), 2)
+        view.release()
+        self.assertEqual(self.ring.get(timeout=0), b'second')
+        self.assertEqual(self.ring.qsize(), 0)
+
+    def test_limits(self):
+        """
+        Test the timeouts, a frame longer than the ring and reading a closed ring
+        """
+        with self.assertRaises(queue.Empty):
+            self.ring.get(timeout=0.01)
+        with self.assertRaises(ValueError):
+            self.ring.put(b'x' * 29)
+        self.ring.put([b'x' * 20, b'y' * 20])
+        with self.assertRaises(queue.Full):
+            self.ring.put(b'z' * 20, timeout=0.01)
+
+        self.ring.close()
+        self.ring.put(b'discarded')
+        self.assertEqual(self.ring.get(timeout=0), b'x' * 20)
+        self.assertEqual(self.ring.get(timeout=0), b'y' * 20)
+        self.assertIsNone(self.ring.get(timeout=0))
+
+    def test_child_process(self):
+        """
+        Test the hand-over of lines to a child process through a ring smaller than the data
+        """
+        lines = generate_stream(300)
+        output_queue = multiprocessing.Queue()
+        ring = RingBuffer(4096)
+        consumer = multiprocessing.Process(target=_consume_ring, args=(ring, output_queue))
+        consumer.start()
+        try:
+            for line in lines:
+                ring.put(line)
+            ring.close()
+            self.assertEqual(output_queue.get(timeout=10), (len(lines), sum(map(len, lines))))
+        finally:
+            consumer.join(10)
+            ring.unlink()
+
+    def test_several_producers(self):
+        """
+        Test that lines and batches put by several threads at once are neither lost nor mixed up
+        """
+        ring = RingBuffer(256)
+
+        def produce(producer):
+            lines = [b'%d-%d' % (producer, ind) for ind in range(2000)]
+            # every other group of four lines is put as a batch
+            for start in range(0, len(lines), 4):
+                if start % 8:
+                    ring.put(lines[start:start + 4])
+                else:
+                    for line in lines[start:start + 4]:
+                        ring.put(line)
+
+        producers = [threading.Thread(target=produce, args=(producer, )) for producer in range(4)]
+        for thread in producers:
+            thread.start()
+        received = {producer: [] for producer in range(4)}
+        try:
+            for _ in range(4 * 2000):
+                producer, ind = ring.get(timeout=10).split(b'-')
+                received[int(producer)].append(int(ind))
+        finally:
+            ring.close()
+            for thread in producers:
+                thread.join(10)
+            ring.unlink()
+        self.assertEqual(received, {producer: list(range(2000)) for producer in range(4)})
+
+    def test_processor_views(self):
+        """
+        Test that the processor decodes the frames in place and releases them, counting the skipped ones
+        """
+        for fast_parse in (False, True):
+            with self.subTest(fast_parse=fast_parse):
+                ring = RingBuffer(4096)
+                ring.put([json.dumps(make_tweet(str(ind % 3))).encode() for ind in range(5)])
+                ring.put([b'{"limit":{"track":1}}', b'{"id_str":"\xff"}'])
+                ring.close()
+                message_queue = queue.Queue()
+                processor = TweetsProcessor(ring, message_queue, None, Event(), fast_parse=fast_parse)
+                try:
+                    processor._accumulate_messages()
+                    self.assertEqual([message_queue.get_nowait().id_str for _ in range(message_queue.qsize())],
+                                     ['0', '1', '2'])
+                    self.assertEqual(processor.control_messages.value, 1)
+                    self.assertEqual(processor.invalid_messages.value, 1)
+                    self.assertEqual(ring.qsize(), 0)
+                finally:
+                    # fails if a view of the shared memory is still referenced
+                    ring.unlink()
+
+
+class ProcessorProcessTestCase(TestCase):
+
+    def test_filter_tweets(self):
+        """
+        Test that the processor running in a child process exports all unique tweets of the stream (the delimited
+        stream puts the views of the framing buffer to the ring)
+        """
+        lines = generate_stream(500)
+        server = ReplayServer(lines)
+        server.start()
+        unique_tweets = len({message_id for message_id in server.message_ids if message_id is not None})
+        try:
+            for delimited in (False, True):
+                with self.subTest(delimited=delimited), tempfile.TemporaryDirectory() as tmp_dir:
+                    filename = os.path.join(tmp_dir, 'output.csv')
+                    api = TwitterAPI('key', 'secret', time_limit=10, message_limit=unique_tweets, filename=filename,
+                                     auth_cls=NoAuthenticator, stream_root_url=server.url, processor_process=True,
+                                     ring_buffer_size=1 << 16, delimited=delimited)
+                    api.filter_tweets('bieber')
+                    with open(filename) as f:
+                        self.assertEqual(len(f.readlines()) - 1, unique_tweets)
+                    self.assertIsNone(api.processor)
+                    self.assertEqual(api.processor_thread.exitcode, 0)
+        finally:
+            server.stop()
+
+    def test_unsupported_options(self):
+        """
+        Test that the processor process is rejected with the asyncio engine and with on_message
+        """
+        with self.assertRaises(ValueError):
+            TwitterAPI('key', 'secret', engine='asyncio', processor_process=True)
+        with self.assertRaises(ValueError):
+            TwitterAPI('key', 'secret', on_message=print, processor_process=True)
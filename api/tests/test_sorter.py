@@ -0,0 +1,30 @@
+import random
+from unittest import TestCase
+
+from api.sorter import ExternalSorter
+
+
+class ExternalSorterTestCase(TestCase):
+
+    def test_sort_in_memory(self):
+        """
+        Test that items are sorted without spilling when they fit into the buffer
+        """
+        items = [random.randint(0, 1000) for _ in range(100)]
+        with ExternalSorter(buffer_size=1000) as sorter:
+            for item in items:
+                sorter.add(item)
+            self.assertEqual(sorter.runs_count, 0)
+            self.assertEqual(list(sorter), sorted(items))
+
+    def test_sort_with_runs(self):
+        """
+        Test that items are spilled to the sorted runs and merged back in order
+        """
+        items = [(random.randint(0, 10), str(ind)) for ind in range(1000)]
+        with ExternalSorter(buffer_size=64, block_size=10) as sorter:
+            for item in items:
+                sorter.add(item)
+            self.assertEqual(sorter.runs_count, 15)
+            self.assertEqual(len(sorter), 1000)
+            self.assertEqual(list(sorter), sorted(items))
@@ -0,0 +1,201 @@
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Queue
+from threading import Event
+from unittest import TestCase
+from unittest.mock import Mock
+
+from api.auth import NoAuthenticator
+from api.backoff import ExponentialBackoff, LinearBackoff
+from api.batcher import LineBatcher
+from api.ringbuffer import RingBuffer
+from api.tweets_streamer import TweetsStreamer
+from api.twitter_api import TwitterAPI
+
+
+class DroppingStreamHandler(BaseHTTPRequestHandler):
+    """
+    Streams a few lines on every connection and drops it without finishing the chunked response.
+    Responds with the status codes from `statuses` first.
+    """
+    protocol_version = 'HTTP/1.1'
+    statuses = []
+    connections = 0
+    lines = 3
+
+    def do_POST(self):
+        cls = type(self)
+        self.rfile.read(int(self.headers['Content-Length']))
+        if cls.statuses:
+            self.send_error(cls.statuses.pop(0))
+            return
+        connection = cls.connections
+        cls.connections += 1
+        self.send_response(200)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for ind in range(cls.lines):
+            line = b'%d-%d\r\n\r\n' % (connection, ind)
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(line), line))
+        self.wfile.flush()
+        self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+class StreamerTestCase(TestCase):
+
+    def test_detach_delimited_lines(self):
+        """
+        Test that the delimited messages are decoded for a plain queue and copied as bytes for a batched ring buffer
+        """
+        view = memoryview(b'{"text":"caf\xc3\xa9"}')
+        streamer = TweetsStreamer('key', 'secret', None, Queue(), Event(), delimited=True)
+        self.assertEqual(streamer._detach_line(view), '{"text":"caf\u00e9"}')
+        self.assertEqual(streamer._detach_line(memoryview(b'\xff')), b'\xff')
+
+        ring = RingBuffer(64)
+        try:
+            self.assertIsNone(TweetsStreamer('key', 'secret', None, ring, Event(), delimited=True)._detach_line)
+            streamer = TweetsStreamer('key', 'secret', None, ring, Event(), delimited=True, batch_size=10)
+            self.assertEqual(streamer._detach_line(view), view.tobytes())
+        finally:
+            ring.unlink()
+
+    def test_batch_lines_by_size(self):
+        """
+        Test that lines are flushed in batches of the configured size and the rest is flushed on close
+        """
+        batches = []
+        with LineBatcher(batches.append, batch_size=4, batch_interval=60) as batcher:
+            for line in range(10):
+                batcher.add(line)
+            self.assertEqual(batches, [[0, 1, 2, 3], [4, 5, 6, 7]])
+        self.assertEqual(batches, [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]])
+
+    def test_batch_lines_by_time(self):
+        """
+        Test that a non-full batch is flushed once the batch interval is over, without waiting for the next line
+        """
+        batches = Queue()
+        with LineBatcher(batches.put, batch_size=100, batch_interval=0.05) as batcher:
+            batcher.add(0)
+            batcher.add(1)
+            self.assertEqual(batches.get(timeout=5), [0, 1])
+            batcher.add(2)
+            self.assertEqual(batches.get(timeout=5), [2])
+            self.assertTrue(batches.empty())
+
+
+class StreamerReconnectTestCase(TestCase):
+
+    def setUp(self):
+        DroppingStreamHandler.connections = 0
+        DroppingStreamHandler.statuses = []
+        DroppingStreamHandler.lines = 3
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), DroppingStreamHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}/1.1/statuses/filter.json'
+
+        self.stop_event = Event()
+        self.streamer = TweetsStreamer('key', 'secret', None, Queue(), self.stop_event, timeout=5)
+        self.streamer.network_backoff = LinearBackoff(0.01, 0.05)
+        self.streamer.http_backoff = ExponentialBackoff(0.01, 0.05)
+        self.streamer.rate_limit_backoff = ExponentialBackoff(0.02, 0.05)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _read(self, count):
+        lines = []
+        for line in self.streamer._read_stream(self.url, {'track': 'foo'}):
+            lines.append(line)
+            if len(lines) == count:
+                self.stop_event.set()
+        return lines
+
+    def test_reconnect(self):
+        """
+        Test that the streamer reconnects after a dropped connection and resumes reading with the same session
+        """
+        lines = self._read(7)
+        self.assertEqual(lines, [b'0-0', b'0-1', b'0-2', b'1-0', b'1-1', b'1-2', b'2-0'])
+        self.assertEqual(self.streamer.reconnects, 2)
+        self.assertGreater(self.streamer.disconnected_seconds, 0)
+        self.assertIsNotNone(self.streamer.session)
+
+    def test_http_errors_backoff(self):
+        """
+        Test that HTTP errors are retried with the HTTP and rate limit backoff strategies
+        """
+        DroppingStreamHandler.statuses = [500, 420, 503]
+        lines = self._read(1)
+        self.assertEqual(lines, [b'0-0'])
+        self.assertEqual(self.streamer.reconnects, 3)
+        # backoff strategies are reset after a successful connection
+        self.assertEqual(self.streamer.http_backoff.attempt, 0)
+
+    def test_max_reconnects(self):
+        """
+        Test that the streamer gives up after the max number of reconnection attempts
+        """
+        self.streamer.max_reconnects = 2
+        DroppingStreamHandler.statuses = [500, 500, 500, 500]
+        self.assertEqual(self._read(1), [])
+        self.assertEqual(self.streamer.reconnects, 2)
+        self.assertTrue(self.stop_event.is_set())
+
+    def test_max_reconnects_without_data(self):
+        """
+        Test that connections dropped before delivering any data do not reset the reconnection attempts
+        """
+        self.streamer.max_reconnects = 2
+        DroppingStreamHandler.lines = 0
+        self.assertEqual(self._read(1), [])
+        self.assertEqual(self.streamer.reconnects, 2)
+        self.assertEqual(self.streamer.network_backoff.attempt, 2)
+        self.assertTrue(self.stop_event.is_set())
+
+    def test_all_streams_gave_up(self):
+        """
+        Test that the run stops once every stream gave up reconnecting, without waiting for the time limit
+        """
+        DroppingStreamHandler.statuses = [500, 500]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            api = TwitterAPI('key', 'secret', time_limit=30, filename=os.path.join(tmp_dir, 'output.csv'),
+                             auth_cls=NoAuthenticator, stream_root_url=self.url.rpartition('/statuses')[0],
+                             max_reconnects=0)
+            started = time.monotonic()
+            api.filter_tweets(['foo', 'bar'])
+        self.assertLess(time.monotonic() - started, 10)
+        self.assertTrue(api.stop_event.is_set())
+        self.assertEqual([streamer.reconnects for streamer in api.streamers], [0, 0])
+
+    def test_backoff_schedules(self):
+        """
+        Test the linear and exponential backoff schedules
+        """
+        linear = LinearBackoff(0.25, 1)
+        self.assertEqual([linear.next_delay() for _ in range(6)], [0.25, 0.5, 0.75, 1, 1, 1])
+        exponential = ExponentialBackoff(5, 30)
+        self.assertEqual([exponential.next_delay() for _ in range(5)], [5, 10, 20, 30, 30])
+        exponential.reset()
+        self.assertEqual(exponential.next_delay(), 5)
+
+    def test_rejected_credentials(self):
+        """
+        Test that the streamer asks the authenticator for new credentials once they are rejected
+        """
+        authenticator = Mock()
+        authenticator.invalidate.return_value = True
+        authenticator.provide_auth.return_value = None
+        self.streamer.authenticator = authenticator
+        DroppingStreamHandler.statuses = [401]
+        self.assertEqual(self._read(1), [b'0-0'])
+        authenticator.invalidate.assert_called_once_with()
+        self.assertEqual(self.streamer.reconnects, 1)
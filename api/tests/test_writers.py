@@ -0,0 +1,95 @@
+import gzip
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from api.bench import generate_rows, write_rows_legacy
+from api.writers import FIELDS, create_writer, escape_text, read_columnar, window_filename
+
+
+class WritersTestCase(TestCase):
+
+    def setUp(self):
+        self.rows = generate_rows(200) + [
+            ('1172962556291551999', 1568491040, 'tab\there\nnew line \\ backslash \x07 ünï', '42', 1514800800,
+             'Name "quoted"', 'screen\tname'),
+        ]
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def _write(self, name):
+        filename = os.path.join(self.tmp_dir.name, f'output.{name}')
+        with create_writer(name, filename) as writer:
+            writer.write_rows(iter(self.rows))
+        self.assertEqual(writer.rows_count, len(self.rows))
+        return filename
+
+    def test_escape_text(self):
+        """
+        Test that the escaping fast path matches the unicode_escape codec
+        """
+        for text in ('plain text', 'tab\t', 'new\nline', 'back\\slash', 'ünïcode “quotes”', '\x00\x7f', ''):
+            self.assertEqual(escape_text(text), text.encode('unicode_escape').decode('ascii'))
+
+    def test_tsv_matches_legacy_export(self):
+        """
+        Test that the TSV writer output is identical to the legacy DictWriter export
+        """
+        legacy_filename = os.path.join(self.tmp_dir.name, 'legacy.csv')
+        write_rows_legacy(self.rows, legacy_filename)
+        with open(legacy_filename, 'rb') as f:
+            expected = f.read()
+
+        with open(self._write('tsv'), 'rb') as f:
+            self.assertEqual(f.read(), expected)
+        with gzip.open(self._write('tsv.gz'), 'rb') as f:
+            self.assertEqual(f.read(), expected)
+
+    def test_jsonl(self):
+        """
+        Test that the JSON lines output (plain and compressed) contains every row
+        """
+        expected = [dict(zip(FIELDS, row)) for row in self.rows]
+        with open(self._write('jsonl'), encoding='utf-8') as f:
+            self.assertEqual([json.loads(line) for line in f], expected)
+        with gzip.open(self._write('jsonl.gz'), 'rt', encoding='utf-8') as f:
+            self.assertEqual([json.loads(line) for line in f], expected)
+
+    def test_columnar_round_trip(self):
+        """
+        Test that the columnar output is read back as the original rows
+        """
+        self.assertEqual(list(read_columnar(self._write('columnar'))), self.rows)
+
+    def test_columnar_non_integer_id(self):
+        """
+        Test that the columnar writer rejects IDs that do not fit into the integer columns
+        """
+        self.rows = [('foo', 1, 'text', '1', 1, 'name', 'screen_name')]
+        with self.assertRaises(ValueError):
+            self._write('columnar')
+
+    def test_unknown_format(self):
+        """
+        Test that an unknown format is rejected
+        """
+        with self.assertRaises(ValueError):
+            create_writer('xml', 'output.xml')
+
+    def test_window_filename(self):
+        """
+        Test that only the window placeholders are filled and stray braces are kept
+        """
+        started_at = 1568491040
+        cases = {
+            'output.csv': 'output-20190914T195720-000007.csv',
+            'out-{start}-{index}.csv': 'out-20190914T195720-7.csv',
+            'out{1}-{index}.tsv': 'out{1}-7.tsv',
+            os.path.join('{tmp}', 'output.jsonl.gz'): os.path.join('{tmp}', 'output-20190914T195720-000007.jsonl.gz'),
+            'output-{phrase}.csv': 'output-{phrase}-20190914T195720-000007.csv',
+            '{phrase}-{index}.csv': '{phrase}-7.csv',
+        }
+        for filename, expected in cases.items():
+            with self.subTest(filename=filename):
+                self.assertEqual(window_filename(filename, 7, started_at), expected)
@@ -1,9 +1,24 @@
+import asyncio
 import csv
 import logging
-import json
 import queue
-
-from .models import User, Tweet
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from operator import attrgetter
+
+from .aggregates import aggregates_filename
+from .canonical import CANONICAL_ROUTE, CanonicalTable
+from .decoder import DecodePool, check_is_tweet, decode_message, message_size, project_payload
+from .dedup import SetDeduplicator
+from .fastparse import is_control_message
+from .matcher import UNMATCHED_ROUTE, route_filename
+from .metrics import MetricsRegistry
+from .models import MIN_SNOWFLAKE_ID, TWITTER_EPOCH_MS, AnnotatedTweet, User, Tweet
+from .ringbuffer import RingBuffer
+from .sorter import ExternalSorter
+from .writers import CHUNK_SIZE, create_writer, window_filename, write_canonical_table
 
 logger = logging.getLogger(__name__)
 
@@ -31,53 +46,378 @@ class TweetsWriter(csv.DictWriter):
 
 
 class TweetsProcessor:
-    def __init__(self, input_queue, message_queue, barrier, stop_event, encoding='utf-8', filename='./output.csv'):
+    def __init__(self, input_queue, message_queue, barrier, stop_event, encoding='utf-8', filename='./output.csv',
+                 sort_buffer_size=None, snowflake_timestamps=False, limiter=None, decode_workers=0,
+                 deduplicator=None, fast_parse=False, on_message=None, metrics=None, output_format='tsv',
+                 rotate_seconds=None, rotate_messages=None, journal=None, index=False, matcher=None, tag=False,
+                 route=False, profiler=None, memory_tracer=None, collapse=None, aggregator=None,
+                 aggregates_interval=None):
         """
         TweetsProcessor class provides a functionality for processing fetched tweets and dumping them to the file
 
         Args:
-            input_queue: input Queue instance (keeps fetched tweets)
-            message_queue: message Queue instance (keeps only uniqueue messages)
+            input_queue: input Queue instance (keeps fetched tweets, either one by one or in lists)
+            message_queue: message Queue instance (keeps only uniqueue messages as compact Tweet records)
             barrier: synchronization primitive to sync all threads
             stop_event: threading Event instance. Is set when either time is out or a message queue is full
             encoding: encoding string
             filename: filename to dump fetched tweets to
+            sort_buffer_size: if set, export with an external merge sort that keeps at most that many rows in memory
+            snowflake_timestamps: take the tweet creation time from the snowflake ID instead of parsing created_at
+            limiter: Limiter instance that is notified about every new message. If None, processor stops as soon
+            as the message queue is full
+            decode_workers: number of worker processes that decode and validate raw messages (0 - decode in the
+            processor thread)
+            deduplicator: BaseDeduplicator instance (exact SetDeduplicator by default)
+            fast_parse: skip control messages without parsing them and extract only the exported tweet fields
+            on_message: optional callable invoked with every Tweet put to the message queue
+            metrics: MetricsRegistry instance shared by the pipeline stages (a private one if None)
+            output_format: output writer name (see writers.WRITERS)
+            rotate_seconds: continuous mode: export a window of messages to its own file every that many seconds
+            rotate_messages: continuous mode: export a window of messages to its own file every that many messages.
+            Windows are exported on a background thread while the processing goes on
+            journal: journal.Journal instance the input queue is. Its cursor is committed once the messages read
+            so far are exported (at the end of the run or of every window)
+            index: write a sidecar index of the user rows next to every output file (see index.OutputIndex)
+            matcher: matcher.TrackMatcher instance that finds the track phrases every accepted tweet text matches
+            tag: add the matched phrases to the output rows (requires a matcher)
+            route: write the tweets to an output file per matched phrase (see matcher.route_filename) instead of
+            a single one (requires a matcher)
+            profiler: profiling.ThreadProfiler instance that profiles the window exports of the continuous mode
+            (the processor thread itself is profiled by its owner)
+            memory_tracer: profiling.MemoryTracer instance that takes a snapshot whenever an export starts
+            collapse: collapse the retweets and quotes into a canonical tweets table (see canonical.CanonicalTable)
+            and export them expanded ('expand') or normalized ('normalize': the text of the collapsed retweets is
+            left out, every row gets the REFERENCE_FIELDS and the canonical tweets table is written next to every
+            output file), no collapsing if None
+            aggregator: aggregates.StreamAggregator instance the accepted tweets are aggregated by. Its snapshot is
+            written next to the output (see aggregates.aggregates_filename) every `aggregates_interval` seconds and
+            at the end of the run
+            aggregates_interval: number of seconds between the aggregates snapshots (the final one only if None)
         """
+        if (tag or route) and matcher is None:
+            raise ValueError('Tagging and routing require a matcher')
         self.input_queue = input_queue
         self.message_queue = message_queue
         self.barrier = barrier
         self.stop_event = stop_event
         self.encoding = encoding
-        self.message_ids = set()
+        self.deduplicator = deduplicator or SetDeduplicator()
+        # interned users (user ID string -> User), so the user information is stored once per user
+        self.users = {}
         self.filename = filename
+        self.sort_buffer_size = sort_buffer_size
+        self.snowflake_timestamps = snowflake_timestamps
+        self.limiter = limiter
+        self.decode_workers = decode_workers
+        self.fast_parse = fast_parse
+        self.on_message = on_message
+        self.output_format = output_format
+        self.index = index
+        self.journal = journal
+        self.matcher = matcher
+        self.tag = tag
+        self.route = route
+        self.profiler = profiler
+        self.memory_tracer = memory_tracer
+        self.collapse = collapse
+        self.aggregator = aggregator
+        self.aggregates_interval = aggregates_interval
+        self._aggregates_deadline = None
+        self._export_failed = False
+        # duration of the last export in seconds
+        self.export_seconds = None
+        # time (epoch seconds) the oldest not exported message was accepted at
+        self._oldest_accepted_at = None
+
+        # continuous mode (output rotation)
+        self.rotate_seconds = rotate_seconds
+        self.rotate_messages = rotate_messages
+        self.window_index = 0
+        self._window_messages = 0
+        self._window_started_at = None
+        self._window_deadline = None
+        self._exporter = None
+        self._exports = []
+
+        self.metrics = metrics or MetricsRegistry()
+        self.metrics.gauge('input_queue_depth', 'Items waiting in the input queue', function=input_queue.qsize)
+        self.decode_seconds = self.metrics.histogram(
+            'decode_seconds', 'Time to decode a raw message and validate its payload (processor thread only)')
+        self.validate_seconds = self.metrics.histogram(
+            'validate_seconds', 'Time to validate the ID of a decoded message, deduplicate it and apply the limits')
+        self.accepted_messages = self.metrics.counter('accepted_messages_total', 'Messages put to the message queue')
+        self.duplicate_messages = self.metrics.counter('duplicate_messages_total', 'Duplicated messages dropped')
+        self.invalid_messages = self.metrics.counter('invalid_messages_total',
+                                                     'Messages dropped as not decodable or not valid tweets')
+        self.control_messages = self.metrics.counter('control_messages_total',
+                                                     'Control messages skipped (limit, delete, scrub_geo etc.)')
+        self.stream_lag = self.metrics.histogram(
+            'stream_lag_seconds', 'Time between the tweet creation (by its snowflake ID) and its acceptance',
+            buckets=(0.1, 0.5, 1, 2, 5, 10, 30, 60, 300, 3600))
+        self.disk_lag = self.metrics.gauge(
+            'stream_to_disk_lag_seconds', 'Time the oldest message of the last export waited till it was written')
+        self.windows_exported = self.metrics.counter('windows_exported_total', 'Output windows exported')
+        self.unmatched_messages = self.metrics.counter(
+            'unmatched_messages_total', 'Accepted messages whose text matched no track phrase (matched by entities)')
+        self.canonical = None
+        if collapse:
+            self.canonical = CanonicalTable(keep_text=collapse == 'normalize', metrics=self.metrics)
+            self.normalized_text_bytes = self.metrics.counter(
+                'normalized_text_bytes_total', 'Retweet texts left out of the normalized output (UTF-8 bytes)')
+        # only the tagged, routed or collapsed tweets carry the matched phrases and the references
+        self.tweet_cls = AnnotatedTweet if matcher is not None or collapse else Tweet
+        if aggregator is not None:
+            self.metrics.gauge('aggregates_bytes', 'Approximate memory of the streaming aggregates',
+                               function=aggregator.memory_usage)
+            self.aggregate_snapshots = self.metrics.counter('aggregate_snapshots_total',
+                                                            'Aggregates snapshots written')
+        self.metrics.gauge('export_backlog', 'Output windows waiting for the export',
+                           function=lambda: sum(not export.done() for export in self._exports))
+
+    def restore_deduplicator(self, messages):
+        """
+        Add the IDs of already exported tweets to the deduplicator (e.g. the committed lines of a resumed journal),
+        so they are not exported again
+
+        Args:
+            messages: iterable of raw messages
+
+        Returns:
+            int, number of IDs added
+        """
+        restored = 0
+        for message in messages:
+            try:
+                record = decode_message(message, self.encoding, self.snowflake_timestamps, fast_parse=True)
+                if record and self.deduplicator.add(int(record.id_str)):
+                    restored += 1
+            except (TypeError, ValueError):
+                continue
+        return restored
+
+    def _commit_journal(self, position):
+        # once an export failed, the cursor stays before its messages
+        if self.journal and not self._export_failed:
+            self.journal.commit(position)
+
+    # kept for backward compatibility, see decoder.check_is_tweet
+    _check_is_tweet = staticmethod(check_is_tweet)
 
-    @staticmethod
-    def _check_is_tweet(data):
+    def _process_message(self, message):
         """
-        Check if a supplied payload looks like a tweet.
+        Decode and validate a single raw message and put it to the message queue unless it is a duplicate
 
         Args:
-            data: Python dict object with a payload that should be tested
+            message: raw message bytes, its decoded text or a memoryview of a ring buffer frame
 
         Returns:
-            bool, True id the data looks like a tweet
+            None
+        """
+        size = message_size(message, self.encoding)
+        started = time.perf_counter()
+        try:
+            if isinstance(message, memoryview):
+                # decode the frame in place, the text is the only copy of it
+                message = str(message, self.encoding)
+            record = decode_message(message, self.encoding, self.snowflake_timestamps, self.fast_parse,
+                                    references=self.canonical is not None)
+        except ValueError:
+            logger.debug('Can not decode a message. Skipping that message.', exc_info=True)
+            self.invalid_messages.inc()
+            return
+        decoded = time.perf_counter()
+        self.decode_seconds.observe(decoded - started)
+
+        if not record:
+            self._count_skipped(message)
+            return
+        self._accept_record(record, size)
+        self.validate_seconds.observe(time.perf_counter() - decoded)
+
+    def _count_skipped(self, message):
+        if is_control_message(message):
+            self.control_messages.inc()
+        else:
+            self.invalid_messages.inc()
+
+    def _accept_record(self, record, message_size):
+        """
+        Put a decoded record to the message queue unless it is a duplicate or does not fit into the limits
+
+        Args:
+            record: TweetRecord instance
+            message_size: size of the raw message in bytes
 
+        Returns:
+            None
+        """
+        try:
+            message_id = int(record.id_str)
+        except (TypeError, ValueError):
+            logger.debug('Invalid message ID %s. Skipping that message.', record.id_str)
+            self.invalid_messages.inc()
+            return
+
+        if not self.deduplicator.add(message_id):
+            logger.debug('Did not add duplicated message (ID %s) to the message_queue', record.id_str)
+            self.duplicate_messages.inc()
+            return
+
+        if self.limiter and not self.limiter.accept(message_size, record.user_id_str):
+            return
+
+        tweet = self._build_tweet(record)
+        try:
+            self.message_queue.put(tweet, timeout=0)
+        except queue.Full:
+            logger.warning('The message queue is already full')
+            self.stop_event.set()
+            return
+
+        self.accepted_messages.inc()
+        self._window_messages += 1
+        now = time.time()
+        if self._oldest_accepted_at is None:
+            self._oldest_accepted_at = now
+        if message_id >= MIN_SNOWFLAKE_ID:
+            self.stream_lag.observe(now - ((message_id >> 22) + TWITTER_EPOCH_MS) / 1000)
+
+        if self.aggregator is not None:
+            self.aggregator.add(tweet)
+        if self.on_message:
+            self.on_message(tweet)
+
+        if not self.limiter and self.message_queue.full():
+            logger.warning('Message queue is full. Stopping further streaming')
+            self.stop_event.set()
+
+        if self.rotate_messages and self._window_messages >= self.rotate_messages:
+            self._rotate()
+
+    @property
+    def continuous(self):
+        return bool(self.rotate_seconds or self.rotate_messages)
+
+    def _start_window(self):
+        self._window_messages = 0
+        self._window_started_at = time.time()
+        if self.rotate_seconds:
+            self._window_deadline = time.monotonic() + self.rotate_seconds
+
+    def _check_rotation(self):
         """
-        if not data or not isinstance(data, dict):
-            return False
-        data_keys_set = set(data.keys())
+        Rotate the output if the time window is over (the messages count is checked on every accepted message),
+        write the aggregates snapshot if it is due
+        """
+        if self._window_deadline is not None and time.monotonic() >= self._window_deadline:
+            self._rotate()
+        if self._aggregates_deadline is not None and time.monotonic() >= self._aggregates_deadline:
+            self._write_aggregates()
 
-        event_keys = {'limit', 'disconnect', 'warning', 'delete', 'scrub_geo', 'status_withheld',
-                      'user_withheld', 'event'}
+    def _start_aggregates(self):
+        if self.aggregator is not None and self.aggregates_interval:
+            self._aggregates_deadline = time.monotonic() + self.aggregates_interval
 
-        if not data or data_keys_set & event_keys:
-            return False
+    def _write_aggregates(self, final=False):
+        """
+        Write a snapshot of the aggregates next to the output and schedule the next one
 
-        message_keys = {'id_str', 'created_at', 'text', 'user'}
-        if not message_keys <= data_keys_set:
-            return False
+        Args:
+            final: whether it is the snapshot of the end of the run
+
+        Returns:
+            None
+        """
+        if self.aggregator is None:
+            return
+        self._start_aggregates()
+        try:
+            self.aggregator.write(aggregates_filename(self.filename), final)
+        except OSError:
+            logger.exception('Can not write the aggregates snapshot')
+            return
+        self.aggregate_snapshots.inc()
+
+    def _rotate(self):
+        """
+        Close the current window: hand its messages over to the background export and start a new window with
+        an empty message queue. Interned users are released too, so the memory of the window is freed once
+        it is exported.
+
+        Returns:
+            None
+        """
+        message_queue = self.message_queue
+        filename = window_filename(self.filename, self.window_index, self._window_started_at)
+        accepted_at = self._oldest_accepted_at
+        messages_count = self._window_messages
+        position = self.journal.tell() if self.journal else None
+
+        self.message_queue = queue.Queue()
+        self.users = {}
+        self._oldest_accepted_at = None
+        self.window_index += 1
+        self._start_window()
+
+        if not messages_count:
+            logger.debug('Window %s is empty. Skipping the export', filename)
+            # committed after the pending exports
+            if self.journal:
+                self._exporter.submit(self._commit_journal, position)
+            return
+
+        self._log_deduplicator()
+        self._log_canonical()
+        if self.canonical is not None:
+            # the exported tweets keep their canonical tweets, the next window starts with an empty table
+            self.canonical.clear()
+        self._exports = [export for export in self._exports if not export.done()]
+        if self._exports:
+            logger.warning('Export is behind: %s windows are waiting', len(self._exports))
+        logger.info('Rotating the output: %s messages go to "%s"', messages_count, filename)
+        export_window = self.profiler.wrap('exporter', self._export_window) if self.profiler else self._export_window
+        self._exports.append(self._exporter.submit(export_window, message_queue, filename, accepted_at, position))
+
+    def _export_window(self, message_queue, filename, accepted_at, position=None):
+        try:
+            self._output_data(message_queue, filename, accepted_at)
+        except Exception:
+            logger.exception('Can not export the window to "%s"', filename)
+            self._export_failed = True
+            return
+        self.windows_exported.inc()
+        self._commit_journal(position)
+
+    def _start_rotation(self):
+        self._exporter = ThreadPoolExecutor(max_workers=1, thread_name_prefix='exporter')
+        self._start_window()
+
+    def _finish_rotation(self):
+        """
+        Export the last window and wait for all exports
+        """
+        self._rotate()
+        self._exporter.shutdown(wait=True)
+
+    def _process_batch(self, batch):
+        """
+        Process an item of the input queue, which is either a single raw message or a list of them
+
+        Args:
+            batch: raw message bytes or a list of raw messages
+
+        Returns:
+            None
+        """
+        if not isinstance(batch, list):
+            self._process_message(batch)
+            return
 
-        return True
+        for message in batch:
+            if self.stop_event.is_set():
+                return
+            self._process_message(message)
 
     def _accumulate_messages(self):
         """
@@ -86,6 +426,12 @@ class TweetsProcessor:
         Returns:
             None
         """
+        if self.decode_workers:
+            self._accumulate_decoded_messages()
+            return
+        if isinstance(self.input_queue, RingBuffer):
+            self._accumulate_frames()
+            return
 
         while not self.stop_event.is_set():
             try:
@@ -93,86 +439,401 @@ class TweetsProcessor:
             except queue.Empty:
                 # let another iteration of the loop
                 continue
+            finally:
+                self._check_rotation()
 
-            decoded_line = message.decode(self.encoding)
-            json_message = json.loads(decoded_line)
+            self._process_batch(message)
 
-            if not self._check_is_tweet(json_message):
-                logger.warning('A message does not look like an event: %s. Skipping that message.', json_message)
+    def _accumulate_frames(self):
+        """
+        Process the frames of a ring buffer without copying them out of the shared memory
+        (see `_accumulate_messages`)
+
+        Returns:
+            None
+        """
+        while not self.stop_event.is_set():
+            try:
+                view = self.input_queue.get_view(timeout=1)
+            except queue.Empty:
+                # let another iteration of the loop
+                continue
+            finally:
+                self._check_rotation()
+
+            if view is None:
+                # the ring is closed and drained
+                return
+            with view:
+                self._process_message(view)
+
+    def _feed_decode_pool(self, decode_pool):
+        """
+        Forward raw messages from the input queue to the decode workers
+
+        Args:
+            decode_pool: DecodePool instance
+
+        Returns:
+            None
+        """
+        while not self.stop_event.is_set():
+            try:
+                batch = self.input_queue.get(timeout=1)
+            except queue.Empty:
                 continue
 
-            logger.info('Received a message (ID %s)', json_message['id_str'])
-            if json_message['id_str'] not in self.message_ids:
+            decode_pool.submit(batch if isinstance(batch, list) else [batch])
+
+    def _accumulate_decoded_messages(self):
+        """
+        Decode messages in a pool of worker processes and accumulate unique tweets in the message queue.
+        Deduplication and limits are applied here, so they stay global.
+
+        Returns:
+            None
+        """
+        decode_pool = DecodePool(self.decode_workers, self.encoding, self.snowflake_timestamps, self.fast_parse,
+                                 references=self.canonical is not None)
+        decode_pool.start()
+        feeder_thread = threading.Thread(name='decode-feeder', target=self._feed_decode_pool, args=(decode_pool, ))
+        feeder_thread.start()
+        try:
+            while not self.stop_event.is_set():
                 try:
-                    self.message_queue.put(json_message, timeout=0)
-                except queue.Full:
-                    logger.warning('The message queue is already full')
-                    # In this case, mos likely, the STOP_EVENT will be set by Limiter on the next iteration
-                    # and loop will quit
+                    records, control_count, invalid_count = decode_pool.get(timeout=1)
+                except queue.Empty:
                     continue
-                self.message_ids.add(json_message['id_str'])
-            else:
-                logger.error(
-                    'Did not add duplicated message (ID %s) to the message_queue',
-                    json_message['id_str']
-                )
-
-    def _output_data(self):
+                finally:
+                    self._check_rotation()
+
+                self.control_messages.inc(control_count)
+                self.invalid_messages.inc(invalid_count)
+                for record, size in records:
+                    if self.stop_event.is_set():
+                        break
+                    self._accept_record(record, size)
+        finally:
+            feeder_thread.join()
+            decode_pool.stop()
+
+    async def _accumulate_messages_async(self):
         """
-        Dump information from the message queue to a file
+        Coroutine version of `_accumulate_messages` that consumes an asyncio.Queue
 
         Returns:
             None
         """
-        logger.info('Exporting messages...')
-        user_mapping = {}
-        while not self.message_queue.empty():
+        while not self.stop_event.is_set():
+            try:
+                message = await asyncio.wait_for(self.input_queue.get(), timeout=1)
+            except asyncio.TimeoutError:
+                # let another iteration of the loop
+                continue
+            finally:
+                self._check_rotation()
+
+            self._process_batch(message)
+
+    def _build_tweet(self, record):
+        """
+        Build a compact Tweet record from the decoded record. The user information is interned,
+        so it is stored once per user.
+
+        Args:
+            record: TweetRecord instance
+
+        Returns:
+            Tweet instance
+        """
+        user = self.users.get(record.user_id_str)
+        if user is None:
+            user = User(id_str=record.user_id_str, name=record.user_name, screen_name=record.user_screen_name,
+                        created_at=record.user_created_at)
+            self.users[user.id_str] = user
+
+        tweet = self.tweet_cls(id_str=record.id_str, created_at=record.created_at, text=record.text)
+        tweet.user = user
+        if self.matcher is not None:
+            tweet.matched = self.matcher.match(tweet.text)
+            if not tweet.matched:
+                self.unmatched_messages.inc()
+        if self.canonical is not None:
+            self.canonical.collapse(tweet, record)
+        return tweet
+
+    def _project(self, data):
+        """
+        Project a decoded tweet payload to a compact Tweet record. Only the exported fields are kept.
+
+        Args:
+            data: Python dict object with a tweet payload
+
+        Returns:
+            Tweet instance or None if the payload is invalid
+        """
+        record = project_payload(data, self.snowflake_timestamps, references=self.canonical is not None)
+        if not record:
+            return None
+        return self._build_tweet(record)
+
+    def _iter_messages(self, message_queue=None):
+        """
+        Drain the message queue
+
+        Args:
+            message_queue: Queue instance to drain (the current message queue if None)
+
+        Returns:
+            yields Tweet instances
+        """
+        if message_queue is None:
+            message_queue = self.message_queue
+        while not message_queue.empty():
             # Expecting only one queue consumer
-            message = self.message_queue.get()
+            yield message_queue.get()
 
-            user_id_str = message['user']['id_str']
-            if user_id_str in user_mapping:
-                user = user_mapping[user_id_str]
-            else:
-                user = User.from_dict(message['user'])
-                if user:
-                    user_mapping[user_id_str] = user
-                else:
-                    logger.error('Can not instantiate User object from the payload. Skipping entry...')
-                    continue
+    def _row(self, tweet, references=None):
+        """
+        Build an output row for the tweet
+
+        Args:
+            tweet: Tweet instance
+            references: dict the canonical tweet of a normalized row is added to (canonical tweet ID -> CanonicalTweet)
 
-            tweet = Tweet.from_dict(message)
-            if tweet:
-                user.add_tweet(tweet)
+        Returns:
+            tuple of tweet ID, tweet creation date, text, user ID, user creation date, user name and screen name
+            (followed by the reference type and the canonical tweet ID in the normalize mode, then by the matched
+            phrases if there is a matcher)
+        """
+        user = tweet.user
+        if self.matcher is None and self.collapse != 'normalize':
+            return (tweet.id_str, tweet.created_at, tweet.text,
+                    user.id_str, user.created_at, user.name, user.screen_name)
+
+        text = tweet.text
+        extra = ()
+        if self.collapse == 'normalize':
+            ref = tweet.ref
+            if ref is None:
+                extra = (None, None)
             else:
-                logger.error('Can not instantiate Tweet object from the payload. Skipping entry...')
-
-        users = sorted(user_mapping.values(), key=lambda user: user.created_at)
-        logger.info('Writing messages to the file "%s"', self.filename)
-        with open(self.filename, 'w', newline='') as csvfile:
-            writer = TweetsWriter(csvfile, delimiter='\t', quoting=csv.QUOTE_NONNUMERIC)
-            writer.writeheader()
-
-            for user in users:
-                for tweet in user.tweets:
-                    writer.writerow({
-                        'tweet_str_id': tweet.id_str,
-                        'tweet_creation_dt': str(tweet.created_at.timestamp()),
-                        'tweet_text': tweet.text.encode('unicode_escape').decode(self.encoding),
-                        'user_str_id': user.id_str,
-                        'user_creation_dt': str(user.created_at.timestamp()),
-                        'user_name': user.name,
-                        'user_screen_name': user.screen_name
-                    })
+                extra = (tweet.ref_type, ref.id_str)
+                references[ref.id_str] = ref
+                if text is ref.retweet_text:
+                    text = ''
+                    self.normalized_text_bytes.inc(ref.retweet_text_size)
+        if self.matcher is not None:
+            extra += (tweet.matched, )
+        return (tweet.id_str, tweet.created_at, text,
+                user.id_str, user.created_at, user.name, user.screen_name) + extra
+
+    def _sorted_rows(self, message_queue=None, references=None):
+        """
+        Group all messages by user in memory and order them by (user creation date, user ID, tweet creation date,
+        tweet ID)
+
+        Args:
+            message_queue: Queue instance to export (the current message queue if None)
+            references: dict the canonical tweets of the normalized rows are added to (see `_row`)
+
+        Returns:
+            yields output rows
+        """
+        user_mapping = {}
+        for tweet in self._iter_messages(message_queue):
+            user = user_mapping.setdefault(tweet.user.id_str, tweet.user)
+            user.add_tweet(tweet)
+
+        # ties are ordered by the IDs, as in the external sort
+        users = sorted(user_mapping.values(), key=attrgetter('created_at', 'id_str'))
+        for user in users:
+            for tweet in user.tweets:
+                yield self._row(tweet, references)
+            user.clear_tweets()
+
+    def _sorted_rows_external(self, sorter, message_queue=None, references=None):
+        """
+        Order all messages by (user creation date, user ID, tweet creation date, tweet ID) with the external merge
+        sort, so that only `sort_buffer_size` rows are kept in memory at a time
+
+        Args:
+            sorter: ExternalSorter instance
+            message_queue: Queue instance to export (the current message queue if None)
+            references: dict the canonical tweets of the normalized rows are added to (see `_row`)
+
+        Returns:
+            yields output rows
+        """
+        for tweet in self._iter_messages(message_queue):
+            user = tweet.user
+            # the row starts with the tweet ID, so ties are ordered by it
+            sorter.add((user.created_at, user.id_str, tweet.created_at) + self._row(tweet, references))
+        logger.info('Sorted %s messages in %s runs', len(sorter), sorter.runs_count)
+
+        for item in sorter:
+            yield item[3:]
+
+    def _write_rows(self, rows, filename=None):
+        """
+        Write ordered rows to the output file
+
+        Args:
+            rows: iterable of output rows
+            filename: output filename (self.filename if None)
+
+        Returns:
+            None
+        """
+        filename = filename or self.filename
+        if self.route:
+            self._write_routed_rows(rows, filename)
+            return
+        if self.matcher is not None and not self.tag:
+            rows = (row[:-1] for row in rows)
+        logger.info('Writing messages to the file "%s" (%s)', filename, self.output_format)
+        with create_writer(self.output_format, filename, self.encoding, self.index, self.tag,
+                           self.collapse == 'normalize') as writer:
+            writer.write_rows(rows)
+
+    def _write_routed_rows(self, rows, filename):
+        """
+        Write ordered rows to an output file per matched phrase (a tweet matching several phrases is written to all
+        their files, the ones matching none to the UNMATCHED_ROUTE file). Files are created for the matched phrases
+        only, every file keeps the rows order.
+
+        Args:
+            rows: iterable of output rows (with the matched phrases)
+            filename: output filename (template, see matcher.route_filename)
+
+        Returns:
+            None
+        """
+        route_names = self.matcher.route_names
+        unmatched = (UNMATCHED_ROUTE, )
+        # route name -> (writer, pending rows)
+        routes = {}
+        with ExitStack() as stack:
+            def flush(writer, pending):
+                writer.write_rows(pending if self.tag else [row[:-1] for row in pending])
+                pending.clear()
+
+            for row in rows:
+                for name in (route_names[phrase] for phrase in row[-1]) if row[-1] else unmatched:
+                    route = routes.get(name)
+                    if route is None:
+                        route_file = route_filename(filename, name)
+                        logger.info('Writing messages to the file "%s" (%s)', route_file, self.output_format)
+                        writer = create_writer(self.output_format, route_file, self.encoding, self.index, self.tag,
+                                               self.collapse == 'normalize')
+                        route = routes[name] = (stack.enter_context(writer), [])
+                    route[1].append(row)
+                    if len(route[1]) >= CHUNK_SIZE:
+                        flush(*route)
+            for route in routes.values():
+                flush(*route)
+        logger.info('Routed messages to %s files', len(routes))
+
+    def _write_canonical_table(self, references, filename):
+        """
+        Write the canonical tweets the normalized output refers to (see writers.write_canonical_table)
+
+        Args:
+            references: dict of canonical tweet ID -> CanonicalTweet
+            filename: output filename (template, the table filename is built with matcher.route_filename)
+
+        Returns:
+            None
+        """
+        filename = route_filename(filename, CANONICAL_ROUTE)
+        count = write_canonical_table(self.output_format, filename, references.values(), self.encoding)
+        logger.info('Wrote %s canonical tweets to the file "%s", %s bytes of retweet texts are left out of '
+                    'the output so far', count, filename, self.normalized_text_bytes.value)
+
+    def _log_deduplicator(self):
+        logger.info('Deduplicator %s keeps %s IDs in ~%s bytes', type(self.deduplicator).__name__,
+                    len(self.deduplicator), self.deduplicator.memory_usage())
+
+    def _log_canonical(self):
+        if self.canonical is not None:
+            self.canonical.log_stats()
+
+    def _output_data(self, message_queue=None, filename=None, accepted_at=None):
+        """
+        Dump information from the message queue to a file
+
+        Args:
+            message_queue: Queue instance to export (the current message queue if None)
+            filename: output filename (self.filename if None)
+            accepted_at: time (epoch seconds) the oldest exported message was accepted at
+
+        Returns:
+            None
+        """
+        logger.info('Exporting messages...')
+        if self.memory_tracer:
+            self.memory_tracer.snapshot('export')
+        started = time.perf_counter()
+        # canonical tweets the normalized rows refer to
+        references = {} if self.collapse == 'normalize' else None
+        if not self.sort_buffer_size:
+            self._write_rows(self._sorted_rows(message_queue, references), filename)
+        else:
+            with ExternalSorter(self.sort_buffer_size) as sorter:
+                self._write_rows(self._sorted_rows_external(sorter, message_queue, references), filename)
+        if references is not None:
+            self._write_canonical_table(references, filename or self.filename)
+        self.export_seconds = time.perf_counter() - started
+        if accepted_at is not None:
+            self.disk_lag.set(time.time() - accepted_at)
+        logger.info('Messages are exported in %.3f sec', self.export_seconds)
 
     def start(self):
         """
-        Start processor: accumulate messages til the STOP event is set, then dump them to the file
+        Start processor: accumulate messages til the STOP event is set, then dump them to the file.
+        In the continuous mode the output is rotated by windows instead (see `_rotate`)
 
         Returns:
             None
         """
         self.barrier.wait()
         logger.info('Starting TweetsProcessor')
+        self._start_aggregates()
+        if self.continuous:
+            self._start_rotation()
+            self._accumulate_messages()
+            self._finish_rotation()
+            self._write_aggregates(final=True)
+            return
+
         self._accumulate_messages()
-        self._output_data()
+        self._log_deduplicator()
+        self._log_canonical()
+        position = self.journal.tell() if self.journal else None
+        self._output_data(accepted_at=self._oldest_accepted_at)
+        self._commit_journal(position)
+        self._write_aggregates(final=True)
+
+    async def start_async(self):
+        """
+        Start processor on the running event loop: accumulate messages til the STOP event is set, then dump them to
+        the file (the export runs in the default executor not to block the loop)
+
+        Returns:
+            None
+        """
+        logger.info('Starting TweetsProcessor')
+        loop = asyncio.get_event_loop()
+        self._start_aggregates()
+        if self.continuous:
+            self._start_rotation()
+            await self._accumulate_messages_async()
+            await loop.run_in_executor(None, self._finish_rotation)
+            self._write_aggregates(final=True)
+            return
+
+        await self._accumulate_messages_async()
+        self._log_deduplicator()
+        self._log_canonical()
+        await loop.run_in_executor(None, self._output_data, None, None, self._oldest_accepted_at)
+        self._write_aggregates(final=True)
@@ -1,15 +1,29 @@
+import json
 import logging
+import time
 
 import requests
 
+from .backoff import http_backoff, network_backoff, rate_limit_backoff
+from .batcher import LineBatcher
+from .framing import ChunkReader, iter_delimited
+from .journal import Journal
+from .metrics import MetricsRegistry
+from .ringbuffer import RingBuffer
 
 logger = logging.getLogger(__name__)
 
+LIMIT_NOTICE_PREFIX = b'{"limit"'
+# A connection that stays up that long is considered healthy even if it delivered no data (only keep-alive lines)
+STABLE_CONNECTION_SECONDS = 60
+
 
 class TweetsStreamer:
 
     def __init__(self, api_key, api_secret_key, barrier, input_queue, stop_event,
-                 stream_version='1.1', encoding='utf-8', auth_cls=None):
+                 stream_version='1.1', encoding='utf-8', auth_cls=None, batch_size=None, batch_interval=0.05,
+                 timeout=90.0, max_reconnects=None, stream_root_url=None, metrics=None, authenticator=None,
+                 stream_id=None, started_at=None, delimited=False, on_give_up=None):
         """
         TweetsStreamer class provides a functionality to read from the tweets stream
 
@@ -22,6 +36,22 @@ class TweetsStreamer:
             stream_version: Twitter stream version
             encoding: encoding string
             auth_cls: authenticator class that provides OAuth layer
+            batch_size: if set, lines are put to the input queue in lists of up to that many lines
+            batch_interval: max number of seconds a line may wait in a non-full batch (see batcher.LineBatcher)
+            timeout: connect and read timeout in seconds (Twitter sends keep-alive lines every 30 seconds)
+            max_reconnects: max number of reconnection attempts in a row (unlimited if None). The attempts are counted
+            till a connection delivers data or stays up for STABLE_CONNECTION_SECONDS
+            stream_root_url: root URL of the stream endpoints (Twitter stream of the given version if None)
+            metrics: MetricsRegistry instance shared by the pipeline stages (a private one if None)
+            authenticator: authenticated BaseAuthenticator instance shared by several streamers (auth_cls is not used
+            if set)
+            stream_id: ID of the stream when several streams run at once, the stream metrics are labeled with it
+            started_at: time.monotonic() value the run started at, to measure the time to the first message
+            (the filter_tweets call time if None)
+            delimited: request the length-delimited stream (`delimited=length`) and split it by the announced lengths
+            instead of searching for newlines (see framing.iter_delimited)
+            on_give_up: callable called once the max number of reconnection attempts is reached, e.g. to stop the run
+            when every stream gave up (the STOP event is set if None)
         """
         self.api_key = api_key
         self.api_secret_key = api_secret_key
@@ -29,10 +59,51 @@ class TweetsStreamer:
         self.input_queue = input_queue
         self.stop_event = stop_event
         self.auth = None
+        self.authenticator = authenticator
         self.session = None
         self.encoding = encoding
         self.auth_cls = auth_cls
-        self.stream_root_url = f'https://stream.twitter.com/{stream_version}'
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.timeout = timeout
+        self.max_reconnects = max_reconnects
+        self.stream_root_url = stream_root_url or f'https://stream.twitter.com/{stream_version}'
+        self.delimited = delimited
+        self.on_give_up = on_give_up
+        # delimited messages are views of the framing buffer: only the ring buffer and the journal copy them right
+        # away, any other queue would keep them till the buffer is overwritten, so they get the decoded text (the one
+        # copy the processor makes anyway). Batches for the ring buffer or the journal are copied as bytes
+        if not isinstance(input_queue, (RingBuffer, Journal)):
+            self._detach_line = self._decode_line
+        else:
+            self._detach_line = bytes if batch_size else None
+
+        self.network_backoff = network_backoff()
+        self.http_backoff = http_backoff()
+        self.rate_limit_backoff = rate_limit_backoff()
+        # reconnection statistics
+        self.reconnects = 0
+        self.disconnected_seconds = 0.0
+
+        self.stream_id = stream_id
+        self.metrics = metrics or MetricsRegistry()
+        labels = {'stream': stream_id} if stream_id is not None else None
+        self.lines_received = self.metrics.counter('lines_received_total', 'Non-empty lines received from the stream',
+                                                   labels)
+        self.bytes_received = self.metrics.counter('bytes_received_total', 'Bytes of the non-empty lines received',
+                                                   labels)
+        self.limit_notices = self.metrics.counter('limit_notices_total', 'Limit notices received from the stream',
+                                                  labels)
+        self.undelivered = self.metrics.gauge('limit_undelivered',
+                                              'Undelivered tweets count reported by the last limit notice', labels)
+        self.metrics.gauge('reconnects', 'Stream reconnection attempts', labels, function=lambda: self.reconnects)
+        self.authentication_seconds = self.metrics.gauge('authentication_seconds', 'Time spent on the authentication')
+        self.time_to_first_message = self.metrics.gauge(
+            'time_to_first_message_seconds', 'Time from the start (including the authentication) till the first line',
+            labels)
+        self._started_at = started_at
+        self._streaming_started_at = None
+        self._first_message_pending = True
 
     def _authenticate(self):
         """
@@ -41,14 +112,86 @@ class TweetsStreamer:
         Returns:
             None
         """
-        if self.auth_cls and not self.auth:
-            authenticator = self.auth_cls(self.api_key, self.api_secret_key)
-            authenticator.authenticate()
-            self.auth = authenticator.provide_auth()
+        if self.auth:
+            return
+        if not self.authenticator:
+            if not self.auth_cls:
+                return
+            started = time.monotonic()
+            self.authenticator = self.auth_cls(self.api_key, self.api_secret_key)
+            self.authenticator.authenticate()
+            self.authentication_seconds.set(time.monotonic() - started)
+        self.auth = self.authenticator.provide_auth()
+
+    def _reauthenticate(self):
+        """
+        Ask the authenticator for new credentials once the stream rejected the current ones.
+        A shared authenticator may have been renewed by another streamer already, then its credentials are taken.
+
+        Returns:
+            bool, True if new credentials were obtained
+        """
+        if not self.authenticator:
+            return False
+        try:
+            renewed = self.authenticator.invalidate()
+        except Exception:
+            logger.exception('Re-authentication failed')
+            return False
+        auth = self.authenticator.provide_auth()
+        if not renewed and auth is self.auth:
+            return False
+        self.auth = auth
+        return True
+
+    def _get_session(self):
+        """
+        Return a pooled session, so reconnections reuse the connection pool
+
+        Returns:
+            requests.Session instance
+        """
+        if not self.session:
+            self.session = requests.Session()
+        return self.session
+
+    def _reset_backoff(self):
+        self.network_backoff.reset()
+        self.http_backoff.reset()
+        self.rate_limit_backoff.reset()
+
+    def _connect(self, url, body):
+        """
+        Open a streaming connection
+
+        Args:
+            url: stream URL
+            body: request body
+
+        Returns:
+            tuple of the response (None if the connection failed) and the backoff strategy to apply on failure
+        """
+        try:
+            resp = self._get_session().post(url, stream=True, auth=self.auth, data=body, timeout=self.timeout)
+        except requests.RequestException:
+            logger.exception('Can not connect to the stream')
+            return None, self.network_backoff
+
+        if resp.status_code == 200:
+            return resp, None
+
+        logger.error('Stream responded with %s status code: %s', resp.status_code, resp.text[:200])
+        resp.close()
+        if resp.status_code == 401 and self._reauthenticate():
+            return None, self.network_backoff
+        if resp.status_code in (420, 429):
+            return None, self.rate_limit_backoff
+        return None, self.http_backoff
 
     def _read_stream(self, url, body):
         """
-        Read from stream and yield none-empty message (omitting ping-alive empty strings)
+        Read from stream and yield none-empty message (omitting ping-alive empty strings).
+        Reconnects with a backoff on the connection errors till the STOP event is set.
 
         Args:
             url: stream URL
@@ -59,15 +202,129 @@ class TweetsStreamer:
 
         """
         logger.info('Reading from stream...')
-        # TODO: add error handling (timeouts specifically)
-        resp = requests.post(url, stream=True, auth=self.auth, data=body, timeout=90.0)
-        for line in resp.iter_lines():
-            if self.stop_event.is_set():
-                logger.info('Exiting the stream')
-                break
-            # filter out 'keep-alive' empty lines
-            if line:
-                yield line
+        attempts = 0
+        disconnected_at = None
+        try:
+            while not self.stop_event.is_set():
+                resp, backoff = self._connect(url, body)
+                if resp is not None:
+                    if disconnected_at is not None:
+                        self.disconnected_seconds += time.monotonic() - disconnected_at
+                        disconnected_at = None
+                        logger.info('Reconnected to the stream')
+                    connected_at = time.monotonic()
+                    stable = False
+                    try:
+                        for line in self._iter_lines(resp):
+                            if self.stop_event.is_set():
+                                logger.info('Exiting the stream')
+                                return
+                            # a stream accepting the connection and dropping it right away is still retried
+                            # with the growing delays
+                            if not stable and (line or time.monotonic() - connected_at >= STABLE_CONNECTION_SECONDS):
+                                stable = True
+                                attempts = 0
+                                self._reset_backoff()
+                            # filter out 'keep-alive' empty lines
+                            if line:
+                                self._observe_line(line)
+                                yield self._detach_line(line) if self.delimited and self._detach_line else line
+                        logger.warning('Stream is closed by the server')
+                    except (requests.RequestException, ValueError):
+                        logger.exception('Stream is interrupted')
+                    finally:
+                        resp.close()
+                    backoff = self.network_backoff
+
+                if disconnected_at is None:
+                    disconnected_at = time.monotonic()
+                delay = self._reconnect_delay(attempts, backoff)
+                if delay is None:
+                    return
+                attempts += 1
+                self.stop_event.wait(delay)
+        finally:
+            if disconnected_at is not None:
+                self.disconnected_seconds += time.monotonic() - disconnected_at
+
+    def _reconnect_delay(self, attempts, backoff):
+        """
+        Account a reconnection attempt, or give up once the max number of attempts is reached (the `on_give_up`
+        callback is called, the STOP event is set if there is none)
+
+        Args:
+            attempts: number of the reconnection attempts made in a row
+            backoff: backoff strategy of the last failure
+
+        Returns:
+            number of seconds to wait before the attempt, None if the streamer gives up
+        """
+        if self.max_reconnects is not None and attempts >= self.max_reconnects:
+            logger.error('Giving up after %s reconnection attempts', attempts)
+            if self.on_give_up:
+                self.on_give_up()
+            else:
+                self.stop_event.set()
+            return None
+        self.reconnects += 1
+        delay = backoff.next_delay()
+        logger.info('Reconnecting in %s sec (attempt %s)', delay, attempts + 1)
+        return delay
+
+    def _iter_lines(self, resp):
+        """
+        Split the response body into messages
+
+        Args:
+            resp: streamed requests.Response instance
+
+        Returns:
+            yields messages (memoryview slices of the framing buffer for the delimited stream) and empty
+            keep-alive lines
+        """
+        if self.delimited:
+            return iter_delimited(ChunkReader.from_response(resp).readinto)
+        return resp.iter_lines()
+
+    def _decode_line(self, line):
+        """
+        Decode a delimited message to text before the framing buffer is overwritten. A message that can not be
+        decoded is copied as bytes, so the processor counts it as invalid.
+
+        Args:
+            line: memoryview of the message
+
+        Returns:
+            str or bytes
+        """
+        try:
+            return str(line, self.encoding)
+        except UnicodeDecodeError:
+            return bytes(line)
+
+    def _observe_line(self, line):
+        """
+        Account a received line in the metrics. Limit notices (the number of tweets matching the track phrases
+        but not delivered since the connection was opened) are sniffed by the leading key and parsed.
+
+        Args:
+            line: raw message bytes (or a memoryview of them)
+
+        Returns:
+            None
+        """
+        if self._first_message_pending:
+            self._first_message_pending = False
+            if self._started_at is not None:
+                self.time_to_first_message.set(time.monotonic() - self._started_at)
+        self.lines_received.inc()
+        self.bytes_received.inc(len(line))
+        if line[:len(LIMIT_NOTICE_PREFIX)] == LIMIT_NOTICE_PREFIX:
+            self.limit_notices.inc()
+            try:
+                self.undelivered.set(json.loads(bytes(line))['limit']['track'])
+            except (ValueError, KeyError, TypeError):
+                logger.warning('Unexpected limit notice: %s', line[:200])
 
     def filter_tweets(self, track):
         """
@@ -80,6 +337,8 @@ class TweetsStreamer:
         Returns:
             None
         """
+        if self._started_at is None:
+            self._started_at = time.monotonic()
         try:
             self._authenticate()
         except Exception:
@@ -90,7 +349,27 @@ class TweetsStreamer:
 
         url = self.stream_root_url + '/statuses/filter.json'
         body = {'track': track}
+        if self.delimited:
+            body['delimited'] = 'length'
         self.barrier.wait()
+        self._streaming_started_at = time.monotonic()
+
+        try:
+            if not self.batch_size:
+                for line in self._read_stream(url, body):
+                    self.input_queue.put(line)
+                return
+
+            with LineBatcher(self.input_queue.put, self.batch_size, self.batch_interval) as batcher:
+                for line in self._read_stream(url, body):
+                    batcher.add(line)
+        finally:
+            logger.info('Stream reconnected %s times, %.1f sec spent disconnected',
+                        self.reconnects, self.disconnected_seconds)
+            self._log_throughput()
 
-        for line in self._read_stream(url, body):
-            self.input_queue.put(line)
+    def _log_throughput(self):
+        elapsed = time.monotonic() - self._streaming_started_at
+        logger.info('Stream%s received %s lines (%s bytes) in %.1f sec: %.1f lines/sec',
+                    f' {self.stream_id}' if self.stream_id is not None else '', self.lines_received.value,
+                    self.bytes_received.value, elapsed, self.lines_received.value / elapsed if elapsed else 0)
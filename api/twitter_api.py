@@ -1,54 +1,266 @@
+import asyncio
+import functools
 import logging
+import multiprocessing
 import queue
-from threading import Thread, Event, Barrier
+import signal
+import time
+from threading import Thread, Event, Barrier, Lock
 
-from .auth import PINAuthenticator
+from .aggregates import HEAVY_HITTERS, create_aggregator
+from .async_streamer import AsyncTweetsStreamer
+from .auth import CachedAuthenticator, PINAuthenticator
+from .canonical import COLLAPSE_MODES
+from .dedup import create_deduplicator
+from .journal import FSYNC_POLICIES, JOURNAL_SEGMENT_SIZE, Journal
 from .limiter import Limiter
+from .matcher import TrackMatcher
+from .metrics import MetricsRegistry, MetricsReporter
+from .overflow import OVERFLOW_POLICIES, create_input_queue
+from .profiling import MemoryTracer, ThreadProfiler
+from .ringbuffer import RING_BUFFER_SIZE, RingBuffer
 from .tweets_processor import TweetsProcessor
 from .tweets_streamer import TweetsStreamer
+from .writers import WRITERS
 
 logger = logging.getLogger(__name__)
 
 
+def _run_processor(input_queue, message_queue_size, barrier, stop_event, limiter_kwargs, processor_kwargs):
+    """
+    Entry point of the processor child process (see TwitterAPI processor_process). The processor gets its own
+    limiter and metrics, the limiter shares the STOP event with the parent process.
+    """
+    # Ctrl+C is handled by the parent (it sets the STOP event), so the processor still exports the messages
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    metrics = MetricsRegistry()
+    try:
+        limiter = Limiter(barrier=None, stop_event=stop_event, metrics=metrics, **limiter_kwargs)
+        processor = TweetsProcessor(input_queue, queue.Queue(message_queue_size), barrier, stop_event,
+                                    limiter=limiter, **dict(processor_kwargs, metrics=metrics))
+        processor.start()
+    finally:
+        # release the other stages if the processor failed before the start
+        barrier.abort()
+        stop_event.set()
+        input_queue.close()
+        logger.info('Processor metrics: %s', MetricsReporter(metrics).summary())
+        input_queue.detach()
+
+
 class TwitterAPI:
-    def __init__(self, api_key, api_secret_key, time_limit=30, message_limit=100):
+    ENGINES = ('threads', 'asyncio')
+
+    def __init__(self, api_key, api_secret_key, time_limit=30, message_limit=100, sort_buffer_size=None,
+                 snowflake_timestamps=False, engine='threads', byte_limit=None, user_message_limit=None,
+                 batch_size=None, decode_workers=0, dedup=None, dedup_options=None,
+                 fast_parse=False, max_reconnects=None, filename='./output.csv', auth_cls=PINAuthenticator,
+                 stream_root_url=None, on_message=None, metrics_interval=None, metrics_file=None,
+                 output_format='tsv', rotate_seconds=None, rotate_messages=None, credentials_file=None,
+                 processor_process=False, ring_buffer_size=RING_BUFFER_SIZE, delimited=False, input_queue_size=None,
+                 overflow_policy='block', spill_dir=None, journal_dir=None, resume=False, fsync='interval',
+                 journal_segment_size=JOURNAL_SEGMENT_SIZE, index=False, tag=False, route=False,
+                 profile_dir=None, trace_memory_dir=None, collapse=None, aggregates=None, aggregates_options=None,
+                 aggregates_interval=60, journal_retain_segments=1):
         """
         TwitterAPI class that provides a functionality to fetch tweets from the Streamer
 
         Args:
             api_key: client API Key
             api_secret_key: client API secret key
-            time_limit: max number of seconds the streaming may run
-            message_limit: max number of messages being fetched
+            time_limit: max number of seconds the streaming may run (no time limit if None)
+            message_limit: max number of messages being fetched (unlimited if None)
+            sort_buffer_size: max number of rows kept in memory during the export (unlimited if None)
+            snowflake_timestamps: take the tweet creation time from the snowflake ID
+            engine: pipeline engine, either 'threads' (a thread per stage) or 'asyncio' (single event loop)
+            byte_limit: max total size (in bytes) of the fetched messages (unlimited if None)
+            user_message_limit: max number of messages fetched per user (unlimited if None)
+            batch_size: hand messages over from the streamer to the processor in batches of that size.
+            Supported by the 'threads' engine only
+            decode_workers: number of processes decoding the messages (0 - decode in the processor thread).
+            Supported by the 'threads' engine only
+            dedup: deduplication backend name (see dedup.DEDUPLICATORS). If None, the exact 'set' backend is used, or
+            the bounded 'window' one in the continuous mode, where the exact one would keep growing with the run
+            dedup_options: dict of the deduplication backend parameters (size, error_rate, window)
+            fast_parse: skip control messages without parsing them and extract only the exported tweet fields
+            max_reconnects: max number of stream reconnection attempts in a row (unlimited if None)
+            filename: filename to dump fetched tweets to
+            auth_cls: authenticator class (see auth.BaseAuthenticator), PIN-based OAuth by default
+            stream_root_url: root URL of the stream endpoints (Twitter stream if None)
+            on_message: optional callable invoked with every accepted Tweet
+            metrics_interval: number of seconds between the metrics reports in the log (10 if only metrics_file
+            is set, no reports if both are None)
+            metrics_file: Prometheus text file the metrics are written to on every report
+            output_format: output writer name (see writers.WRITERS)
+            rotate_seconds: continuous mode: rotate the output file every that many seconds
+            rotate_messages: continuous mode: rotate the output file every that many messages.
+            In the continuous mode the stream is kept open till the limits are reached (if any) or till interrupted,
+            and every window is exported to its own file (see writers.window_filename) on a background thread
+            credentials_file: if set, access tokens are cached in that file and reused across runs, auth_cls is
+            only used when there are no cached tokens or they are rejected (see auth.CachedAuthenticator)
+            processor_process: run the processor in a child process, so it gets a core of its own. Raw lines are
+            handed over through a shared memory ring buffer (see ringbuffer.RingBuffer) instead of the input queue.
+            Supported by the 'threads' engine only, on_message is not supported (it would be called in the child)
+            ring_buffer_size: size of the ring buffer in bytes
+            delimited: read the length-delimited stream instead of splitting it by newlines (see
+            framing.iter_delimited). Supported by the 'threads' engine only
+            input_queue_size: max number of items (messages or batches) waiting for the processor (unbounded if None)
+            overflow_policy: what to do with the new items when the input queue is full (see overflow.OVERFLOW_POLICIES).
+            The 'asyncio' engine and the processor process (its ring buffer is bounded by ring_buffer_size) support
+            the 'block' policy only
+            spill_dir: directory of the spill file of the 'spill' policy (the system temporary directory if None)
+            journal_dir: if set, the streamers append raw lines to a memory-mapped journal in that directory instead
+            of the input queue, and the processor commits its cursor once the lines are exported (see
+            journal.Journal). Supported by the 'threads' engine only, without the processor process, the decode
+            workers and the input queue size
+            resume: process the journal lines not exported by the previous run first, and restore the deduplication
+            state from the exported ones
+            fsync: journal sync policy (see journal.FSYNC_POLICIES)
+            journal_segment_size: size of a journal segment file in bytes
+            index: write a sidecar index of the user rows next to every output file, for the `query` lookups
+            (see index.OutputIndex). Supported by the uncompressed 'tsv' and 'jsonl' formats only
+            tag: add the track phrases every tweet text matched to the output (see matcher.TrackMatcher).
+            Not supported by the 'columnar' format
+            route: write the tweets to an output file per matched track phrase (see matcher.route_filename)
+            profile_dir: if set, every pipeline thread (the event loop of the 'asyncio' engine) is profiled and
+            the profiles are written to that directory at the end of the run (see profiling.ThreadProfiler)
+            trace_memory_dir: if set, the allocations are traced and the top allocation sites are written to that
+            directory whenever an export starts (see profiling.MemoryTracer)
+            Profiling and memory tracing are not supported with the processor process
+            collapse: store the text shared by the retweets of a tweet once and export the retweets and quotes
+            expanded ('expand') or normalized ('normalize', with a canonical tweets table, not supported by the
+            'columnar' format), see canonical.COLLAPSE_MODES. No collapsing if None
+            aggregates: if set, the top users, hashtags and mentions are counted by that algorithm (see
+            aggregates.HEAVY_HITTERS) along with the tweets per minute, in a fixed memory, and the snapshots are
+            written next to the output (see aggregates.StreamAggregator)
+            aggregates_options: dict of the aggregator parameters (size, top, rate_window, rate_windows, width, depth)
+            aggregates_interval: number of seconds between the aggregates snapshots (the final one only if None)
+            journal_retain_segments: number of the exported journal segments kept before the segment of the cursor,
+            to restore the deduplication state on resume (all of them if None, see journal.Journal)
         """
+        if engine not in self.ENGINES:
+            raise ValueError(f'Unknown engine: {engine}')
+        if output_format not in WRITERS:
+            raise ValueError(f'Unknown output format: {output_format}')
+        if decode_workers and engine != 'threads':
+            raise ValueError('Decode workers are supported by the threads engine only')
+        if processor_process and engine != 'threads':
+            raise ValueError('Processor process is supported by the threads engine only')
+        if delimited and engine != 'threads':
+            raise ValueError('Length-delimited stream is supported by the threads engine only')
+        if batch_size and engine != 'threads':
+            raise ValueError('Batched hand-off is supported by the threads engine only')
+        if processor_process and on_message:
+            raise ValueError('on_message is not supported with the processor process')
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f'Unknown overflow policy: {overflow_policy}')
+        if overflow_policy != 'block' and (engine != 'threads' or processor_process):
+            raise ValueError(f'Overflow policy {overflow_policy} is supported by the threads engine only '
+                             f'and not with the processor process')
+        if index and not WRITERS[output_format].index_format:
+            raise ValueError(f'Output format {output_format} can not be indexed')
+        if tag and not WRITERS[output_format].extendable:
+            raise ValueError(f'Output format {output_format} can not hold the matched phrases')
+        if collapse and collapse not in COLLAPSE_MODES:
+            raise ValueError(f'Unknown collapse mode: {collapse}')
+        if collapse == 'normalize' and not WRITERS[output_format].extendable:
+            raise ValueError(f'Output format {output_format} can not be normalized')
+        if aggregates and aggregates not in HEAVY_HITTERS:
+            raise ValueError(f'Unknown heavy hitters algorithm: {aggregates}')
+        if (profile_dir or trace_memory_dir) and processor_process:
+            raise ValueError('Profiling is not supported with the processor process')
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f'Unknown fsync policy: {fsync}')
+        if resume and not journal_dir:
+            raise ValueError('Resume requires the journal')
+        if journal_dir and (engine != 'threads' or processor_process or decode_workers or input_queue_size):
+            raise ValueError('Journal is supported by the threads engine only, without the processor process, '
+                             'the decode workers and the input queue size')
         self.api_key = api_key
         self.api_secret_key = api_secret_key
         self.streaming = False
 
         self.time_limit = time_limit
         self.message_limit = message_limit
+        self.sort_buffer_size = sort_buffer_size
+        self.snowflake_timestamps = snowflake_timestamps
+        self.engine = engine
+        self.byte_limit = byte_limit
+        self.user_message_limit = user_message_limit
+        self.batch_size = batch_size
+        self.decode_workers = decode_workers
+        self.dedup = dedup or ('window' if rotate_seconds or rotate_messages else 'set')
+        self.dedup_options = dedup_options or {}
+        self.fast_parse = fast_parse
+        self.max_reconnects = max_reconnects
+        self.filename = filename
+        if credentials_file:
+            auth_cls = functools.partial(CachedAuthenticator, cache_file=credentials_file, fallback_cls=auth_cls)
+        self.auth_cls = auth_cls
+        self.stream_root_url = stream_root_url
+        self.on_message = on_message
+        self.metrics_interval = metrics_interval
+        self.metrics_file = metrics_file
+        self.output_format = output_format
+        self.rotate_seconds = rotate_seconds
+        self.rotate_messages = rotate_messages
+        self.processor_process = processor_process
+        self.ring_buffer_size = ring_buffer_size
+        self.delimited = delimited
+        self.input_queue_size = input_queue_size
+        self.overflow_policy = overflow_policy
+        self.spill_dir = spill_dir
+        self.journal_dir = journal_dir
+        self.resume = resume
+        self.fsync = fsync
+        self.journal_segment_size = journal_segment_size
+        self.journal_retain_segments = journal_retain_segments
+        self.index = index
+        self.tag = tag
+        self.route = route
+        # track phrases matcher of the last run (tagging and routing only)
+        self.matcher = None
+        self.collapse = collapse
+        self.aggregates = aggregates
+        self.aggregates_options = aggregates_options or {}
+        self.aggregates_interval = aggregates_interval
+        self.profile_dir = profile_dir
+        self.trace_memory_dir = trace_memory_dir
+        self.profiler = None
+        self.memory_tracer = None
 
+        # replaced by a multiprocessing Event for every run with the processor process (an asyncio Event with
+        # the asyncio engine)
         self.stop_event = Event()
-        # will create 3 threads, to sync them we need a barrier for 3 parties
-        self.barrier = Barrier(3)
-        # thread responsible for handling stream request
+        # will create a thread per stream, a limiter and a processor threads, to sync them we need a barrier
+        # (created for every run as the number of streams may vary)
+        self.barrier = None
+        # threads responsible for handling stream requests (one per track group)
+        self.streamer_threads = []
         self.streamer_thread = None
-        # thread responsible for processing fetched tweets
+        # thread (child process with processor_process) responsible for processing fetched tweets
         self.processor_thread = None
         # thread responsible for limiting the fetching and processing
         self.limiter_thread = None
+        # pipeline stages of the last run and their metrics
+        self.streamers = []
+        self.streamer = None
+        self.processor = None
+        self.metrics = None
 
     def filter_tweets(self, track):
         """
         Fetch tweets from the stream endpoint with a use of multiple threads
         Args:
             track: string that represents a comma-separated list of phrases which will be used to determine
-            what Tweets will be delivered on the stream
+            what Tweets will be delivered on the stream, or a list of such strings (track groups). A stream is opened
+            per track group, all of them feed the same processor, so the deduplication and the limits are global
 
         Returns:
             None
         """
-        if not track:
+        groups = [track] if isinstance(track, str) else [group for group in track or () if group]
+        if not groups:
             return
 
         if self.streaming:
@@ -56,38 +268,268 @@ class TwitterAPI:
             return
 
         self.streaming = True
+        self.metrics = MetricsRegistry()
+        self.matcher = TrackMatcher(groups) if self.tag or self.route else None
+        self.profiler = ThreadProfiler(self.profile_dir) if self.profile_dir else None
+        self.memory_tracer = MemoryTracer(self.trace_memory_dir) if self.trace_memory_dir else None
+        if self.memory_tracer:
+            self.memory_tracer.start()
+        reporter = None
+        if self.metrics_interval or self.metrics_file:
+            reporter = MetricsReporter(self.metrics, self.metrics_interval or 10, self.metrics_file)
+            reporter.start()
+        try:
+            if self.engine == 'asyncio':
+                self._profiled('event_loop', asyncio.run)(self._filter_tweets_async(groups))
+            else:
+                self._filter_tweets_threads(groups)
+        finally:
+            if reporter:
+                reporter.stop()
+            if self.profiler:
+                self.profiler.write()
+            if self.memory_tracer:
+                self.memory_tracer.stop()
+            self.streaming = False
 
-        logger.info('Creating queues...')
-        input_queue = queue.Queue()
-        messages_queue = queue.Queue(self.message_limit)
-
-        logger.info('Initializing threads...')
-        streamer = TweetsStreamer(self.api_key, self.api_secret_key, self.barrier, input_queue, self.stop_event,
-                                  auth_cls=PINAuthenticator)
-        self.streamer_thread = Thread(
-            name='streamer',
-            target=streamer.filter_tweets,
-            args=(track, )
+    def _profiled(self, name, target):
+        """
+        Wrap a thread target with the profiler of the run (if any)
+        """
+        return self.profiler.wrap(name, target) if self.profiler else target
+
+    def _authenticate(self):
+        """
+        Authenticate once for all streams
+
+        Returns:
+            authenticated BaseAuthenticator instance or None if there is no auth class
+        """
+        if not self.auth_cls:
+            return None
+        started = time.monotonic()
+        authenticator = self.auth_cls(self.api_key, self.api_secret_key)
+        authenticator.authenticate()
+        self.metrics.gauge('authentication_seconds', 'Time spent on the authentication').set(time.monotonic() - started)
+        return authenticator
+
+    def _create_streamers(self, streamer_cls, groups, input_queue, stop_event, authenticator, started_at, **kwargs):
+        self._streams_lock = Lock()
+        self._streams_given_up = 0
+        self.streamers = [
+            streamer_cls(
+                self.api_key, self.api_secret_key, input_queue=input_queue, stop_event=stop_event,
+                auth_cls=self.auth_cls, authenticator=authenticator, stream_root_url=self.stream_root_url,
+                metrics=self.metrics, stream_id=str(ind) if len(groups) > 1 else None, started_at=started_at,
+                max_reconnects=self.max_reconnects, on_give_up=self._stream_given_up, **kwargs
+            )
+            for ind in range(len(groups))
+        ]
+        self.streamer = self.streamers[0]
+        return self.streamers
+
+    def _stream_given_up(self):
+        """
+        Called by a streamer once it gives up reconnecting: the run goes on while any other stream is alive
+        """
+        with self._streams_lock:
+            self._streams_given_up += 1
+            if self._streams_given_up < len(self.streamers):
+                return
+        logger.error('All streams gave up reconnecting. Stopping')
+        self.stop_event.set()
+
+    def _filter_tweets_threads(self, groups):
+        """
+        Run the streamers (one per track group), limiter and processor in separate threads
+
+        Args:
+            groups: list of strings that represent comma-separated lists of phrases
+
+        Returns:
+            None
+        """
+        started_at = time.monotonic()
+        try:
+            authenticator = self._authenticate()
+        except Exception:
+            logger.exception('Authentication failed')
+            return
+
+        logger.info('Initializing queues and threads...')
+        # the processor starts first, so its process is forked before the other threads are running
+        if self.processor_process:
+            input_queue = RingBuffer(self.ring_buffer_size)
+            self.metrics.gauge('input_queue_depth', 'Items waiting in the input queue', function=input_queue.qsize)
+            self.stop_event = multiprocessing.Event()
+            self.barrier = multiprocessing.Barrier(len(groups) + 2)
+            # the limiter of the child process accounts the messages, this one only tracks the time limit
+            limiter = Limiter(barrier=self.barrier, stop_event=self.stop_event, **self._limiter_kwargs())
+            self.processor = None
+            self.processor_thread = multiprocessing.Process(
+                name='processor',
+                target=_run_processor,
+                args=(input_queue, self._message_queue_size(), self.barrier, self.stop_event, self._limiter_kwargs(),
+                      dict(self._processor_kwargs(), metrics=None, decode_workers=self.decode_workers)),
+            )
+        else:
+            if self.journal_dir:
+                input_queue = Journal(self.journal_dir, self.journal_segment_size, fsync=self.fsync,
+                                      resume=self.resume, retain_segments=self.journal_retain_segments,
+                                      metrics=self.metrics)
+            else:
+                input_queue = create_input_queue(self.overflow_policy, self.input_queue_size,
+                                                 stop_event=self.stop_event, metrics=self.metrics,
+                                                 spill_dir=self.spill_dir)
+            self.barrier = Barrier(len(groups) + 2)
+            limiter = self._create_limiter(self.barrier, self.stop_event)
+            processor = self.processor = TweetsProcessor(
+                input_queue, queue.Queue(self._message_queue_size()), self.barrier, self.stop_event,
+                limiter=limiter, decode_workers=self.decode_workers,
+                journal=input_queue if self.journal_dir else None, **self._processor_kwargs()
+            )
+            if self.resume:
+                restored = processor.restore_deduplicator(input_queue.iter_committed())
+                logger.info('Restored %s exported tweet IDs from the journal', restored)
+            self.processor_thread = Thread(
+                name='processor',
+                target=self._profiled('processor', processor.start),
+            )
+        self.processor_thread.start()
+
+        streamers = self._create_streamers(
+            TweetsStreamer, groups, input_queue, self.stop_event, authenticator, started_at, barrier=self.barrier,
+            batch_size=self.batch_size, delimited=self.delimited,
         )
-        self.streamer_thread.start()
+        names = ['streamer'] if len(groups) == 1 else [f'streamer-{ind}' for ind in range(len(groups))]
+        self.streamer_threads = [
+            Thread(
+                name=name,
+                target=self._profiled(name, streamer.filter_tweets),
+                args=(group, )
+            )
+            for name, streamer, group in zip(names, streamers, groups)
+        ]
+        self.streamer_thread = self.streamer_threads[0]
+        for streamer_thread in self.streamer_threads:
+            streamer_thread.start()
 
-        limiter = Limiter(self.time_limit, self.message_limit, messages_queue, self.barrier, self.stop_event)
         self.limiter_thread = Thread(
             name='limiter',
-            target=limiter.start,
+            target=self._profiled('limiter', limiter.start),
         )
         self.limiter_thread.start()
 
-        processor = TweetsProcessor(input_queue, messages_queue, self.barrier, self.stop_event)
-        self.processor_thread = Thread(
-            name='processor',
-            target=processor.start,
-        )
-        self.processor_thread.start()
-
         logger.info('All threads started. Waiting for a completion...')
-        self.streamer_thread.join()
+        try:
+            self._join_threads()
+        except KeyboardInterrupt:
+            logger.warning('Interrupted. Stopping the stream and exporting the fetched messages')
+            self.stop_event.set()
+            self._join_threads()
+        finally:
+            if self.processor_process:
+                input_queue.unlink()
+            else:
+                self._close_input_queue(input_queue)
+        logger.info('All threads completed')
+
+    def _close_input_queue(self, input_queue):
+        if self.journal_dir:
+            input_queue.close()
+            return
+        if not self.input_queue_size:
+            return
+        dropped = self.metrics.get('input_dropped_total')
+        spilled = self.metrics.get('input_spilled_total')
+        if dropped and dropped.value:
+            logger.warning('Input queue overflow: %d messages dropped (%s policy)', dropped.value,
+                           self.overflow_policy)
+        if spilled and spilled.value:
+            logger.warning('Input queue overflow: %d messages spilled to the disk', spilled.value)
+        input_queue.close()
+
+    def _join_threads(self):
+        for streamer_thread in self.streamer_threads:
+            streamer_thread.join()
         self.limiter_thread.join()
         self.processor_thread.join()
-        logger.info('All threads completed')
-        self.streaming = False
+
+    def _limiter_kwargs(self):
+        return {
+            'time_limit': self.time_limit,
+            'message_limit': self.message_limit,
+            'byte_limit': self.byte_limit,
+            'user_message_limit': self.user_message_limit,
+        }
+
+    def _create_limiter(self, barrier, stop_event):
+        return Limiter(barrier=barrier, stop_event=stop_event, metrics=self.metrics, **self._limiter_kwargs())
+
+    def _processor_kwargs(self):
+        return {
+            'sort_buffer_size': self.sort_buffer_size,
+            'snowflake_timestamps': self.snowflake_timestamps,
+            'deduplicator': create_deduplicator(self.dedup, **self.dedup_options),
+            'fast_parse': self.fast_parse,
+            'filename': self.filename,
+            'on_message': self.on_message,
+            'metrics': self.metrics,
+            'output_format': self.output_format,
+            'rotate_seconds': self.rotate_seconds,
+            'rotate_messages': self.rotate_messages,
+            'index': self.index,
+            'matcher': self.matcher,
+            'tag': self.tag,
+            'route': self.route,
+            'profiler': self.profiler,
+            'memory_tracer': self.memory_tracer,
+            'collapse': self.collapse,
+            'aggregator': create_aggregator(self.aggregates, **self.aggregates_options) if self.aggregates else None,
+            'aggregates_interval': self.aggregates_interval,
+        }
+
+    def _message_queue_size(self):
+        # in the continuous mode windows are exported on rotation, so the queue is not bounded by the message limit
+        if self.rotate_seconds or self.rotate_messages or not self.message_limit:
+            return 0
+        return self.message_limit
+
+    async def _filter_tweets_async(self, groups):
+        """
+        Run the streamers (one per track group), limiter and processor as coroutines on a single event loop
+
+        Args:
+            groups: list of strings that represent comma-separated lists of phrases
+
+        Returns:
+            None
+        """
+        started_at = time.monotonic()
+        try:
+            authenticator = await asyncio.get_event_loop().run_in_executor(None, self._authenticate)
+        except Exception:
+            logger.exception('Authentication failed')
+            return
+
+        logger.info('Creating queues...')
+        stop_event = self.stop_event = asyncio.Event()
+        input_queue = asyncio.Queue(self.input_queue_size or 0)
+        messages_queue = queue.Queue(self._message_queue_size())
+
+        streamers = self._create_streamers(AsyncTweetsStreamer, groups, input_queue, stop_event, authenticator,
+                                           started_at)
+
+        limiter = self._create_limiter(None, stop_event)
+        processor = self.processor = TweetsProcessor(input_queue, messages_queue, None, stop_event, limiter=limiter,
+                                                     **self._processor_kwargs())
+
+        logger.info('Starting coroutines. Waiting for a completion...')
+        streamer_tasks = [asyncio.ensure_future(streamer.filter_tweets(group))
+                          for streamer, group in zip(streamers, groups)]
+        await asyncio.gather(limiter.start_async(), processor.start_async())
+        # the streams may wait for the next chunk, so they are not awaited till the end
+        for streamer_task in streamer_tasks:
+            streamer_task.cancel()
+        await asyncio.gather(*streamer_tasks, return_exceptions=True)
+        logger.info('All coroutines completed')
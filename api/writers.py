@@ -0,0 +1,447 @@
+import csv
+import gzip
+import json
+import logging
+import os
+import re
+import struct
+import sys
+import time
+from abc import ABC, abstractmethod
+from array import array
+from itertools import islice
+
+from .index import IndexBuilder, index_filename
+
+logger = logging.getLogger(__name__)
+
+# Output row layout (see TweetsProcessor._row)
+FIELDS = ('id_str', 'created_at', 'text', 'user_id_str', 'user_created_at', 'user_name', 'user_screen_name')
+TSV_HEADER = ('Message ID', 'Message creation date (epoch)', 'Text', 'User ID', 'User creation date (epoch)',
+              'User name', 'User screen name')
+# Optional fields of the normalized rows, after the FIELDS: the reference type ('retweet' or 'quote') and the ID of
+# the canonical tweet (see canonical.CanonicalTable)
+REFERENCE_FIELDS = ('ref_type', 'ref_id_str')
+TSV_REFERENCE_HEADER = ('Reference type', 'Referenced message ID')
+# Optional last field of the tagged rows: the matched track phrases (see matcher.TrackMatcher)
+TAG_FIELD = 'matched'
+TSV_TAG_HEADER = 'Matched phrases'
+# Canonical tweets table of the normalized output (see write_canonical_table)
+CANONICAL_FIELDS = ('id_str', 'user_screen_name', 'text', 'retweet_text')
+CANONICAL_TSV_HEADER = ('Message ID', 'User screen name', 'Text', 'Retweet text')
+# Rows are converted and written in chunks of that many rows
+CHUNK_SIZE = 4096
+BUFFER_SIZE = 1 << 20
+GZIP_COMPRESS_LEVEL = 6
+# Placeholders of the window filename template (see window_filename)
+WINDOW_PLACEHOLDER_PATTERN = re.compile(r'\{(index|start)\}')
+
+
+class BaseWriter(ABC):
+    """
+    Base output writer. Takes rows in bulk (iterables of output rows) and writes them through a large buffer.
+    Usage:
+        with create_writer('tsv', filename) as writer:
+            writer.write_rows(rows)
+    """
+    # open the output with gzip compression
+    compress = False
+    # format name of the sidecar index, None if the format can not be indexed (see index.IndexBuilder)
+    index_format = None
+    # the format can hold the fields that follow the FIELDS (REFERENCE_FIELDS, TAG_FIELD)
+    extendable = True
+
+    def __init__(self, filename, encoding='utf-8', index=False, tags=False, references=False):
+        """
+        Args:
+            filename: output filename
+            encoding: encoding string
+            index: write a sidecar index of the user rows (filename + index.INDEX_SUFFIX)
+            tags: rows end with the TAG_FIELD (a tuple of the matched phrases)
+            references: rows have the REFERENCE_FIELDS (None values for the tweets referring to none) after
+            the FIELDS
+        """
+        if index and not self.index_format:
+            raise ValueError(f'{type(self).__name__} output can not be indexed')
+        if (tags or references) and not self.extendable:
+            raise ValueError(f'{type(self).__name__} output can not hold the matched phrases or the references')
+        self.filename = filename
+        self.encoding = encoding
+        # fields of the rows after the FIELDS
+        self.extra_fields = (REFERENCE_FIELDS if references else ()) + ((TAG_FIELD, ) if tags else ())
+        self.rows_count = 0
+        self.file = None
+        self.index = IndexBuilder(self.index_format) if index else None
+
+    def _open(self, mode):
+        if self.compress:
+            return gzip.open(self.filename, mode, compresslevel=GZIP_COMPRESS_LEVEL,
+                             **({'encoding': self.encoding, 'newline': ''} if 't' in mode else {}))
+        if 'b' in mode:
+            return open(self.filename, mode, buffering=BUFFER_SIZE)
+        return open(self.filename, mode, buffering=BUFFER_SIZE, encoding=self.encoding, newline='')
+
+    @abstractmethod
+    def open(self):
+        raise NotImplementedError('Method not implemented')
+
+    @abstractmethod
+    def write_rows(self, rows):
+        """
+        Write output rows
+
+        Args:
+            rows: iterable of output rows (tuples in the FIELDS order)
+
+        Returns:
+            None
+        """
+        raise NotImplementedError('Method not implemented')
+
+    def _byte_size(self, line):
+        return len(line) if line.isascii() else len(line.encode(self.encoding))
+
+    def _index_lines(self, rows, lines):
+        """
+        Account written lines in the index. The index is given up (with a warning) if the rows can not be indexed.
+
+        Args:
+            rows: output rows
+            lines: the lines (strings) the rows were written as
+        """
+        try:
+            for row, line in zip(rows, lines):
+                self.index.add(row[3], row[4], self._byte_size(line))
+        except ValueError as exc:
+            logger.warning('Can not index "%s": %s', self.filename, exc)
+            self.index = None
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+            if self.index is not None:
+                try:
+                    self.index.write(index_filename(self.filename))
+                except ValueError as exc:
+                    logger.warning('Can not index "%s": %s', self.filename, exc)
+                else:
+                    logger.info('Indexed %s users of "%s"', len(self.index), self.filename)
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            # the output is incomplete
+            self.index = None
+        self.close()
+
+
+def _chunks(rows, size=CHUNK_SIZE):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def escape_text(text):
+    """
+    Escape the tweet text the way the TSV output always did (`unicode_escape`), skipping the codec for
+    printable ASCII text without backslashes, which it would return as is.
+
+    Args:
+        text: tweet text
+
+    Returns:
+        str, escaped text
+    """
+    if text.isascii() and text.isprintable() and '\\' not in text:
+        return text
+    return text.encode('unicode_escape').decode('ascii')
+
+
+class _LineFormatter:
+    """
+    File-like object returning what is written to it, so `csv.writer(...).writerow` returns the formatted line
+    """
+
+    @staticmethod
+    def write(line):
+        return line
+
+
+class TSVWriter(BaseWriter):
+    """
+    Tab-separated output (the original format): every value is quoted, epochs are written as floats and
+    the text is `unicode_escape`-d. The matched phrases of the tagged rows are joined with commas, missing
+    references are empty.
+    """
+    index_format = 'tsv'
+
+    def open(self):
+        self.file = self._open('wt' if self.compress else 'w')
+        self.writer = csv.writer(self.file, delimiter='\t', quoting=csv.QUOTE_NONNUMERIC)
+        header = TSV_HEADER
+        if REFERENCE_FIELDS[0] in self.extra_fields:
+            header += TSV_REFERENCE_HEADER
+        if TAG_FIELD in self.extra_fields:
+            header += (TSV_TAG_HEADER, )
+        if self.index is None:
+            self.writer.writerow(header)
+            return
+        # lines are formatted before they are written, to account their sizes
+        self.formatter = csv.writer(_LineFormatter(), delimiter='\t', quoting=csv.QUOTE_NONNUMERIC)
+        header = self.formatter.writerow(header)
+        self.file.write(header)
+        self.index.skip(self._byte_size(header))
+
+    def write_rows(self, rows):
+        for chunk in _chunks(rows):
+            if self.extra_fields:
+                converted = [
+                    (id_str, str(float(created_at)), escape_text(text), user_id_str, str(float(user_created_at)),
+                     name, screen_name, *map(_tsv_value, extra))
+                    for id_str, created_at, text, user_id_str, user_created_at, name, screen_name, *extra in chunk
+                ]
+            else:
+                converted = [
+                    (id_str, str(float(created_at)), escape_text(text), user_id_str, str(float(user_created_at)),
+                     name, screen_name)
+                    for id_str, created_at, text, user_id_str, user_created_at, name, screen_name in chunk
+                ]
+            if self.index is None:
+                self.writer.writerows(converted)
+            else:
+                writerow = self.formatter.writerow
+                lines = [writerow(row) for row in converted]
+                self.file.write(''.join(lines))
+                self._index_lines(chunk, lines)
+            self.rows_count += len(chunk)
+
+
+def _tsv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, tuple):
+        return ','.join(value)
+    return value
+
+
+class JSONLWriter(BaseWriter):
+    """
+    JSON lines output: a JSON object per row with the FIELDS keys (and the REFERENCE_FIELDS and the TAG_FIELD list if
+    the rows have them), epochs are integers
+    """
+    index_format = 'jsonl'
+
+    def open(self):
+        self.file = self._open('wt' if self.compress else 'w')
+        self.encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+    def write_rows(self, rows):
+        encode = self.encoder.encode
+        fields = FIELDS + self.extra_fields
+        for chunk in _chunks(rows):
+            lines = [encode(dict(zip(fields, row))) + '\n' for row in chunk]
+            self.file.write(''.join(lines))
+            if self.index is not None:
+                self._index_lines(chunk, lines)
+            self.rows_count += len(chunk)
+
+
+class GzipTSVWriter(TSVWriter):
+    compress = True
+    index_format = None
+
+
+class GzipJSONLWriter(JSONLWriter):
+    compress = True
+    index_format = None
+
+
+COLUMNAR_MAGIC = b'TWCOL\x00\x01\x00'
+COLUMNAR_ROW_GROUP = struct.Struct('<I')
+# fixed-width columns: tweet ID, tweet epoch, user ID, user epoch
+COLUMNAR_INT_COLUMNS = (('id_str', 'Q'), ('created_at', 'q'), ('user_id_str', 'Q'), ('user_created_at', 'q'))
+# variable-width columns: (rows + 1) offsets followed by the UTF-8 blob
+COLUMNAR_TEXT_COLUMNS = ('text', 'user_name', 'user_screen_name')
+COLUMNAR_ROW_GROUP_SIZE = 65536
+
+
+def _to_little_endian(values):
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_little_endian(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+class ColumnarWriter(BaseWriter):
+    """
+    Compact binary columnar output. The file starts with COLUMNAR_MAGIC followed by row groups of up to
+    COLUMNAR_ROW_GROUP_SIZE rows. A row group is the little-endian uint32 rows count, the 64-bit integer columns
+    (tweet ID, tweet epoch, user ID, user epoch) and the text columns (text, user name, screen name), each of them
+    as (rows count + 1) uint64 offsets followed by the UTF-8 blob. See `read_columnar`.
+    """
+    extendable = False
+
+    def open(self):
+        self.file = self._open('wb')
+        self.file.write(COLUMNAR_MAGIC)
+
+    def write_rows(self, rows):
+        for chunk in _chunks(rows, COLUMNAR_ROW_GROUP_SIZE):
+            columns = list(zip(*chunk))
+            parts = [COLUMNAR_ROW_GROUP.pack(len(chunk))]
+            for (field, typecode), ind in zip(COLUMNAR_INT_COLUMNS, (0, 1, 3, 4)):
+                try:
+                    parts.append(_to_little_endian(array(typecode, map(int, columns[ind]))))
+                except (ValueError, OverflowError):
+                    raise ValueError(f'Column {field} does not fit into 64-bit integers')
+            for ind in (2, 5, 6):
+                values = [value.encode('utf-8') for value in columns[ind]]
+                offsets = array('Q', [0])
+                position = 0
+                for value in values:
+                    position += len(value)
+                    offsets.append(position)
+                parts.append(_to_little_endian(offsets))
+                parts.append(b''.join(values))
+            self.file.write(b''.join(parts))
+            self.rows_count += len(chunk)
+
+
+def read_columnar(filename):
+    """
+    Read a file written by ColumnarWriter
+
+    Args:
+        filename: path to the file
+
+    Returns:
+        yields output rows (IDs as strings, epochs as integers)
+    """
+    with open(filename, 'rb') as f:
+        if f.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+            raise ValueError(f'{filename} is not a columnar output file')
+        while True:
+            header = f.read(COLUMNAR_ROW_GROUP.size)
+            if not header:
+                return
+            rows_count, = COLUMNAR_ROW_GROUP.unpack(header)
+            int_columns = [_from_little_endian(typecode, f.read(8 * rows_count))
+                           for _, typecode in COLUMNAR_INT_COLUMNS]
+            text_columns = []
+            for _ in COLUMNAR_TEXT_COLUMNS:
+                offsets = _from_little_endian('Q', f.read(8 * (rows_count + 1)))
+                blob = f.read(offsets[-1])
+                text_columns.append([blob[offsets[ind]:offsets[ind + 1]].decode('utf-8')
+                                     for ind in range(rows_count)])
+            ids, created_at, user_ids, user_created_at = int_columns
+            texts, names, screen_names = text_columns
+            for ind in range(rows_count):
+                yield (str(ids[ind]), created_at[ind], texts[ind], str(user_ids[ind]), user_created_at[ind],
+                       names[ind], screen_names[ind])
+
+
+def window_filename(filename, index, started_at):
+    """
+    Build the filename of an output window in the continuous mode. The filename may contain `{index}` and `{start}`
+    placeholders (any other braces are left as is), otherwise the window start time and index are inserted before
+    the extension (e.g. output.csv -> output-20190914T195720-000001.csv,
+    output.jsonl.gz -> output-20190914T195720-000001.jsonl.gz)
+
+    Args:
+        filename: output filename (template)
+        index: window index
+        started_at: window start time (epoch seconds)
+
+    Returns:
+        str, filename
+    """
+    start = time.strftime('%Y%m%dT%H%M%S', time.gmtime(started_at))
+    if WINDOW_PLACEHOLDER_PATTERN.search(filename):
+        # other braces (e.g. the phrase placeholder of the routed outputs, see matcher.route_filename) are kept as is
+        values = {'index': str(index), 'start': start}
+        return WINDOW_PLACEHOLDER_PATTERN.sub(lambda match: values[match.group(1)], filename)
+
+    directory, name = os.path.split(filename)
+    base, dot, extension = name.partition('.')
+    return os.path.join(directory, f'{base}-{start}-{index:06d}{dot}{extension}')
+
+
+WRITERS = {
+    'tsv': TSVWriter,
+    'tsv.gz': GzipTSVWriter,
+    'jsonl': JSONLWriter,
+    'jsonl.gz': GzipJSONLWriter,
+    'columnar': ColumnarWriter,
+}
+
+
+def create_writer(name='tsv', filename='./output.csv', encoding='utf-8', index=False, tags=False, references=False):
+    """
+    Instantiate an output writer by its name
+
+    Args:
+        name: one of WRITERS keys
+        filename: output filename
+        encoding: encoding string
+        index: write a sidecar index of the user rows (uncompressed tsv and jsonl only)
+        tags: rows end with the TAG_FIELD (all formats but columnar)
+        references: rows have the REFERENCE_FIELDS after the FIELDS (all formats but columnar)
+
+    Returns:
+        BaseWriter instance
+    """
+    if name not in WRITERS:
+        raise ValueError(f'Unknown output format: {name}')
+    return WRITERS[name](filename, encoding, index, tags, references)
+
+
+def write_canonical_table(name, filename, canonical_tweets, encoding='utf-8'):
+    """
+    Write the canonical tweets table of a normalized output in the text format of the output: the CANONICAL_FIELDS
+    of every tweet, the retweet text is the text of the retweets whose text is empty in the output
+
+    Args:
+        name: output format name (one of WRITERS keys but columnar)
+        filename: table filename
+        canonical_tweets: iterable of canonical.CanonicalTweet instances
+        encoding: encoding string
+
+    Returns:
+        int, number of written tweets
+    """
+    writer_cls = WRITERS[name]
+    if not writer_cls.extendable:
+        raise ValueError(f'{writer_cls.__name__} output can not be normalized')
+    if writer_cls.compress:
+        f = gzip.open(filename, 'wt', compresslevel=GZIP_COMPRESS_LEVEL, encoding=encoding, newline='')
+    else:
+        f = open(filename, 'w', buffering=BUFFER_SIZE, encoding=encoding, newline='')
+    rows = ((tweet.id_str, tweet.screen_name, tweet.text, tweet.retweet_text or '') for tweet in canonical_tweets)
+    count = 0
+    with f:
+        if issubclass(writer_cls, TSVWriter):
+            writer = csv.writer(f, delimiter='\t', quoting=csv.QUOTE_NONNUMERIC)
+            writer.writerow(CANONICAL_TSV_HEADER)
+            for id_str, screen_name, text, retweet_text in rows:
+                writer.writerow((id_str, screen_name, escape_text(text), escape_text(retweet_text)))
+                count += 1
+        else:
+            encode = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+            for row in rows:
+                f.write(encode(dict(zip(CANONICAL_FIELDS, row))) + '\n')
+                count += 1
+    return count
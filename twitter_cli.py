@@ -1,7 +1,20 @@
 import logging
 
 import click
+from api.aggregates import HEAVY_HITTERS
+from api.auth import DEFAULT_CREDENTIALS_FILE
+from api.canonical import COLLAPSE_MODES
+from api.bench import (generate_items, generate_phrases, generate_rows, run_aggregates_benchmark, run_benchmark,
+                       run_framing_benchmark, run_matcher_benchmark, run_transport_benchmark, run_writer_benchmark)
+from api.decoder import decode_message
+from api.dedup import DEDUPLICATORS
+from api.index import OutputIndex
+from api.journal import FSYNC_POLICIES, JOURNAL_SEGMENT_SIZE
+from api.overflow import OVERFLOW_POLICIES
+from api.replay import generate_stream, load_stream
+from api.ringbuffer import RING_BUFFER_SIZE
 from api.twitter_api import TwitterAPI
+from api.writers import WRITERS
 
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s :: %(levelname)s :: %(message)s :: %(name)s :: %(lineno)d')
@@ -10,23 +23,277 @@ logger = logging.getLogger(__name__)
 
 # Use a group so that these commands are only accessible from this file
 @click.group()
-def twitter_cli():
-    pass
+@click.option('-v', '--verbose', is_flag=True, default=False, help='Log every received message (debug logging)')
+def twitter_cli(verbose):
+    if verbose:
+        logging.getLogger().setLevel(logging.DEBUG)
 
 
 @twitter_cli.command('stream-tweets')
-@click.option('-t', '--track', default=None, help='A comma-separated list of phrases which will be used to determine what Tweets will be delivered on the stream.')
+@click.option('-t', '--track', multiple=True, help='A comma-separated list of phrases which will be used to determine what Tweets will be delivered on the stream. Repeat the option to open a stream per list (the streams share the deduplication and the limits).')
 @click.option('-k', '--key', default=None, help='Client API key')
 @click.option('-s', '--secret_key', default=None, help='Client API secret key')
-@click.option('-T', '--time_limit', default=30, help='Maximum number of seconds CLI will consume from the stream (default 30)')
-@click.option('-m', '--message_limit', default=100, help='Maximum number of tweets CLI will consume from the stream (default 100)')
-def stream_tweets(message_limit, time_limit, secret_key, key, track):
+@click.option('-T', '--time_limit', default=None, type=int, help='Maximum number of seconds CLI will consume from the stream (default 30, unlimited in the continuous mode)')
+@click.option('-m', '--message_limit', default=None, type=int, help='Maximum number of tweets CLI will consume from the stream (default 100, unlimited in the continuous mode)')
+@click.option('--sort_buffer', default=None, type=int, help='Maximum number of rows kept in memory during the export. Larger exports are sorted on disk (default: unlimited)')
+@click.option('--snowflake_timestamps', is_flag=True, default=False, help='Take the tweet creation date from the tweet ID instead of parsing the "created_at" field')
+@click.option('--engine', default='threads', type=click.Choice(TwitterAPI.ENGINES), help='Pipeline engine: a thread per stage or a single asyncio event loop (default threads)')
+@click.option('--byte_limit', default=None, type=int, help='Maximum total size (in bytes) of the tweets CLI will consume from the stream (default: unlimited)')
+@click.option('--user_message_limit', default=None, type=int, help='Maximum number of tweets CLI will keep per user (default: unlimited)')
+@click.option('--batch_size', default=None, type=int, help='Hand tweets over from the streamer to the processor in batches of that size (default: one by one; threads engine only)')
+@click.option('--decode_workers', default=0, help='Number of processes decoding and validating tweets (default 0: decode in the processor thread)')
+@click.option('--dedup', default=None, type=click.Choice(sorted(DEDUPLICATORS)), help='Deduplication backend: "set" is exact but grows with the run, "window" keeps IDs of the last --dedup_window seconds, "lru" keeps the last --dedup_size IDs, "bloom" uses ~1.44*log2(1/rate) bits per ID with --dedup_error_rate false positives (default set, window in the continuous mode)')
+@click.option('--dedup_size', default=None, type=int, help='Number of IDs kept by the "lru" backend / initial capacity of the "bloom" backend (default 1000000)')
+@click.option('--dedup_error_rate', default=None, type=float, help='False-positive rate of the "bloom" backend, i.e. share of unique tweets dropped as duplicates (default 0.001)')
+@click.option('--dedup_window', default=None, type=int, help='Number of seconds the "window" backend remembers IDs for (default 300)')
+@click.option('--fast_parse', is_flag=True, default=False, help='Skip control messages without parsing them and extract only the exported tweet fields (falls back to the full JSON parser for unexpected payloads)')
+@click.option('--max_reconnects', default=None, type=int, help='Maximum number of stream reconnection attempts in a row (default: unlimited)')
+@click.option('--metrics_interval', default=10, type=float, help='Number of seconds between the pipeline metrics reports in the log, 0 to disable (default 10)')
+@click.option('--metrics_file', default=None, type=click.Path(dir_okay=False), help='Prometheus text file the pipeline metrics are written to on every report')
+@click.option('-o', '--filename', default='./output.csv', type=click.Path(dir_okay=False), help='Output filename (default ./output.csv)')
+@click.option('--format', 'output_format', default='tsv', type=click.Choice(list(WRITERS)), help='Output format: tab-separated values, JSON lines, their gzip-compressed variants or a compact binary columnar file (default tsv)')
+@click.option('--rotate_seconds', default=None, type=int, help='Continuous mode: keep streaming and write every window of that many seconds to its own file')
+@click.option('--rotate_messages', default=None, type=int, help='Continuous mode: keep streaming and write every window of that many tweets to its own file')
+@click.option('--credentials_file', default=DEFAULT_CREDENTIALS_FILE, help=f'File the access tokens are cached in, so the PIN is only asked for once (default {DEFAULT_CREDENTIALS_FILE})')
+@click.option('--no_credentials_cache', is_flag=True, default=False, help='Do not cache the access tokens, ask for the PIN on every run')
+@click.option('--processor_process', is_flag=True, default=False, help='Run the processor in a child process fed through a shared memory ring buffer (threads engine only)')
+@click.option('--ring_buffer_size', default=RING_BUFFER_SIZE, help=f'Size of the shared memory ring buffer in bytes (default {RING_BUFFER_SIZE})')
+@click.option('--delimited', is_flag=True, default=False, help='Read the length-delimited stream instead of splitting it by newlines (threads engine only)')
+@click.option('--input_queue_size', default=None, type=int, help='Maximum number of tweets (or batches) waiting for the processor (default: unlimited)')
+@click.option('--overflow', default='block', type=click.Choice(list(OVERFLOW_POLICIES)), help='What to do when the input queue is full: block the stream, drop the newest or the oldest tweets, keep a uniform sample or spill to the disk (default block, the only one supported by the asyncio engine and the processor process)')
+@click.option('--spill_dir', default=None, type=click.Path(file_okay=False), help='Directory of the "spill" overflow file (default: the system temporary directory)')
+@click.option('--journal', 'journal_dir', default=None, type=click.Path(file_okay=False), help='Directory of a crash-safe journal the streamed tweets go through, so an interrupted run can be resumed (threads engine only)')
+@click.option('--resume', is_flag=True, default=False, help='Process the journal tweets the previous run did not export first and skip the ones it did')
+@click.option('--fsync', default='interval', type=click.Choice(FSYNC_POLICIES), help='Journal sync policy: sync every write, every second or leave it to the OS (default interval)')
+@click.option('--journal_segment_size', default=JOURNAL_SEGMENT_SIZE, help=f'Size of a journal segment file in bytes (default {JOURNAL_SEGMENT_SIZE})')
+@click.option('--journal_retain_segments', default=1, type=click.IntRange(min=0), help='Number of the exported journal segments kept before the one of the cursor, to restore the deduplication state on resume; older ones are removed (default 1)')
+@click.option('--index', is_flag=True, default=False, help='Write a sidecar index (<output>.idx) of the user rows next to every output file, for the query command (tsv and jsonl formats only)')
+@click.option('--tag', is_flag=True, default=False, help='Add the track phrases every tweet text matched to the output (a "Matched phrases" column of tsv, a "matched" list of jsonl; not supported by columnar)')
+@click.option('--route', is_flag=True, default=False, help='Write the tweets to an output file per matched track phrase (output-<phrase>.csv, or use the {phrase} placeholder in the filename), the ones matching no phrase in the text to output-_unmatched.csv')
+@click.option('--profile', 'profile_dir', default=None, type=click.Path(file_okay=False), help='Profile every pipeline thread and write a pstats file per thread (<thread>.prof) and their merged collapsed stacks (profile.collapsed, for the flame graph tools) to that directory')
+@click.option('--trace_memory', 'trace_memory_dir', default=None, type=click.Path(file_okay=False), help='Trace the allocations and write the top allocation sites to that directory whenever an export starts')
+@click.option('--collapse', default=None, type=click.Choice(COLLAPSE_MODES), help='Store the text shared by the retweets of a tweet once. expand: export the retweets as usual; normalize: leave the text of such retweets out of the output, add the reference type and ID columns and write the referred tweets to output-_canonical.csv (default: no collapsing)')
+@click.option('--aggregates', default=None, type=click.Choice(list(HEAVY_HITTERS)), help='Count the most active users, the most used hashtags and the most mentioned users with a fixed memory top-k counter (Space-Saving or Count-Min) and the tweets per --rate_window, and write the snapshots to output-_aggregates.json (default: no aggregates)')
+@click.option('--aggregates_size', default=None, type=int, help='Number of the items the top-k counters monitor per kind (default 1000)')
+@click.option('--aggregates_interval', default=60, type=int, help='Number of seconds between the aggregates snapshots, 0 to write the final one only (default 60)')
+@click.option('--rate_window', default=None, type=int, help='Length of the tumbling windows the tweets are counted by, in seconds of the tweet creation time (default 60)')
+def stream_tweets(rate_window, aggregates_interval, aggregates_size, aggregates, collapse, trace_memory_dir, profile_dir, route, tag, index, journal_retain_segments, journal_segment_size, fsync, resume, journal_dir, spill_dir, overflow, input_queue_size, delimited, ring_buffer_size, processor_process, no_credentials_cache, credentials_file, rotate_messages, rotate_seconds, output_format, filename, metrics_file, metrics_interval, max_reconnects, fast_parse, dedup_window, dedup_error_rate, dedup_size, dedup, decode_workers, batch_size, user_message_limit, byte_limit, engine, snowflake_timestamps, sort_buffer,
+                  message_limit, time_limit, secret_key, key, track):
+    if not (rotate_seconds or rotate_messages):
+        time_limit = 30 if time_limit is None else time_limit
+        message_limit = 100 if message_limit is None else message_limit
     # TODO: Make checks to be more specific and test for age cases
-    if not all((message_limit, time_limit, secret_key, key, track)):
+    if not all((secret_key, key, track)):
         logger.error('You must specify all parameters. Use --help option to get information about the inputs')
         return
-    reader = TwitterAPI(key, secret_key, time_limit, message_limit)
-    reader.filter_tweets(track)
+    reader = TwitterAPI(key, secret_key, time_limit, message_limit, sort_buffer_size=sort_buffer,
+                        snowflake_timestamps=snowflake_timestamps, engine=engine,
+                        byte_limit=byte_limit, user_message_limit=user_message_limit, batch_size=batch_size,
+                        decode_workers=decode_workers, dedup=dedup,
+                        dedup_options={'size': dedup_size, 'error_rate': dedup_error_rate, 'window': dedup_window},
+                        fast_parse=fast_parse, max_reconnects=max_reconnects,
+                        metrics_interval=metrics_interval, metrics_file=metrics_file,
+                        filename=filename, output_format=output_format,
+                        rotate_seconds=rotate_seconds, rotate_messages=rotate_messages,
+                        credentials_file=None if no_credentials_cache else credentials_file,
+                        processor_process=processor_process, ring_buffer_size=ring_buffer_size,
+                        delimited=delimited, input_queue_size=input_queue_size, overflow_policy=overflow,
+                        spill_dir=spill_dir, journal_dir=journal_dir, resume=resume, fsync=fsync,
+                        journal_segment_size=journal_segment_size, journal_retain_segments=journal_retain_segments,
+                        index=index, tag=tag, route=route,
+                        profile_dir=profile_dir, trace_memory_dir=trace_memory_dir, collapse=collapse,
+                        aggregates=aggregates, aggregates_options={'size': aggregates_size, 'rate_window': rate_window},
+                        aggregates_interval=aggregates_interval or None)
+    reader.filter_tweets(list(track))
+
+
+@twitter_cli.command('bench')
+@click.option('-i', '--input', 'input_file', default=None, type=click.Path(exists=True, dir_okay=False), help='Recorded stream file (a raw message per line). A synthetic stream is generated if omitted')
+@click.option('-n', '--messages', default=100000, help='Number of lines in the synthetic stream (default 100000)')
+@click.option('--control_ratio', default=0.1, help='Share of control messages in the synthetic stream (default 0.1)')
+@click.option('--duplicate_ratio', default=0.01, help='Share of duplicated tweets in the synthetic stream (default 0.01)')
+@click.option('--users', default=1000, help='Number of distinct users in the synthetic stream (default 1000)')
+@click.option('-r', '--rate', default=None, type=float, help='Replay rate in lines per second (default: unlimited)')
+@click.option('-T', '--time_limit', default=60, help='Maximum number of seconds of the run (default 60)')
+@click.option('-m', '--message_limit', default=None, type=int, help='Maximum number of tweets (default: all tweets of the stream)')
+@click.option('--engine', default='threads', type=click.Choice(TwitterAPI.ENGINES), help='Pipeline engine (default threads)')
+@click.option('--batch_size', default=None, type=int, help='Streamer to processor batch size (default: one by one)')
+@click.option('--decode_workers', default=0, help='Number of decode worker processes (default 0)')
+@click.option('--dedup', default='set', type=click.Choice(sorted(DEDUPLICATORS)), help='Deduplication backend (default set)')
+@click.option('--fast_parse', is_flag=True, default=False, help='Use the fast parsing path')
+@click.option('--sort_buffer', default=None, type=int, help='Maximum number of rows kept in memory during the export')
+@click.option('--delimited', is_flag=True, default=False, help='Read the length-delimited stream')
+@click.option('--input_queue_size', default=None, type=int, help='Maximum number of items in the input queue (default: unlimited)')
+@click.option('--overflow', default='block', type=click.Choice(list(OVERFLOW_POLICIES)), help='Input queue overflow policy (default block)')
+@click.option('--journal', 'journal_dir', default=None, type=click.Path(file_okay=False), help='Journal directory (default: no journal)')
+@click.option('--fsync', default='interval', type=click.Choice(FSYNC_POLICIES), help='Journal sync policy (default interval)')
+@click.option('--profile', 'profile_dir', default=None, type=click.Path(file_okay=False), help='Directory of the per-thread profiles (default: no profiling)')
+@click.option('--trace_memory', 'trace_memory_dir', default=None, type=click.Path(file_okay=False), help='Directory of the memory snapshots taken when the export starts (default: no tracing)')
+@click.option('--retweet_ratio', default=0.0, help='Share of retweets (of a few popular tweets) in the synthetic stream (default 0)')
+@click.option('--quote_ratio', default=0.0, help='Share of quotes in the synthetic stream (default 0)')
+@click.option('--collapse', default=None, type=click.Choice(COLLAPSE_MODES), help='Collapse the retweets and quotes (default: no collapsing)')
+@click.option('--aggregates', default=None, type=click.Choice(list(HEAVY_HITTERS)), help='Aggregate the top users, hashtags and mentions with that top-k counter (default: no aggregates)')
+def bench(aggregates, collapse, quote_ratio, retweet_ratio, trace_memory_dir, profile_dir, fsync, journal_dir, overflow, input_queue_size, delimited, sort_buffer, fast_parse, dedup, decode_workers, batch_size, engine, message_limit, time_limit, rate,
+          users, duplicate_ratio, control_ratio, messages, input_file):
+    """
+    Measure the pipeline throughput replaying a stream from a local stand-in of the stream endpoint
+    """
+    if input_file:
+        lines = load_stream(input_file)
+    else:
+        lines = generate_stream(messages, control_ratio=control_ratio, duplicate_ratio=duplicate_ratio, users=users,
+                                retweet_ratio=retweet_ratio, quote_ratio=quote_ratio)
+    logger.info('Replaying %s lines', len(lines))
+
+    report = run_benchmark(
+        lines, rate=rate, time_limit=time_limit, message_limit=message_limit, engine=engine, batch_size=batch_size,
+        decode_workers=decode_workers, dedup=dedup, fast_parse=fast_parse, sort_buffer_size=sort_buffer,
+        delimited=delimited, input_queue_size=input_queue_size, overflow_policy=overflow, journal_dir=journal_dir,
+        fsync=fsync, profile_dir=profile_dir, trace_memory_dir=trace_memory_dir, collapse=collapse,
+        aggregates=aggregates,
+    )
+
+    def _format(value, scale=1, unit=''):
+        return 'n/a' if value is None else f'{value * scale:.2f}{unit}'
+
+    click.echo(f"Messages accepted:   {report['messages']} of {report['lines']} lines")
+    click.echo(f"Throughput:          {_format(report['messages_per_second'], unit=' msg/s')}")
+    click.echo(f"Latency p50/p90/p99: {_format(report['latency_p50'], 1000, ' ms')} / "
+               f"{_format(report['latency_p90'], 1000, ' ms')} / {_format(report['latency_p99'], 1000, ' ms')}")
+    click.echo(f"Export time:         {_format(report['export_seconds'], unit=' s')}")
+    click.echo(f"Total time:          {_format(report['total_seconds'], unit=' s')}")
+    click.echo(f"Peak RSS:            {_format(report['peak_rss_bytes'], 1 / 2 ** 20, ' MiB')}")
+    click.echo(f"Output size:         {_format(report['output_bytes'], 1 / 2 ** 20, ' MiB')}")
+    if collapse:
+        metrics = report['metrics']
+        click.echo(f"Shared retweets:     {metrics.get('collapsed_retweets_total', 0)} "
+                   f"({_format(metrics.get('collapsed_text_bytes_total', 0), 1 / 2 ** 20, ' MiB')} of text)")
+        if collapse == 'normalize':
+            click.echo(f"Left out of output:  "
+                       f"{_format(metrics.get('normalized_text_bytes_total', 0), 1 / 2 ** 20, ' MiB')}")
+    if input_queue_size:
+        click.echo(f"Dropped/spilled:     {report['metrics'].get('input_dropped_total', 0)} / "
+                   f"{report['metrics'].get('input_spilled_total', 0)}")
+
+
+@twitter_cli.command('bench-writers')
+@click.option('-n', '--rows', default=100000, help='Number of synthetic rows (default 100000)')
+@click.option('--format', 'formats', multiple=True, type=click.Choice(list(WRITERS)), help='Output format to measure, may be repeated (default: all formats)')
+@click.option('--repeat', default=3, help='Number of runs per format, the best one is reported (default 3)')
+def bench_writers(repeat, formats, rows):
+    """
+    Measure the export time and the output size of the output formats against the legacy TSV export
+    """
+    report = run_writer_benchmark(generate_rows(rows), formats, repeat)
+    for name, result in report.items():
+        click.echo(f"{name:<12} {result['seconds']:8.3f} s {result['rows_per_second']:12.0f} rows/s "
+                   f"{result['size'] / 2 ** 20:10.2f} MiB")
+
+
+@twitter_cli.command('bench-transport')
+@click.option('-n', '--messages', default=100000, help='Number of synthetic lines (default 100000)')
+@click.option('--ring_buffer_size', default=RING_BUFFER_SIZE, help=f'Size of the shared memory ring buffer in bytes (default {RING_BUFFER_SIZE})')
+@click.option('--repeat', default=3, help='Number of runs per transport, the best one is reported (default 3)')
+def bench_transport(repeat, ring_buffer_size, messages):
+    """
+    Measure the hand-over of raw lines to a child process: multiprocessing.Queue against the shared memory ring buffer
+    """
+    report = run_transport_benchmark(generate_stream(messages), ring_buffer_size, repeat)
+    for name, result in report.items():
+        click.echo(f"{name:<8} {result['seconds']:8.3f} s {result['lines_per_second']:12.0f} lines/s")
+
+
+@twitter_cli.command('bench-framing')
+@click.option('-i', '--input', 'input_file', default=None, type=click.Path(exists=True, dir_okay=False), help='Recorded stream file (a raw message per line). A synthetic stream is generated if omitted')
+@click.option('-n', '--messages', default=100000, help='Number of lines in the synthetic stream (default 100000)')
+@click.option('--repeat', default=3, help='Number of runs per framing, the best one is reported (default 3)')
+def bench_framing(repeat, messages, input_file):
+    """
+    Measure the splitting of a captured stream into messages: newline search (iter_lines) against the length-delimited framing
+    """
+    lines = load_stream(input_file) if input_file else generate_stream(messages)
+    report = run_framing_benchmark(lines, repeat)
+    for name, result in report.items():
+        click.echo(f"{name:<16} {result['seconds']:8.3f} s {result['lines_per_second']:12.0f} lines/s")
+
+
+@twitter_cli.command('bench-matcher')
+@click.option('-i', '--input', 'input_file', default=None, type=click.Path(exists=True, dir_okay=False), help='Recorded stream file (a raw message per line). A synthetic stream is generated if omitted')
+@click.option('-n', '--messages', default=100000, help='Number of lines in the synthetic stream (default 100000)')
+@click.option('-t', '--track', multiple=True, help='A comma-separated list of phrases to match, may be repeated. Synthetic phrases are generated if omitted')
+@click.option('-p', '--phrases', default=400, help='Number of the synthetic phrases (default 400)')
+@click.option('--repeat', default=3, help='Number of runs per matcher, the best one is reported (default 3)')
+def bench_matcher(repeat, phrases, track, messages, input_file):
+    """
+    Measure the matching of tweet texts against the track phrases: a substring check per phrase against the single-pass matcher
+    """
+    if input_file:
+        texts = [record.text for record in map(decode_message, load_stream(input_file)) if record]
+    else:
+        texts = [row[2] for row in generate_rows(messages)]
+    report = run_matcher_benchmark(texts, list(track) or generate_phrases(phrases), repeat)
+    for name, result in report.items():
+        click.echo(f"{name:<10} {result['seconds']:8.3f} s {result['tweets_per_second']:12.0f} tweets/s "
+                   f"{result['matched']:10} matched")
+
+
+@twitter_cli.command('bench-aggregates')
+@click.option('-n', '--items', default=1000000, help='Number of synthetic items (default 1000000)')
+@click.option('--distinct', default=100000, help='Number of distinct items (default 100000)')
+@click.option('--skew', default=1.1, help='Zipf exponent of the item frequencies (default 1.1)')
+@click.option('--size', default=1000, help='Number of the items monitored by the top-k counters (default 1000)')
+@click.option('--top', default=100, help='Number of the top items compared (default 100)')
+def bench_aggregates(top, size, skew, distinct, items):
+    """
+    Measure the top-k counters (Space-Saving, Count-Min) against an exact count: the time, the memory and the accuracy of the top items
+    """
+    report = run_aggregates_benchmark(generate_items(items, distinct, skew), size, top)
+    for name, result in report.items():
+        click.echo(f"{name:<14} {result['seconds']:8.3f} s {result['items_per_second']:12.0f} items/s "
+                   f"{result['memory'] / 2 ** 20:8.2f} MiB  recall {result['recall']:.3f}  "
+                   f"max error {result['max_error']:.4f}")
+
+
+@twitter_cli.command('query')
+@click.argument('filename', type=click.Path(exists=True, dir_okay=False))
+@click.option('-u', '--user_id', 'user_ids', multiple=True, help='User ID to output the tweets of, may be repeated')
+@click.option('--from_epoch', default=None, type=int, help='Output the tweets of the users created at or after that date (epoch)')
+@click.option('--to_epoch', default=None, type=int, help='Output the tweets of the users created at or before that date (epoch)')
+@click.option('--no_header', is_flag=True, default=False, help='Do not output the TSV header')
+def query(no_header, to_epoch, from_epoch, user_ids, filename):
+    """
+    Output the rows of an exported file (written with --index) by user IDs and/or a range of the user creation dates
+    """
+    try:
+        index = OutputIndex(filename)
+    except (OSError, ValueError) as exc:
+        logger.error('Can not open the index of "%s": %s. Export the file with the --index option', filename, exc)
+        return
+
+    with index:
+        if user_ids:
+            ranges = []
+            for user_id in user_ids:
+                try:
+                    found = index.find_user(user_id)
+                except ValueError:
+                    logger.warning('User ID %s is not numeric', user_id)
+                    continue
+                if found is None:
+                    logger.warning('User %s is not in the file', user_id)
+                    continue
+                start, end, epoch = found
+                if (from_epoch is None or epoch >= from_epoch) and (to_epoch is None or epoch <= to_epoch):
+                    ranges.append((start, end))
+        else:
+            ranges = [index.epoch_range(from_epoch, to_epoch)]
+
+        output = click.get_binary_stream('stdout')
+        if not no_header:
+            output.write(index.header())
+        for start, end in ranges:
+            for chunk in index.read(start, end):
+                output.write(chunk)
 
 
 if __name__ == '__main__':